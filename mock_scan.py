@@ -2,7 +2,9 @@ from django.utils.timezone import now
 from datetime import timedelta
 import random
 
-from production.models import Lot, ScanRecord
+from production.ingest import rebuild_lot_counters
+from production.rollups import rebuild_rollups
+from production.models import Lot, Machine, ScanRecord, ScanRecordArchive
 
 
 def create_mock_scans_for_lot(lot, days=30):
@@ -15,6 +17,7 @@ def create_mock_scans_for_lot(lot, days=30):
 
     # ลบข้อมูลเดิมของ lot นี้ (กันข้อมูลซ้ำ/มั่ว)
     ScanRecord.objects.filter(lot=lot).delete()
+    ScanRecordArchive.objects.filter(lot=lot).delete()
 
     base = now()
     scans = []
@@ -40,7 +43,7 @@ def create_mock_scans_for_lot(lot, days=30):
         scans.append(
             ScanRecord(
                 lot=lot,
-                machine_no=lot.machine_no or "MC-01",
+                machine=lot.machine or Machine.for_machine_no("MC-01"),
                 qty=qty,
                 scanned_at=day.replace(
                     hour=random.randint(7, 21),
@@ -52,7 +55,11 @@ def create_mock_scans_for_lot(lot, days=30):
         )
 
     # สร้างทีเดียวรวดเดียว
+    for scan in scans:
+        scan.set_local_time()  # bulk_create ไม่เรียก save()
     ScanRecord.objects.bulk_create(scans)
+    rebuild_lot_counters([lot.id])  # ยอดสะสม produced_qty / scan_count
+    rebuild_rollups([lot.id])  # rollup สำหรับกราฟ / Productivity
 
     # อัปเดต first_scan / last_scan ของ Lot
     first = lot.scans.order_by("scanned_at").first()
@@ -1,7 +1,9 @@
 # mock_scan_all.py
 from django.utils.timezone import now
 from datetime import timedelta
-from production.models import Lot, ScanRecord
+from production.ingest import rebuild_lot_counters
+from production.rollups import rebuild_rollups
+from production.models import Lot, Machine, ScanRecord, ScanRecordArchive
 import random
 
 
@@ -17,6 +19,7 @@ def create_mock_scans_for_all(days=30):
 
         # ลบ log เดิมของ lot นั้นก่อน
         ScanRecord.objects.filter(lot=lot).delete()
+        ScanRecordArchive.objects.filter(lot=lot).delete()
 
         scans = []
 
@@ -36,13 +39,17 @@ def create_mock_scans_for_all(days=30):
             scans.append(
                 ScanRecord(
                     lot=lot,
-                    machine_no=lot.machine_no or "MC-01",
+                    machine=lot.machine or Machine.for_machine_no("MC-01"),
                     qty=qty,
                     scanned_at=scanned_at,
                 )
             )
 
+        for scan in scans:
+            scan.set_local_time()  # bulk_create ไม่เรียก save()
         ScanRecord.objects.bulk_create(scans)
+        rebuild_lot_counters([lot.id])  # ยอดสะสม produced_qty / scan_count
+        rebuild_rollups([lot.id])  # rollup สำหรับกราฟ / Productivity
 
         # อัปเดต first_scan / last_scan ของ Lot
         first = lot.scans.order_by("scanned_at").first()
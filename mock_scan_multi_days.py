@@ -3,7 +3,9 @@ from datetime import timedelta
 import random
 
 from django.utils.timezone import now
-from production.models import Lot, ScanRecord
+from production.ingest import rebuild_lot_counters
+from production.rollups import rebuild_rollups
+from production.models import Lot, Machine, ScanRecord, ScanRecordArchive
 
 
 def run(lot_no="L002", days=20):
@@ -22,6 +24,7 @@ def run(lot_no="L002", days=20):
 
     # ลบข้อมูลเก่าก่อน กันข้อมูลซ้อน
     ScanRecord.objects.filter(lot=lot).delete()
+    ScanRecordArchive.objects.filter(lot=lot).delete()
 
     base_dt = now()              # วันที่/เวลา ณ ปัจจุบัน (timezone ถูกต้อง)
 
@@ -47,14 +50,18 @@ def run(lot_no="L002", days=20):
             scans.append(
                 ScanRecord(
                     lot=lot,
-                    machine_no=lot.machine_no or "MC-01",
+                    machine=lot.machine or Machine.for_machine_no("MC-01"),
                     qty=qty,
                     scanned_at=scanned_at,
                 )
             )
 
     # บันทึกทีเดียว
+    for scan in scans:
+        scan.set_local_time()  # bulk_create ไม่เรียก save()
     ScanRecord.objects.bulk_create(scans)
+    rebuild_lot_counters([lot.id])  # ยอดสะสม produced_qty / scan_count
+    rebuild_rollups([lot.id])  # rollup สำหรับกราฟ / Productivity
 
     # อัปเดต first_scan / last_scan ให้ Lot
     first = lot.scans.order_by("scanned_at").first()
@@ -1,9 +1,73 @@
-from django.contrib import admin
-from .models import Lot, ScanRecord, Department, UserProfile
+from django.contrib import admin, messages
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.http import QueryDict
+from .db_router import shard_aliases, use_shard
+from .device_auth import issue_token
+from .models import Lot, ScanRecord, Department, UserProfile, Device
+
+
+# ---------- Lot / Scan แยก database ตามแผนก (db_router.ShardRouter) ----------
+# เลือก shard จากตัวกรองด้านขวาของหน้า list (?shard=...) ค่านี้ติดไปกับลิงก์หน้าแก้ไข / ลบ
+# (_changelist_filters) -> query ทั้ง view รันใน use_shard() ของ shard นั้น (id ซ้ำกันข้าม shard ได้)
+SHARD_PARAM = "shard"
+
+
+def _request_shard(request):
+    alias = request.GET.get(SHARD_PARAM)
+    if alias is None:
+        alias = QueryDict(request.GET.get("_changelist_filters", "")).get(SHARD_PARAM)
+    return alias if alias in shard_aliases() else DEFAULT_DB_ALIAS
+
+
+class ShardListFilter(admin.SimpleListFilter):
+    title = "database (shard)"
+    parameter_name = SHARD_PARAM
+
+    def lookups(self, request, model_admin):
+        # ไม่ได้แยก shard = ไม่มีตัวเลือก (ตัวกรองไม่แสดง)
+        return [(alias, alias) for alias in shard_aliases()]
+
+    def choices(self, changelist):
+        yield {
+            "selected": self.value() is None,
+            "query_string": changelist.get_query_string(remove=[self.parameter_name]),
+            "display": DEFAULT_DB_ALIAS,
+        }
+        for lookup, title in self.lookup_choices:
+            yield {
+                "selected": self.value() == lookup,
+                "query_string": changelist.get_query_string({self.parameter_name: lookup}),
+                "display": title,
+            }
+
+    def queryset(self, request, queryset):
+        # เลือก database ที่ ShardAdminMixin แล้ว ไม่ต้อง filter เพิ่ม
+        return queryset
+
+
+class ShardAdminMixin:
+    """หน้า list / แก้ไข / ลบ / ประวัติ อ่านเขียน shard ที่เลือกไว้ (หน้าเพิ่มใหม่ให้ router เลือกตามแผนก)"""
+
+    def changelist_view(self, request, extra_context=None):
+        with use_shard(_request_shard(request)):
+            return super().changelist_view(request, extra_context)
+
+    def change_view(self, request, object_id, form_url="", extra_context=None):
+        with use_shard(_request_shard(request)):
+            return super().change_view(request, object_id, form_url, extra_context)
+
+    def delete_view(self, request, object_id, extra_context=None):
+        with use_shard(_request_shard(request)):
+            return super().delete_view(request, object_id, extra_context)
+
+    def history_view(self, request, object_id, extra_context=None):
+        with use_shard(_request_shard(request)):
+            return super().history_view(request, object_id, extra_context)
 
 
 @admin.register(Lot)
-class LotAdmin(admin.ModelAdmin):
+class LotAdmin(ShardAdminMixin, admin.ModelAdmin):
     # ตัด target / first_scan / last_scan ออกก่อน ให้ system check ผ่าน
     list_display = (
         "lot_no",
@@ -14,14 +78,28 @@ class LotAdmin(admin.ModelAdmin):
         "type",
     )
     search_fields = ("lot_no", "part_no", "customer", "machine_no")
-    list_filter = ("department", "machine_no", "type")
+    list_filter = (ShardListFilter, "department", "machine_no", "type")
 
 
 @admin.register(ScanRecord)
-class ScanRecordAdmin(admin.ModelAdmin):
+class ScanRecordAdmin(ShardAdminMixin, admin.ModelAdmin):
     list_display = ("lot", "machine_no", "qty", "scanned_at")
-    list_filter = ("machine_no", "scanned_at")
-    search_fields = ("lot__lot_no",)
+    list_filter = (ShardListFilter, "machine", "scanned_at")
+    # ScanRecord อาจอยู่คนละ database กับ Lot / Machine (db_router.ScanStoreRouter)
+    # -> ไม่ใช้ select_related / search ผ่าน lot__lot_no แต่ prefetch และค้นด้วย lot_id แทน
+    #    (Lot ที่ค้นอยู่ shard เดียวกับ scan ที่เลือกไว้ใน ShardListFilter)
+    list_select_related = ()
+    search_fields = ("sticker_unique_id",)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related("lot", "machine")
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        lot_ids = list(Lot.objects.filter(lot_no__icontains=term).values_list("id", flat=True)[:1000])
+        return queryset.filter(Q(sticker_unique_id__icontains=term) | Q(lot_id__in=lot_ids)), False
 
 
 @admin.register(Department)
@@ -35,3 +113,19 @@ class UserProfileAdmin(admin.ModelAdmin):
     list_display = ("user", "role", "department")
     list_filter = ("role", "department")
     search_fields = ("user__username",)
+
+
+@admin.register(Device)
+class DeviceAdmin(admin.ModelAdmin):
+    list_display = ("name", "machine_no", "is_active", "token_issued_at")
+    list_filter = ("is_active",)
+    search_fields = ("name", "machine_no")
+    readonly_fields = ("token_version", "token_issued_at", "created_at")
+    actions = ["issue_new_token"]
+
+    @admin.action(description="ออก token ใหม่ (token เก่าใช้ไม่ได้ทันที)")
+    def issue_new_token(self, request, queryset):
+        # token ไม่ได้เก็บไว้ใน DB -> แสดงครั้งเดียวตอนออก ให้คัดลอกไปตั้งที่เครื่อง
+        for device in queryset:
+            token = issue_token(device)
+            messages.success(request, f"{device.name}: {token}")
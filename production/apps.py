@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class AccConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "production"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import signals  # noqa: F401  (ผูก signal ล้าง cache ของ Lot)
+        from .sqlite_tuning import apply_sqlite_pragmas
+
+        connection_created.connect(apply_sqlite_pragmas, dispatch_uid="production.sqlite_pragmas")
@@ -0,0 +1,135 @@
+# production/archive.py
+# ย้าย ScanRecord ของ Lot ที่จบไปนานแล้วไปเก็บใน ScanRecordArchive (manage.py archive_scans)
+#
+# - ตาราง ScanRecord (+ index ทั้ง 4 ตัว) เหลือแค่ scan ของ Lot ที่ยังเดิน / เพิ่งจบ
+# - ยอดสะสมใน Lot และ rollup (ScanHourly / MachineDaily) ไม่เปลี่ยน เพราะนับ scan ไว้แล้วตอนบันทึก
+# - หน้า lot_detail อ่านตาราง archive เพิ่มเฉพาะ Lot ที่ has_archived_scans
+#   ingest (เช็ค sticker ซ้ำ) เช็คตาราง archive ทุกครั้ง ไม่ต้องรอ cache ของ process อื่นหมดอายุ
+# - ย้ายทีละ batch ต่อ transaction (INSERT archive + DELETE ScanRecord)
+#   ไม่ถือ write lock นาน เครื่องสแกนบันทึกแทรกได้ระหว่างรัน
+# - ScanRecord / ScanRecordArchive อยู่ database เดียวกัน (scan_db) ส่วน Lot อาจอยู่อีก database
+#   -> เลือก Lot ด้วย id ไม่ใช้ subquery ข้ามตาราง
+
+from datetime import date, datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .db_router import scan_db
+from .lot_cache import lot_cache
+from .models import Lot, ScanRecord, ScanRecordArchive
+
+
+ARCHIVE_FIELDS = (
+    "id",
+    "lot_id",
+    "machine_id",
+    "qty",
+    "scanned_at",
+    "scan_date",
+    "scan_hour",
+    "sticker_unique_id",
+)
+
+
+def archive_cutoff(months, today=None):
+    """วันแรกของเดือนที่ย้อนหลังไป months เดือน (ตัดเป็นรายเดือน รันซ้ำในเดือนเดียวกันได้ผลเท่าเดิม)"""
+    today = today or timezone.localdate()
+    month_index = today.year * 12 + (today.month - 1) - months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _chunks(ids, size=500):
+    """แบ่ง id เป็นชุด ๆ (จำนวน parameter ต่อ query ของ SQLite มีจำกัด)"""
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def cold_lots(cutoff):
+    """
+    Lot ที่จบแล้ว (กด END หรือยอดถึงเป้า) และไม่มี scan ใหม่ตั้งแต่ cutoff
+    ที่ยังมี scan เหลืออยู่ในตาราง ScanRecord (list ของ Lot เฉพาะ id / lot_no เรียงตาม id)
+    """
+    start = timezone.make_aware(datetime.combine(cutoff, datetime.min.time()))
+    finished = Q(end_time__lt=start) | Q(target__gt=0, produced_qty__gte=F("target"))
+    candidates = dict(
+        Lot.objects.filter(finished, last_scan__lt=start).values_list("id", "lot_no")
+    )
+    with_scans = set()
+    for ids in _chunks(sorted(candidates)):
+        with_scans.update(
+            ScanRecord.objects.filter(lot_id__in=ids)
+            .order_by()
+            .values_list("lot_id", flat=True)
+            .distinct()
+        )
+    return [Lot(id=lot_id, lot_no=candidates[lot_id]) for lot_id in sorted(with_scans)]
+
+
+def archive_lot(lot, batch_size=None):
+    """
+    ย้าย scan ทั้งหมดของ Lot นี้ไป ScanRecordArchive ทีละ batch_size แถว
+    คืนค่าจำนวน scan ที่ย้าย
+    """
+    batch_size = batch_size or getattr(settings, "SCAN_ARCHIVE_BATCH_SIZE", 2000)
+    db = scan_db()
+    # ตั้ง flag ก่อนย้าย batch แรก: lot_detail เริ่มดู archive ด้วย
+    # (Lot อาจอยู่คนละ database กับ scan จึงไม่ได้อยู่ใน transaction เดียวกัน)
+    Lot.objects.filter(pk=lot.id, has_archived_scans=False).update(has_archived_scans=True)
+    moved = 0
+    while True:
+        with transaction.atomic(using=db):
+            rows = list(
+                ScanRecord.objects.filter(lot_id=lot.id)
+                .order_by("id")
+                .values(*ARCHIVE_FIELDS)[:batch_size]
+            )
+            if not rows:
+                break
+            ScanRecordArchive.objects.bulk_create(
+                ScanRecordArchive(**row) for row in rows
+            )
+            ScanRecord.objects.filter(id__in=[row["id"] for row in rows]).delete()
+        moved += len(rows)
+
+    if moved:
+        # update() ไม่ส่ง signal -> ล้าง cache เอง (process อื่นหมดอายุตาม LOT_CACHE_TTL
+        # ระหว่างนั้น ingest ยังกันซ้ำได้ เพราะเช็คตาราง archive เองไม่ได้อ่าน flag จาก cache)
+        lot_cache.invalidate(lot_no=lot.lot_no, lot_id=lot.id)
+    return moved
+
+
+def archive_scans(months=None, batch_size=None, dry_run=False):
+    """
+    ย้าย scan ของทุก Lot ที่จบแล้วและไม่มี scan ใหม่มา months เดือน
+    คืนค่า (จำนวน Lot, จำนวน scan) ที่ย้าย (dry_run = นับอย่างเดียว)
+    """
+    if months is None:
+        months = getattr(settings, "SCAN_ARCHIVE_MONTHS", 6)
+    lots = cold_lots(archive_cutoff(months))
+
+    if dry_run:
+        lot_ids = [lot.id for lot in lots]
+        scans = sum(ScanRecord.objects.filter(lot_id__in=ids).count() for ids in _chunks(lot_ids))
+        return len(lot_ids), scans
+
+    lot_count = scan_count = 0
+    for lot in lots:
+        moved = archive_lot(lot, batch_size)
+        if moved:
+            lot_count += 1
+            scan_count += moved
+    return lot_count, scan_count
+
+
+def scans_of_lot(lot):
+    """
+    querysets ของ scan ทั้งหมดของ Lot (ScanRecord และ ScanRecordArchive ถ้ามี)
+    แถวของทั้งสองตารางมี machine / qty / scanned_at / machine_no เหมือนกัน
+    """
+    querysets = [ScanRecord.objects.filter(lot=lot)]
+    if lot.has_archived_scans:
+        querysets.append(ScanRecordArchive.objects.filter(lot=lot))
+    return querysets
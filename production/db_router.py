@@ -0,0 +1,267 @@
+# production/db_router.py
+# ส่ง query อ่านของหน้า dashboard / รายงานไปที่ database "replica" ส่วนการเขียนทั้งหมดอยู่ที่ "default"
+#
+# - view ที่อ่านอย่างเดียว (dashboard / productivity / OEE daily / export) ครอบด้วย @read_from_replica
+#   query ของ view อื่น ๆ (ingest, OEE operator, admin ฯลฯ) ยังอ่าน default เหมือนเดิม
+# - "read your own writes": view ที่เขียน (เช่น oee_do_action) ครอบด้วย @pin_primary
+#   -> ตั้ง cookie ให้ browser นั้นอ่านจาก default ต่ออีก REPLICA_PIN_SECONDS วินาที (replica ยังตามไม่ทัน)
+# - ไม่ได้ตั้ง DATABASES["replica"] (ค่า default) = อ่าน default ทั้งหมด ไม่ต้องแก้ view
+# - scans / shard_N มี replica ของตัวเองได้ (DATABASES["<alias>_replica"], SQLite snapshot)
+#   อ่านภายใน use_replica() ไปที่ replica นั้นแทน ไม่ได้ตั้ง = อ่านจากตัวจริง
+#
+# replica:
+#   PostgreSQL : REPLICA_DATABASE_URL ชี้ไปที่ streaming replica
+#   SQLite     : SQLITE_REPLICA=1 -> ไฟล์ snapshot (เปิดแบบ read-only) ที่ manage.py refresh_replica สร้าง/อัปเดต
+#
+# ScanStoreRouter: ตารางที่เขียนตลอดเวลา (SCAN_STORE_MODELS) อยู่ใน database "scans" ถ้าตั้งไว้
+# - อ่าน / เขียน / migrate ของตารางกลุ่มนี้ไปที่ "scans" (อ่านผ่าน "scans_replica" เฉพาะถ้าตั้งไว้)
+# - FK จากตารางกลุ่มนี้ไป Lot / Machine / Department เป็น db_constraint=False
+#   query ห้าม join ข้าม database: filter ด้วย lot_id__in / machine_id แทน lot__... / machine__...
+#   ลบ Lot / Machine / Department แล้วจัดการแถวที่อ้างอิงใน signals.py
+# - transaction ของการบันทึก scan ใช้ transaction.atomic(using=scan_db())
+#
+# ShardRouter: แยก database ตามแผนก (settings.DEPARTMENT_SHARDS, แผนกไหนอยู่ shard ไหนดู shards.py)
+# - Lot + SCAN_STORE_MODELS (SHARDED_MODELS) ของแผนกที่มี shard อยู่ใน database ของแผนกนั้น
+# - query ของกลุ่มนี้ไปที่ shard ปัจจุบันของ thread (use_shard) หรือ database เดียวกับ instance ที่อ้างถึง
+#   (lot.scans.all(), scan.lot ฯลฯ) นอกนั้นส่งต่อให้ router ถัดไป (= shard "default")
+# - หน้า Overall: fan_out() รันฟังก์ชันเดียวกันในทุก shard พร้อมกันด้วย thread แล้วรวมผลเอง
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, router
+
+
+REPLICA_DB = "replica"
+SCAN_DB = "scans"
+SCAN_STORE_MODELS = {
+    "scanrecord",
+    "scanrecordarchive",
+    "scanhourly",
+    "machinedaily",
+    "idempotencykey",
+    "downtimelog",
+}
+SHARDED_MODELS = {"lot"} | SCAN_STORE_MODELS
+PIN_COOKIE = "db_pin_primary"
+
+_state = threading.local()
+
+
+def replica_enabled():
+    return REPLICA_DB in settings.DATABASES
+
+
+@contextmanager
+def use_replica():
+    """query อ่านภายใน block นี้ไปที่ replica (ถ้ามีตั้งไว้)"""
+    previous = getattr(_state, "replica", False)
+    _state.replica = True
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def read_from_replica(view_func):
+    """view อ่านอย่างเดียว: อ่านจาก replica ยกเว้น browser ที่เพิ่งเขียน (มี cookie pin)"""
+
+    @wraps(view_func)
+    def _wrapped(request, *args, **kwargs):
+        if PIN_COOKIE in request.COOKIES:
+            return view_func(request, *args, **kwargs)
+        with use_replica():
+            return view_func(request, *args, **kwargs)
+
+    return _wrapped
+
+
+def pin_primary(view_func):
+    """view ที่เขียน: หลัง POST สำเร็จ ให้ browser นี้อ่านจาก default ต่ออีก REPLICA_PIN_SECONDS วินาที"""
+
+    @wraps(view_func)
+    def _wrapped(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+        if request.method == "POST" and replica_enabled() and response.status_code < 400:
+            response.set_cookie(
+                PIN_COOKIE,
+                "1",
+                max_age=getattr(settings, "REPLICA_PIN_SECONDS", 30),
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+    return _wrapped
+
+
+def replica_of(alias):
+    """
+    database ที่ใช้อ่านของ alias: ภายใน use_replica() และมี "<alias>_replica" = replica นั้น
+    (default ใช้ ReplicaRouter / "replica" อยู่แล้ว) ไม่งั้น = alias เดิม
+    """
+    if getattr(_state, "replica", False) and f"{alias}_replica" in settings.DATABASES:
+        return f"{alias}_replica"
+    return alias
+
+
+def shard_aliases():
+    """alias ของ database แยกตามแผนก (ไม่รวม default)"""
+    return list(dict.fromkeys(getattr(settings, "DEPARTMENT_SHARDS", {}).values()))
+
+
+@contextmanager
+def use_shard(alias):
+    """query ของ SHARDED_MODELS ภายใน block นี้ไปที่ shard alias (None / "default" = shard default)"""
+    previous = getattr(_state, "shard", None)
+    _state.shard = alias
+    try:
+        yield
+    finally:
+        _state.shard = previous
+
+
+def current_shard():
+    return getattr(_state, "shard", None) or DEFAULT_DB_ALIAS
+
+
+def fan_out(func, aliases):
+    """
+    เรียก func() ใน use_shard(alias) ของทุก alias คืนค่า list ผลลัพธ์ตามลำดับ aliases
+    - shard เดียว: รันใน thread ปัจจุบัน
+    - หลาย shard: รันพร้อมกันคนละ thread (SHARD_FANOUT_WORKERS) แผนกที่ช้าไม่ถ่วงแผนกอื่น
+      thread ใหม่ได้ connection ของตัวเอง ปิดทิ้งเมื่อจบงาน + ส่งสถานะ use_replica ต่อให้
+    """
+    aliases = list(aliases)
+    if len(aliases) <= 1:
+        with use_shard(aliases[0] if aliases else None):
+            return [func()]
+
+    replica = getattr(_state, "replica", False)
+
+    def run(alias):
+        _state.replica = replica
+        try:
+            with use_shard(alias):
+                return func()
+        finally:
+            connections.close_all()
+
+    workers = getattr(settings, "SHARD_FANOUT_WORKERS", 0) or len(aliases)
+    with ThreadPoolExecutor(max_workers=min(workers, len(aliases)), thread_name_prefix="shard") as pool:
+        return list(pool.map(run, aliases))
+
+
+def scan_db():
+    """alias ของ database ที่เก็บ ScanRecord ("scans" หรือ "default")"""
+    from .models import ScanRecord
+
+    return router.db_for_write(ScanRecord)
+
+
+class ShardRouter:
+    """SHARDED_MODELS -> shard ของ thread (use_shard) หรือ shard ของ instance ใน hints"""
+
+    def _shard(self, model, hints):
+        if model._meta.app_label != "production" or model._meta.model_name not in SHARDED_MODELS:
+            return None
+        shards = shard_aliases()
+        if not shards:
+            return None
+        alias = getattr(_state, "shard", None)
+        if alias is None:
+            instance = hints.get("instance")
+            alias = getattr(getattr(instance, "_state", None), "db", None)
+            if alias:
+                # instance ที่อ่านมาจาก replica ของ shard -> shard ตัวจริง
+                alias = alias.removesuffix("_replica")
+        return alias if alias in shards else None
+
+    def db_for_read(self, model, **hints):
+        alias = self._shard(model, hints)
+        return replica_of(alias) if alias else None
+
+    def db_for_write(self, model, **hints):
+        alias = self._shard(model, hints)
+        if alias is None and getattr(_state, "shard", None) is None:
+            instance = hints.get("instance")
+            if isinstance(instance, model) and model._meta.model_name == "lot" and instance._state.adding:
+                # Lot ใหม่: ไปที่ shard ของแผนก (dept ตั้งใน Lot.save ก่อนถึงตรงนี้)
+                from .shards import shard_for_department
+
+                alias = shard_for_department(instance.dept_id)
+                return alias if alias != DEFAULT_DB_ALIAS else None
+        return alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db not in shard_aliases():
+            return None
+        if app_label != "production":
+            return False
+        if model_name is None:
+            # RunPython ของ production: ตัวฟังก์ชันเช็คเองว่าตารางอยู่ database นี้หรือไม่
+            return True
+        return model_name in SHARDED_MODELS
+
+
+class ScanStoreRouter:
+    """ตารางใน SCAN_STORE_MODELS อยู่ที่ "scans" (ถ้าตั้งไว้) ตารางอื่นส่งต่อให้ router ถัดไป"""
+
+    def _is_scan_store(self, app_label, model_name):
+        return (
+            SCAN_DB in settings.DATABASES
+            and app_label == "production"
+            and model_name in SCAN_STORE_MODELS
+        )
+
+    def db_for_read(self, model, **hints):
+        if self._is_scan_store(model._meta.app_label, model._meta.model_name):
+            return replica_of(SCAN_DB)
+        return None
+
+    def db_for_write(self, model, **hints):
+        if self._is_scan_store(model._meta.app_label, model._meta.model_name):
+            return SCAN_DB
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if SCAN_DB not in settings.DATABASES:
+            return None
+        if model_name is None:
+            # RunPython ของ production รันทั้งสอง database ตัวฟังก์ชันเช็คเองว่าตารางอยู่ที่ไหน
+            if db == SCAN_DB:
+                return app_label == "production"
+            return None
+        if self._is_scan_store(app_label, model_name):
+            return db == SCAN_DB
+        if db == SCAN_DB:
+            return False
+        return None
+
+
+class ReplicaRouter:
+    """อ่าน = replica เฉพาะใน use_replica(), เขียน / migrate = default เสมอ"""
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, "replica", False) and replica_enabled():
+            return REPLICA_DB
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # ข้อมูลชุดเดียวกัน (replica เป็นสำเนาของ default)
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
@@ -0,0 +1,94 @@
+# production/device_auth.py
+# ยืนยันตัวตนเครื่องสแกน / kiosk ด้วย token แบบ signed (ไม่ใช้ session)
+#
+# - token = signing ของ {device id, token_version} ด้วย SECRET_KEY -> ตรวจได้โดยไม่ต้องค้น DB
+# - ส่งมาทาง header:  Authorization: Device <token>
+# - เช็คว่าเครื่องยังเปิดใช้ + version ตรง จาก cache ใน memory (หมดอายุตาม DEVICE_TOKEN_CACHE_TTL)
+#   ออก token ใหม่ / ปิดเครื่องใน admin -> token เก่าใช้ไม่ได้ (ทันทีใน process เดียวกัน)
+
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core import signing
+from django.utils import timezone
+
+from .models import Device
+
+
+TOKEN_SALT = "production.device_auth"
+AUTH_SCHEME = "device"
+
+
+def issue_token(device):
+    """ออก token ใหม่ให้สถานี (token เก่าของสถานีนี้ใช้ไม่ได้อีก)"""
+    device.token_version += 1
+    device.token_issued_at = timezone.now()
+    device.save(update_fields=["token_version", "token_issued_at"])
+    return signing.dumps({"d": device.pk, "v": device.token_version}, salt=TOKEN_SALT)
+
+
+def token_from_request(request):
+    """คืน token จาก header Authorization: Device <token> (ไม่มี = None)"""
+    header = request.headers.get("Authorization") or ""
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() != AUTH_SCHEME:
+        return None
+    return token.strip() or None
+
+
+# ---------- cache สถานะเครื่อง ----------
+
+_devices = {}  # device id -> (expires_at, Device | None)
+_lock = threading.Lock()
+
+
+def _get_device(device_id):
+    now = time.monotonic()
+    with _lock:
+        entry = _devices.get(device_id)
+    if entry and entry[0] > now:
+        return entry[1]
+
+    device = Device.objects.filter(pk=device_id, is_active=True).first()
+    ttl = getattr(settings, "DEVICE_TOKEN_CACHE_TTL", 60)
+    with _lock:
+        _devices[device_id] = (now + ttl, device)
+    return device
+
+
+def invalidate_device(device_id):
+    with _lock:
+        _devices.pop(device_id, None)
+
+
+def authenticate(token):
+    """ตรวจ token -> คืน Device หรือ None ถ้า token ไม่ถูกต้อง / ถูกยกเลิก"""
+    try:
+        data = signing.loads(token, salt=TOKEN_SALT)
+    except signing.BadSignature:
+        return None
+    if not isinstance(data, dict):
+        return None
+
+    device = _get_device(data.get("d"))
+    if device is None or device.token_version != data.get("v"):
+        return None
+    return device
+
+
+# ---------- decorator สำหรับ view ที่เครื่องสแกน / kiosk เรียก ----------
+
+def device_or_login_required(view_func):
+    """ผ่านได้ถ้าเป็นเครื่องที่มี Device token ถูกต้อง ไม่งั้นต้อง login แบบเดิม"""
+    login_view = login_required(view_func)
+
+    @wraps(view_func)
+    def _wrapped(request, *args, **kwargs):
+        if getattr(request, "device", None) is not None:
+            return view_func(request, *args, **kwargs)
+        return login_view(request, *args, **kwargs)
+
+    return _wrapped
@@ -0,0 +1,477 @@
+# production/ingest.py
+# logic กลางสำหรับบันทึก Scan (ใช้ร่วมกันระหว่าง api action=scan / scan_batch)
+
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, router, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .db_router import scan_db, use_shard
+from .lot_cache import lot_cache
+from .machine_cache import machine_cache
+from . import rollups
+from .models import IdempotencyKey, Lot, ScanRecord, ScanRecordArchive
+from .scan_metrics import metrics
+from .shards import all_shards
+
+
+MSG_LOT_NOT_FOUND = "ไม่พบ Lot นี้ในระบบ"
+DEFAULT_MACHINE_NO = "Unknown-Machine"
+
+
+class LotGone(Exception):
+    """
+    Lot ที่ได้มาจาก lot_cache ถูกลบไปแล้ว (_update_lot ไม่เจอแถว ไม่มี FK constraint กันไว้)
+    ให้ rollback ทั้ง batch แล้วบันทึกใหม่โดยตอบ lot_not_found ให้ scan ของ Lot นั้น
+    (แยกจาก IntegrityError ที่หมายถึง sticker / key ชนกัน)
+    """
+
+    def __init__(self, lot_id, db):
+        super().__init__(f"Lot id={lot_id} ไม่มีในระบบแล้ว ({db})")
+        self.lot_id = lot_id
+        self.db = db
+
+
+# ---------- Helper แปลงข้อมูลจากหน้าเว็บ / เครื่องสแกน ----------
+
+def parse_unique_id(qr_code):
+    """ดึง Unique ID (ช่องที่ 3) จาก QR รูปแบบ LotNo|Qty|UniqueID"""
+    if qr_code and "|" in qr_code:
+        parts = qr_code.split("|")
+        if len(parts) >= 3:
+            return parts[2].strip() or None
+    return None
+
+
+def parse_qty(value):
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _parse_scanned_at(value):
+    """รับเวลาสแกนจากฝั่ง client (ISO 8601) ถ้าไม่มี/อ่านไม่ได้ใช้เวลาปัจจุบัน"""
+    if not value:
+        return None
+    dt = parse_datetime(str(value))
+    if dt is None:
+        return None
+    if timezone.is_naive(dt):
+        dt = timezone.make_aware(dt)
+    return dt
+
+
+def clean_idempotency_key(value):
+    """key ยาวเกิน 64 ตัวอักษรจะเก็บเป็น sha256 แทน (ตารางเล็ก + index สั้น)"""
+    value = (value or "").strip()
+    if not value:
+        return None
+    if len(value) > 64:
+        return hashlib.sha256(value.encode("utf-8")).hexdigest()
+    return value
+
+
+def normalize_item(data, idempotency_key=None):
+    """
+    แปลงข้อมูล 1 scan (dict จาก POST หรือ JSON) ให้อยู่ในรูปแบบเดียวกัน
+    - ถ้าไม่ส่ง lot_no / qty มา จะแตกจาก qr_code (LotNo|Qty|UniqueID) ให้เอง
+    - idempotency_key: จาก header Idempotency-Key หรือ field idempotency_key
+    """
+    qr_code = (data.get("qr_code") or "").strip()
+    parts = qr_code.split("|") if qr_code else []
+
+    lot_no = (data.get("lot_no") or "").strip()
+    if not lot_no and parts:
+        lot_no = parts[0].strip()
+
+    qty = data.get("qty")
+    if qty in (None, "") and len(parts) >= 2:
+        qty = parts[1]
+
+    return {
+        "lot_no": lot_no,
+        "qty": parse_qty(qty),
+        "machine_no": (data.get("machine_no") or "").strip() or None,
+        "unique_id": parse_unique_id(qr_code),
+        "scanned_at": _parse_scanned_at(data.get("scanned_at")),
+        "idempotency_key": clean_idempotency_key(
+            idempotency_key or data.get("idempotency_key")
+        ),
+    }
+
+
+def duplicate_result(unique_id):
+    return {
+        "status": "error",
+        "code": "duplicate",
+        "message": f"ซ้ำ! เบอร์ {unique_id} รับไปแล้ว",
+    }
+
+
+def lot_not_found_result():
+    return {"status": "error", "code": "lot_not_found", "message": MSG_LOT_NOT_FOUND}
+
+
+# ---------- บันทึก Scan ----------
+
+def ingest_scans(items):
+    """
+    บันทึก scan หลายรายการในครั้งเดียว (items = list ของ dict จาก normalize_item)
+    - หา Lot จาก lot_cache (ถ้าไม่มีใน cache ค่อยดึงด้วย query เดียว)
+    - แปลงชื่อเครื่องเป็น Machine id ผ่าน machine_cache (ไม่สนตัวพิมพ์, ไม่มีใน Machine List = NULL)
+    - รายการที่มี Idempotency-Key ซึ่งเคยบันทึกแล้ว -> ตอบผลลัพธ์เดิม ไม่ insert ซ้ำ
+    - sticker ซ้ำตัดสินโดย unique index (lot, sticker_unique_id) ใน database
+      batch หลายรายการจะเช็คล่วงหน้าด้วย query เดียวเพื่อไม่ต้อง fallback บ่อย
+    - bulk_create ScanRecord (+ IdempotencyKey ใน transaction เดียวกัน)
+    - อัปเดตยอดสะสม + first_scan / last_scan ครั้งเดียวต่อ Lot
+      (แยก database scans: transaction ของ Lot ซ้อนอยู่ท้าย transaction ของ scan
+      commit ทีละ database ถ้าอันหลังล้มเหลวใช้ rebuild_lot_counters ซ่อมยอด)
+    คืนค่า list ของผลลัพธ์ เรียงตามลำดับ items
+    """
+    lot_nos = {it["lot_no"] for it in items if it["lot_no"]}
+    with metrics.timed("resolve_lot"):
+        lots = lot_cache.get_many(lot_nos)
+    results = _ingest_by_shard(items, lots)
+
+    metrics.count_results(results)
+    if any(it.get("idempotency_key") for it in items):
+        maybe_purge_idempotency_keys()
+    return results
+
+
+def _ingest_by_shard(items, lots):
+    """
+    แยก items ตาม shard ของ Lot (LotInfo.db) แล้วบันทึกทีละ shard (ไม่แยก shard = กลุ่มเดียว)
+    รายการที่ไม่พบ Lot ไปอยู่กลุ่ม default (ตอบ lot_not_found)
+    """
+    groups = {}
+    for i, it in enumerate(items):
+        lot = lots.get(it["lot_no"])
+        groups.setdefault(lot.db if lot else DEFAULT_DB_ALIAS, []).append(i)
+    if len(groups) <= 1:
+        with use_shard(next(iter(groups), None)):
+            return _ingest_shard(items, lots)
+
+    results = [None] * len(items)
+    for alias, indexes in groups.items():
+        with use_shard(alias):
+            for i, result in zip(indexes, _ingest_shard([items[i] for i in indexes], lots)):
+                results[i] = result
+    return results
+
+
+def _ingest_shard(items, lots):
+    """
+    _ingest ของ shard เดียว: Lot ใน cache ถูกลบไปแล้ว (LotGone, batch ถูก rollback)
+    -> เอา Lot นั้นออกจาก cache แล้วบันทึกใหม่ scan ของ Lot นั้นได้ lot_not_found
+    ลองใหม่เฉพาะ shard นี้ (shard อื่น commit ไปแล้ว ไม่บันทึกซ้ำ)
+    """
+    while True:
+        try:
+            return _ingest(items, lots)
+        except LotGone as gone:
+            metrics.incr("retry_stale_lot")
+            lot_cache.invalidate(lot_id=gone.lot_id)
+            lots = {
+                lot_no: lot
+                for lot_no, lot in lots.items()
+                if not (lot.id == gone.lot_id and lot.db == gone.db)
+            }
+
+
+def _ingest(items, lots):
+    results = [None] * len(items)
+    if not items:
+        return results
+
+    now = timezone.now()
+    dedup_started = time.perf_counter()
+
+    # 1) Idempotency-Key ที่เคยบันทึกไปแล้ว -> ตอบผลเดิม (query เดียว)
+    keys = {it["idempotency_key"] for it in items if it.get("idempotency_key")}
+    stored = {}
+    if keys:
+        stored = {
+            k.key: k
+            for k in IdempotencyKey.objects.filter(key__in=keys)
+        }
+        expired = [k.pk for k in stored.values() if k.expires_at <= now]
+        if expired:
+            IdempotencyKey.objects.filter(pk__in=expired).delete()
+            stored = {key: k for key, k in stored.items() if k.expires_at > now}
+
+    # 2) batch หลายรายการ: ดึง sticker ที่เคยรับไปแล้วมาเช็คก่อน (query เดียว)
+    #    ส่วน scan เดี่ยวไม่ต้องเช็คก่อน ให้ unique index ใน database ตัดสินเลย
+    unique_ids = {it["unique_id"] for it in items if it["unique_id"]}
+    seen = set()
+    if unique_ids and len(items) > 1:
+        seen = set(
+            ScanRecord.objects.filter(
+                lot_id__in=[l.id for l in lots.values()],
+                sticker_unique_id__in=unique_ids,
+            ).values_list("lot_id", "sticker_unique_id")
+        )
+
+    #    scan ที่ถูกย้ายไป archive แล้ว: unique index ของ ScanRecord ไม่ครอบคลุม
+    #    -> เช็คกับตาราง archive ทุก batch ที่มี sticker (1 query ผ่าน unique index (lot, sticker_unique_id))
+    #    ไม่อาศัย has_archived_scans ใน lot_cache: archive_scans (คนละ process) ล้าง cache ของ web ไม่ได้
+    lot_ids = [l.id for l in lots.values()]
+    if unique_ids and lot_ids:
+        seen.update(
+            ScanRecordArchive.objects.filter(
+                lot_id__in=lot_ids,
+                sticker_unique_id__in=unique_ids,
+            ).values_list("lot_id", "sticker_unique_id")
+        )
+
+    metrics.record("dedup", time.perf_counter() - dedup_started)
+
+    # ถ้าไม่ได้ระบุเครื่องมา -> ใช้เครื่อง Default ของ Lot นั้น
+    machine_names = {}
+    for i, it in enumerate(items):
+        lot = lots.get(it["lot_no"])
+        if lot is not None:
+            machine_names[i] = (
+                it["machine_no"] or (lot.machine_no or "").strip() or DEFAULT_MACHINE_NO
+            )
+    with metrics.timed("resolve_machine"):
+        machines = machine_cache.get_many(set(machine_names.values()))
+
+    # 3) เตรียม record ที่จะบันทึก
+    pending = []     # [(index ใน items, ScanRecord)]
+    key_first = {}   # idempotency key -> index แรกใน batch นี้
+    repeats = []     # [(index, index แรกที่ใช้ key เดียวกัน)]
+    for i, it in enumerate(items):
+        key = it.get("idempotency_key")
+        if key in stored:
+            results[i] = _replayed(stored[key].response)
+            continue
+        if key:
+            if key in key_first:
+                repeats.append((i, key_first[key]))
+                continue
+            key_first[key] = i
+
+        lot = lots.get(it["lot_no"])
+        if lot is None:
+            results[i] = lot_not_found_result()
+            continue
+
+        unique_id = it["unique_id"]
+        if unique_id:
+            if (lot.id, unique_id) in seen:
+                results[i] = duplicate_result(unique_id)
+                continue
+            seen.add((lot.id, unique_id))
+
+        # เครื่องที่ไม่มีใน Machine List -> machine = NULL (ตอบชื่อที่ส่งมาเหมือนเดิม)
+        machine_id, machine_no = machines.get(machine_names[i], (None, machine_names[i]))
+        rec = ScanRecord(
+            lot_id=lot.id,
+            machine_id=machine_id,
+            qty=it["qty"],
+            scanned_at=it["scanned_at"] or now,
+            sticker_unique_id=unique_id,
+        )
+        rec.set_local_time()  # bulk_create ไม่เรียก save()
+        pending.append((i, rec))
+        results[i] = _success_result(it, rec, machine_no)
+
+    # 4) บันทึกทั้งหมด + Idempotency-Key + อัปเดต Lot + rollup ใน transaction เดียว
+    if pending:
+        try:
+            with transaction.atomic(using=scan_db()):
+                with metrics.timed("insert"):
+                    ScanRecord.objects.bulk_create([rec for _, rec in pending])
+                    IdempotencyKey.objects.bulk_create(
+                        _key_rows(items, results, [i for i, _ in pending], now)
+                    )
+                with metrics.timed("rollup"):
+                    rollups.add_scans([rec for _, rec in pending])
+                with metrics.timed("lot_update"):
+                    _update_lot_stats([rec for _, rec in pending])
+                commit_started = time.perf_counter()
+            metrics.record("commit", time.perf_counter() - commit_started)
+        except IntegrityError:
+            # มีเครื่องอื่นส่ง sticker / key เดียวกันเข้ามาพร้อมกัน (หรือเป็น scan เดี่ยวที่ซ้ำ)
+            # -> บันทึกทีละรายการ แยกตัวที่ซ้ำออกมา
+            metrics.incr("insert_fallback")
+            _insert_each(items, pending, results, now)
+
+    # key เดียวกันซ้ำใน batch เดียวกัน -> ใช้ผลของรายการแรก
+    for i, first in repeats:
+        results[i] = _replayed(results[first])
+    return results
+
+
+def _insert_each(items, pending, results, now):
+    """
+    บันทึกทีละรายการ (savepoint ต่อรายการ)
+    ตัวที่ชน unique index: ถ้าเป็น Idempotency-Key ตอบผลเดิม ไม่งั้นถือว่า sticker ซ้ำ
+    """
+    inserted = []
+    db = scan_db()
+    with transaction.atomic(using=db):
+        for i, rec in pending:
+            rec.pk = None
+            try:
+                with transaction.atomic(using=db):
+                    rec.save(force_insert=True)
+                    IdempotencyKey.objects.bulk_create(_key_rows(items, results, [i], now))
+            except IntegrityError:
+                key = items[i].get("idempotency_key")
+                original = key and IdempotencyKey.objects.filter(key=key).first()
+                if original:
+                    results[i] = _replayed(original.response)
+                else:
+                    results[i] = duplicate_result(rec.sticker_unique_id)
+                continue
+            inserted.append(rec)
+
+        if inserted:
+            rollups.add_scans(inserted)
+            _update_lot_stats(inserted)
+
+
+def _success_result(item, rec, machine_no):
+    return {
+        "status": "success",
+        "machine": machine_no,
+        "lot": item["lot_no"],
+        "qty": rec.qty,
+    }
+
+
+def _replayed(response):
+    return dict(response, replayed=True)
+
+
+def _key_rows(items, results, indexes, now):
+    expires_at = now + timedelta(seconds=getattr(settings, "IDEMPOTENCY_KEY_TTL", 86400))
+    return [
+        IdempotencyKey(
+            key=items[i]["idempotency_key"],
+            response=results[i],
+            expires_at=expires_at,
+        )
+        for i in indexes
+        if items[i].get("idempotency_key")
+    ]
+
+
+def ingest_scan(item):
+    """บันทึก scan รายการเดียว (ใช้กับ api action=scan)"""
+    return ingest_scans([item])[0]
+
+
+def _update_lot_stats(records):
+    """
+    อัปเดตยอดสะสม (produced_qty / scan_count) + first_scan / last_scan
+    ของแต่ละ Lot ครั้งเดียวต่อ batch (เรียกท้าย transaction ของ insert)
+    Lot อยู่ที่ default เสมอ: แยก database scans แล้วเป็น transaction ของ default ซ้อนอยู่ข้างใน
+    ไม่เจอ Lot (ถูกลบไปแล้ว ไม่มี FK constraint กันไว้) -> LotGone ให้ rollback ทั้ง batch
+    """
+    stats = {}
+    for rec in records:
+        qty, n, lo, hi = stats.get(rec.lot_id, (0, 0, rec.scanned_at, rec.scanned_at))
+        stats[rec.lot_id] = (
+            qty + (rec.qty or 0),
+            n + 1,
+            min(lo, rec.scanned_at),
+            max(hi, rec.scanned_at),
+        )
+
+    db = router.db_for_write(Lot)
+    # Lot อยู่ database เดียวกับ scan = อยู่ใน transaction ของ scan แล้วไม่ต้อง savepoint
+    # คนละ database: savepoint กัน LotGone ทำให้ transaction ของ default ที่ครอบอยู่ (ถ้ามี) ใช้ต่อไม่ได้
+    with transaction.atomic(using=db, savepoint=db != scan_db()):
+        for lot_id, (qty, n, first, last) in stats.items():
+            _update_lot(db, lot_id, qty, n, first, last)
+
+
+def _update_lot(db, lot_id, qty, n, first, last):
+    updated = Lot.objects.using(db).filter(pk=lot_id).update(
+            produced_qty=F("produced_qty") + qty,
+            scan_count=F("scan_count") + n,
+            first_scan=Case(
+                When(Q(first_scan__isnull=True) | Q(first_scan__gt=first), then=Value(first)),
+                default=F("first_scan"),
+            ),
+            last_scan=Case(
+                When(Q(last_scan__isnull=True) | Q(last_scan__lt=last), then=Value(last)),
+                default=F("last_scan"),
+            ),
+        )
+    if not updated:
+        raise LotGone(lot_id, db)
+
+
+# ---------- ซ่อม / คำนวณยอดสะสมใหม่ ----------
+
+def rebuild_lot_counters(lot_ids=None):
+    """
+    คำนวณ produced_qty / scan_count ของ Lot ใหม่จาก ScanRecord (+ ScanRecordArchive)
+    ใช้หลัง import / mock ข้อมูล หรือเมื่อมีการลบ scan ตรง ๆ ใน admin
+    lot_ids=None = ทุก Lot, คืนค่าจำนวน Lot ที่อัปเดต
+    (scan อาจอยู่คนละ database กับ Lot -> group ยอดต่อ lot_id ก่อน แล้วเขียนกลับด้วย bulk_update)
+    """
+    if lot_ids is not None:
+        lot_ids = list(lot_ids)
+
+    totals = {}
+    for model in (ScanRecord, ScanRecordArchive):
+        scans = model.objects.order_by().values("lot_id")
+        if lot_ids is not None:
+            scans = scans.filter(lot_id__in=lot_ids)
+        for row in scans.annotate(s=Sum("qty"), n=Count("id")):
+            qty, n = totals.get(row["lot_id"], (0, 0))
+            totals[row["lot_id"]] = (qty + (row["s"] or 0), n + row["n"])
+
+    qs = Lot.objects.only("id", "produced_qty", "scan_count")
+    if lot_ids is not None:
+        qs = qs.filter(pk__in=lot_ids)
+    lots = list(qs)
+    changed = []
+    for lot in lots:
+        qty, n = totals.get(lot.id, (0, 0))
+        if (lot.produced_qty, lot.scan_count) != (qty, n):
+            lot.produced_qty, lot.scan_count = qty, n
+            changed.append(lot)
+    Lot.objects.bulk_update(changed, ["produced_qty", "scan_count"], batch_size=500)
+    return len(lots)
+
+
+# ---------- ล้าง Idempotency-Key ที่หมดอายุ ----------
+
+_last_purge = 0.0
+
+
+def purge_idempotency_keys():
+    """
+    ลบ key ที่หมดอายุทั้งหมดด้วย DELETE เดียวต่อ shard คืนค่าจำนวนที่ลบ
+    (IdempotencyKey อยู่ shard เดียวกับ scan -> ต้องไล่ทุก shard ไม่ใช่แค่ default)
+    """
+    now = timezone.now()
+    deleted = 0
+    for alias in all_shards():
+        with use_shard(alias):
+            count, _ = IdempotencyKey.objects.filter(expires_at__lte=now).delete()
+        deleted += count
+    return deleted
+
+
+def maybe_purge_idempotency_keys():
+    """เรียกจาก ingest: ล้าง key หมดอายุไม่เกิน 1 ครั้งต่อ IDEMPOTENCY_PURGE_INTERVAL วินาที"""
+    global _last_purge
+    interval = getattr(settings, "IDEMPOTENCY_PURGE_INTERVAL", 600)
+    now = time.monotonic()
+    if now - _last_purge < interval:
+        return
+    _last_purge = now
+    purge_idempotency_keys()
@@ -0,0 +1,106 @@
+# production/lot_cache.py
+# Cache ขนาดจำกัด (LRU) สำหรับแปลง lot_no -> ข้อมูล Lot ที่ใช้ตอนบันทึก Scan
+#
+# - ทุก scan ต้องรู้แค่ id + เครื่อง default ของ Lot ไม่ต้องโหลดทั้งแถว (remark ฯลฯ)
+# - ล้างเมื่อ Lot ถูก save / delete (signals.py) และหลัง import Excel
+# - cache อยู่ใน memory ของแต่ละ process จึงมี TTL กำกับไว้ด้วย
+#   (กรณีแก้ Lot จาก process อื่น เช่น manage.py import_abest_excel)
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from .models import Lot
+from .shards import all_shards
+
+
+# db = alias ของ shard ที่ Lot นี้อยู่ (ดู shards.py) ingest บันทึก scan ลง shard เดียวกัน
+# ไม่เก็บ has_archived_scans: archive_scans รันคนละ process ล้าง cache นี้ไม่ได้
+# (ingest เช็คตาราง archive ผ่าน unique index เองทุกครั้ง)
+LotInfo = namedtuple("LotInfo", "id lot_no machine_no pieces_per_box target db")
+
+
+class LotCache:
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # lot_no -> (expires_at, LotInfo)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, lot_nos):
+        """คืน dict lot_no -> LotInfo (lot ที่ไม่มีในระบบจะไม่อยู่ใน dict)"""
+        found = {}
+        missing = []
+        now = time.monotonic()
+
+        with self._lock:
+            for lot_no in lot_nos:
+                entry = self._data.get(lot_no)
+                if entry and entry[0] > now:
+                    self._data.move_to_end(lot_no)
+                    found[lot_no] = entry[1]
+                else:
+                    missing.append(lot_no)
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        loaded = {}
+        for alias in all_shards():
+            remaining = [lot_no for lot_no in missing if lot_no not in loaded]
+            if not remaining:
+                break
+            rows = Lot.objects.using(alias).filter(lot_no__in=remaining).values_list(
+                "id", "lot_no", "machine_no", "pieces_per_box", "target"
+            )
+            loaded.update((row[1], LotInfo(*row, alias)) for row in rows)
+        if loaded:
+            found.update(loaded)
+            self._store(loaded)
+
+        return found
+
+    def get(self, lot_no):
+        return self.get_many([lot_no]).get(lot_no)
+
+    def _store(self, infos):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for lot_no, info in infos.items():
+                self._data[lot_no] = (expires_at, info)
+                self._data.move_to_end(lot_no)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, lot_no=None, lot_id=None):
+        """ลบ Lot ออกจาก cache (ระบุ lot_no หรือ id ก็ได้ เผื่อ lot_no ถูกแก้)"""
+        with self._lock:
+            if lot_no is not None:
+                self._data.pop(lot_no, None)
+            if lot_id is not None:
+                stale = [k for k, (_, info) in self._data.items() if info.id == lot_id]
+                for k in stale:
+                    del self._data[k]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+lot_cache = LotCache(
+    max_size=getattr(settings, "LOT_CACHE_SIZE", 1024),
+    ttl=getattr(settings, "LOT_CACHE_TTL", 300),
+)
@@ -0,0 +1,64 @@
+# production/machine_cache.py
+# แปลงชื่อเครื่อง (machine_no จาก QR / เครื่องสแกน / Lot) -> id ของ Machine
+#
+# - จับคู่ด้วย Machine.key (ตัดช่องว่าง + ตัวพิมพ์เล็ก) ครั้งเดียวตอนบันทึก Scan
+# - จับคู่ได้เฉพาะเครื่องใน Machine List (ไม่สร้างเครื่องใหม่จากชื่อที่ส่งมา)
+#   ชื่อที่ไม่มีในตาราง -> ไม่อยู่ในผลลัพธ์ (scan บันทึกเป็น machine = NULL)
+# - ตาราง Machine เล็กและแทบไม่เปลี่ยน จึง cache ไว้ทั้ง process (ล้างผ่าน signals.py)
+#   ชื่อที่ไม่พบ cache ไว้แค่ MISS_TTL วินาที (เผื่อเพิ่มเครื่องจาก process อื่น เช่น import Excel)
+
+import threading
+import time
+
+from .models import Machine
+
+
+class MachineCache:
+    MISS_TTL = 60
+
+    def __init__(self):
+        self._ids = {}     # key -> (id, machine_no)
+        self._misses = {}  # key -> expires_at ของชื่อที่ไม่มีในตาราง Machine
+        self._lock = threading.Lock()
+
+    def get_many(self, names):
+        """คืน dict ชื่อ -> (id, machine_no ที่บันทึกไว้) ชื่อที่ไม่มีใน Machine List จะไม่อยู่ใน dict"""
+        keys = {name: Machine.make_key(name) for name in names if Machine.make_key(name)}
+        now = time.monotonic()
+        with self._lock:
+            found = {k: self._ids[k] for k in set(keys.values()) if k in self._ids}
+            known_missing = {k for k in set(keys.values()) if self._misses.get(k, 0) > now}
+
+        missing = set(keys.values()) - set(found) - known_missing
+        if missing:
+            loaded = dict(
+                (key, (pk, no))
+                for pk, no, key in Machine.objects.filter(key__in=missing).values_list(
+                    "id", "machine_no", "key"
+                )
+            )
+            with self._lock:
+                self._ids.update(loaded)
+                for key in missing - set(loaded):
+                    self._misses[key] = now + self.MISS_TTL
+            found.update(loaded)
+
+        return {name: found[key] for name, key in keys.items() if key in found}
+
+    def get(self, name):
+        return self.get_many([name]).get(name)
+
+    def invalidate(self, machine_id, key=None):
+        with self._lock:
+            for k in [k for k, (pk, _) in self._ids.items() if pk == machine_id]:
+                del self._ids[k]
+            if key is not None:
+                self._misses.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._misses.clear()
+
+
+machine_cache = MachineCache()
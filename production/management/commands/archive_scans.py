@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from production.archive import archive_scans
+from production.db_router import use_shard
+from production.shards import all_shards
+
+
+class Command(BaseCommand):
+    help = (
+        "ย้าย ScanRecord ของ Lot ที่จบแล้วและไม่มี scan ใหม่มา N เดือน ไปตาราง ScanRecordArchive "
+        "(ตั้ง cron ไว้รันเดือนละครั้งได้ รันระหว่างเครื่องสแกนทำงานได้)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--months",
+            type=int,
+            default=getattr(settings, "SCAN_ARCHIVE_MONTHS", 6),
+            help="ย้าย Lot ที่ไม่มี scan ใหม่ตั้งแต่วันที่ 1 ของเดือนที่ย้อนไปกี่เดือน",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=getattr(settings, "SCAN_ARCHIVE_BATCH_SIZE", 2000),
+            help="จำนวน scan ต่อ 1 transaction",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="นับจำนวนที่จะย้ายอย่างเดียว ไม่ย้ายจริง",
+        )
+
+    def handle(self, *args, **options):
+        # ทำทีละ shard (แยก database ตามแผนก) ไม่แยก = default อย่างเดียว
+        lots = scans = 0
+        for alias in all_shards():
+            with use_shard(alias):
+                shard_lots, shard_scans = archive_scans(
+                    months=options["months"],
+                    batch_size=options["batch_size"],
+                    dry_run=options["dry_run"],
+                )
+            lots += shard_lots
+            scans += shard_scans
+        if options["dry_run"]:
+            self.stdout.write(f"จะย้าย {scans} scan จาก {lots} Lot")
+            return
+        self.stdout.write(self.style.SUCCESS(f"ย้ายแล้ว {scans} scan จาก {lots} Lot"))
@@ -0,0 +1,160 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from production import sqlite_maintenance as maintenance
+
+
+def _size(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "ดูแลไฟล์ SQLite: ANALYZE / PRAGMA optimize, incremental vacuum ทีละช่วง, "
+        "เช็ค integrity และรายงานขนาด table / index (รันระหว่างเครื่องสแกนทำงานได้)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            action="append",
+            default=None,
+            help="alias ของ database ที่จะดูแล (ใส่ซ้ำได้ เช่น --database scans --database shard_1) "
+            "default = ทุก database ที่เป็น SQLite (default / scans / shard_N)",
+        )
+        parser.add_argument(
+            "--analysis-limit",
+            type=int,
+            default=None,
+            help="จำนวนแถวที่ ANALYZE สุ่มต่อ index (0 = ทั้งหมด, default ตาม SQLITE_ANALYSIS_LIMIT)",
+        )
+        parser.add_argument(
+            "--vacuum-step",
+            type=int,
+            default=None,
+            help="page ที่คืนต่อ 1 transaction (default ตาม SQLITE_VACUUM_STEP_PAGES)",
+        )
+        parser.add_argument(
+            "--max-vacuum-pages",
+            type=int,
+            default=None,
+            help="คืนพื้นที่รวมไม่เกินกี่ page ต่อการรันครั้งนี้ (default = จนหมด)",
+        )
+        parser.add_argument(
+            "--full-check",
+            action="store_true",
+            help="ใช้ integrity_check แทน quick_check (ช้ากว่า เช็ค index ตรงกับ table ด้วย)",
+        )
+        parser.add_argument(
+            "--enable-incremental",
+            action="store_true",
+            help="เปลี่ยนไฟล์เดิมเป็น auto_vacuum=INCREMENTAL ด้วย VACUUM เต็มไฟล์ 1 ครั้ง "
+            "(ถือ lock ตลอด ให้รันตอนไม่มีการสแกน)",
+        )
+        parser.add_argument("--skip-analyze", action="store_true", help="ไม่รัน ANALYZE")
+        parser.add_argument("--skip-vacuum", action="store_true", help="ไม่รัน incremental vacuum")
+        parser.add_argument("--skip-check", action="store_true", help="ไม่เช็ค integrity")
+        parser.add_argument("--json", action="store_true", help="แสดงรายงานเป็น JSON")
+
+    def handle(self, *args, **options):
+        aliases = options["database"] or maintenance.sqlite_aliases()
+        if not aliases:
+            raise CommandError("db_maintain ใช้กับ SQLite เท่านั้น (PostgreSQL ใช้ autovacuum ของ server)")
+        unknown = [alias for alias in aliases if alias not in maintenance.sqlite_aliases()]
+        if unknown:
+            raise CommandError(f"ไม่ใช่ database SQLite ที่เขียนได้: {', '.join(unknown)}")
+
+        reports = {}
+        problems = {}
+        for alias in aliases:
+            if not options["json"]:
+                self.stdout.write(self.style.MIGRATE_HEADING(f"== {alias} =="))
+            reports[alias], found = self._maintain(alias, options)
+            if found:
+                problems[alias] = len(found)
+            if not options["json"]:
+                self._print_report(reports[alias])
+                self.stdout.write("")
+
+        if options["json"]:
+            self.stdout.write(json.dumps(reports, ensure_ascii=False, indent=2))
+
+        if problems:
+            summary = ", ".join(f"{alias} {count} รายการ" for alias, count in problems.items())
+            raise CommandError(f"integrity check พบปัญหา: {summary}")
+
+    def _maintain(self, alias, options):
+        """ทำทุกขั้นตอนกับ database alias คืนค่า (report, รายการปัญหาจาก integrity check)"""
+        report = {"steps": {}}
+        log = (lambda msg: None) if options["json"] else self.stdout.write
+
+        if options["enable_incremental"]:
+            if maintenance.auto_vacuum_mode(using=alias) == 2:
+                log("auto_vacuum เป็น INCREMENTAL อยู่แล้ว")
+            else:
+                started = time.perf_counter()
+                maintenance.enable_incremental_vacuum(using=alias)
+                log(f"VACUUM + auto_vacuum=INCREMENTAL ({time.perf_counter() - started:.1f}s)")
+
+        if not options["skip_analyze"]:
+            started = time.perf_counter()
+            maintenance.analyze(options["analysis_limit"], using=alias)
+            report["steps"]["analyze_s"] = round(time.perf_counter() - started, 2)
+            log(f"ANALYZE + optimize ({report['steps']['analyze_s']}s)")
+
+        if not options["skip_vacuum"]:
+            if maintenance.auto_vacuum_mode(using=alias) != 2:
+                log(self.style.WARNING(
+                    "ข้าม incremental vacuum: ไฟล์นี้ยังไม่ได้ตั้ง auto_vacuum=INCREMENTAL "
+                    "(รันครั้งเดียวด้วย --enable-incremental)"
+                ))
+            else:
+                started = time.perf_counter()
+                freed = maintenance.incremental_vacuum(
+                    options["vacuum_step"], options["max_vacuum_pages"], using=alias
+                )
+                report["steps"]["vacuum_pages"] = freed
+                report["steps"]["vacuum_s"] = round(time.perf_counter() - started, 2)
+                log(f"incremental vacuum: คืน {freed} page ({report['steps']['vacuum_s']}s)")
+            report["steps"]["wal_checkpoint"] = maintenance.wal_checkpoint(using=alias)
+
+        problems = []
+        if not options["skip_check"]:
+            started = time.perf_counter()
+            problems = maintenance.integrity_check(full=options["full_check"], using=alias)
+            report["steps"]["integrity"] = problems or "ok"
+            report["steps"]["integrity_s"] = round(time.perf_counter() - started, 2)
+            if problems:
+                for message in problems[:20]:
+                    log(self.style.ERROR(message))
+            else:
+                log(f"integrity: ok ({report['steps']['integrity_s']}s)")
+
+        report["database"] = maintenance.database_stats(using=alias)
+        report["tables"] = maintenance.table_stats(using=alias)
+        return report, problems
+
+    def _print_report(self, report):
+        db = report["database"]
+        self.stdout.write(
+            f"\nไฟล์ {_size(db['size_bytes'])} ({db['page_count']} page x {db['page_size']} B), "
+            f"page ว่าง {db['freelist_pages']} ({db['free_pct']}%), auto_vacuum={db['auto_vacuum']}"
+        )
+        if not report["tables"]:
+            self.stdout.write(self.style.WARNING("SQLite ตัวนี้ไม่มี dbstat ไม่สามารถรายงานขนาดต่อ table ได้"))
+            return
+
+        self.stdout.write(
+            f"{'table':<36}{'rows':>10}{'table':>11}{'index':>11}{'idx':>5}{'unused%':>9}{'frag%':>7}"
+        )
+        for row in report["tables"]:
+            self.stdout.write(
+                f"{row['table']:<36}{row['rows']:>10}{_size(row['table_bytes']):>11}"
+                f"{_size(row['index_bytes']):>11}{row['indexes']:>5}"
+                f"{row['unused_pct']:>9.1f}{row['fragmented_pct']:>7.1f}"
+            )
@@ -3,7 +3,12 @@ import openpyxl
 from django.core.management.base import BaseCommand
 from django.db import transaction
 
-from production.models import Lot, ScanRecord, Machine
+from production.db_router import scan_db, use_shard
+from production.ingest import rebuild_lot_counters
+from production.rollups import rebuild_rollups
+from production.lot_cache import lot_cache
+from production.models import Department, Lot, ScanRecord, Machine
+from production.shards import group_by_shard, shard_for_import
 
 
 class Command(BaseCommand):
@@ -22,11 +27,20 @@ class Command(BaseCommand):
         self.stdout.write(self.style.NOTICE(f"Loading workbook: {path}"))
         wb = openpyxl.load_workbook(path, data_only=True)
 
-        with transaction.atomic():
+        # แยก shard ตามแผนก: transaction นี้ครอบเฉพาะ shard default, Lot / scan ของ shard อื่นเขียนทีละแถว
+        with transaction.atomic(), transaction.atomic(using=scan_db()):
             self._import_machines(wb)
             lot_map = self._import_lots(wb)
             self._import_collect(wb, lot_map)
 
+            # อัปเดตยอดสะสม produced_qty / scan_count + rollup กราฟ / Productivity จาก ScanRecord
+            for alias, lot_ids in group_by_shard(lot_map.values()).items():
+                with use_shard(alias):
+                    rebuild_lot_counters(lot_ids)
+                    rebuild_rollups(lot_ids)
+
+        # ล้าง cache lot_no -> Lot (process อื่นจะหมดอายุตาม LOT_CACHE_TTL)
+        lot_cache.clear()
         self.stdout.write(self.style.SUCCESS("Import completed."))
 
     # ------------------------ Machines ------------------------
@@ -49,11 +63,15 @@ class Command(BaseCommand):
             machine_name = row[idx.get("Machine Name")] if "Machine Name" in idx else ""
             department = row[idx.get("Department")] if "Department" in idx else ""
 
+            # แผนกที่ยังไม่มีในตาราง Department -> สร้างให้ (เครื่องจะได้ผูก dept ตอน save)
+            Department.for_name(department, create=True)
             Machine.objects.update_or_create(
-                machine_no=str(machine_no).strip(),
+                key=Machine.make_key(str(machine_no)),
                 defaults={
+                    "machine_no": str(machine_no).strip(),
                     "machine_name": str(machine_name or "").strip(),
                     "department": str(department or "").strip(),
+                    "in_machine_list": True,
                 },
             )
             count += 1
@@ -106,23 +124,27 @@ class Command(BaseCommand):
             except:
                 target = prod_qty
 
-            lot, created = Lot.objects.update_or_create(
-                lot_no=str(lot_no).strip(),
-                defaults={
-                    "part_no": str(abest_part_no or "").strip(),
-                    "customer": str(customer or "").strip(),
-                    "description": str(description or "").strip(),
-                    "customer_part_no": str(customer_part_no or "").strip(),
-                    "po_no": str(po_no or "").strip(),
-                    "remark": str(remark or "").strip(),
-                    "production_quantity": prod_qty,
-                    "pieces_per_box": pieces_per_box,
-                    "target": target,
-                    "department": str(department or "").strip(),
-                    "machine_no": str(machine_no or "").strip(),
-                    "type": str(lot_type or "Order").strip(),
-                },
-            )
+            lot_no = str(lot_no).strip()
+            department = str(department or "").strip()
+            Department.for_name(department, create=True)
+            with use_shard(shard_for_import(lot_no, department)):
+                lot, created = Lot.objects.update_or_create(
+                    lot_no=lot_no,
+                    defaults={
+                        "part_no": str(abest_part_no or "").strip(),
+                        "customer": str(customer or "").strip(),
+                        "description": str(description or "").strip(),
+                        "customer_part_no": str(customer_part_no or "").strip(),
+                        "po_no": str(po_no or "").strip(),
+                        "remark": str(remark or "").strip(),
+                        "production_quantity": prod_qty,
+                        "pieces_per_box": pieces_per_box,
+                        "target": target,
+                        "department": department,
+                        "machine_no": str(machine_no or "").strip(),
+                        "type": str(lot_type or "Order").strip(),
+                    },
+                )
             lot_map[lot.lot_no] = lot
             count += 1
 
@@ -169,9 +191,11 @@ class Command(BaseCommand):
 
             qty = lot.pieces_per_box or 0   # 1 scan = 1 กล่อง
 
-            ScanRecord.objects.create(
-                lot=lot,
-                machine_no=str(machine_no or "").strip(),
-                qty=qty,
-                scanned_at=scan_dt,
-            )
\ No newline at end of file
+            machine = Machine.for_machine_no(str(machine_no or ""))
+            with use_shard(lot._state.db):
+                ScanRecord.objects.create(
+                    lot=lot,
+                    machine=machine,
+                    qty=qty,
+                    scanned_at=scan_dt,
+                )
\ No newline at end of file
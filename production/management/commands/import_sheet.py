@@ -1,5 +1,8 @@
 from django.core.management.base import BaseCommand
-from production.models import Lot
+from production.db_router import use_shard
+from production.lot_cache import lot_cache
+from production.models import Department, Lot
+from production.shards import shard_for_import
 import pandas as pd
 from pandas import ExcelFile 
 from pathlib import Path
@@ -63,13 +66,21 @@ class Command(BaseCommand):  # <<== ต้องชื่อ Command และ
             if not int(data.get("target") or 0) and pq and ppb:
                 data["target"] = pq // max(ppb, 1)
 
-            obj, is_created = Lot.objects.update_or_create(
-                lot_no=lot_no,
-                defaults=data,
-            )
+            # แผนกที่ยังไม่มีในตาราง Department -> สร้างให้ (Lot จะได้ผูก dept / ไป shard ของแผนก)
+            department = data.get("department")
+            if not pd.isna(department):
+                Department.for_name(department, create=True)
+
+            # แยก shard ตามแผนก: Lot เดิมอยู่ shard ไหนอัปเดตที่นั่น Lot ใหม่ไป shard ของแผนก
+            with use_shard(shard_for_import(lot_no, str(data.get("department") or ""))):
+                obj, is_created = Lot.objects.update_or_create(
+                    lot_no=lot_no,
+                    defaults=data,
+                )
             created += int(is_created)
             updated += int(not is_created)
 
+        lot_cache.clear()
         self.stdout.write(self.style.SUCCESS(
             f"Imported OK -> created: {created}, updated: {updated}"
         ))
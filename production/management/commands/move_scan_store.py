@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from production.db_router import SCAN_DB
+from production.scan_store import clear_source, copy_model, scan_store_models
+
+
+class Command(BaseCommand):
+    help = (
+        "คัดลอกตาราง scan (ScanRecord / rollup / DowntimeLog ฯลฯ) จาก default ไป database \"scans\" "
+        "หลังเริ่มแยก database (รันซ้ำต่อจากเดิมได้)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=2000,
+            help="จำนวนแถวต่อ 1 transaction",
+        )
+        parser.add_argument(
+            "--clear-source",
+            action="store_true",
+            help="ลบแถวใน default ที่คัดลอกไปแล้ว (รันหลังตรวจยอดว่าครบ)",
+        )
+
+    def handle(self, *args, **options):
+        if SCAN_DB not in settings.DATABASES:
+            raise CommandError("ยังไม่ได้ตั้ง database \"scans\" (SCAN_DATABASE_URL หรือ SQLITE_SCAN_DB=1)")
+
+        unresolved = 0
+        for model in scan_store_models():
+            name = model._meta.object_name
+            if options["clear_source"]:
+                deleted, kept = clear_source(model, options["batch_size"])
+                self.stdout.write(f"{name}: ลบจาก default {deleted} แถว")
+                if kept:
+                    self.stdout.write(self.style.WARNING(
+                        f"{name}: เก็บไว้ใน default {kept} แถว (ยังไม่ได้คัดลอก / ข้อมูลไม่ตรงกับ \"scans\")"
+                    ))
+                unresolved += kept
+            else:
+                copied, conflicts = copy_model(model, options["batch_size"])
+                self.stdout.write(f"{name}: คัดลอก {copied} แถว")
+                if conflicts:
+                    self.stdout.write(self.style.WARNING(
+                        f"{name}: id ชนกับแถวอื่นใน \"scans\" {conflicts} แถว (ไม่คัดลอก / ไม่ลบ)"
+                    ))
+                unresolved += conflicts
+        if unresolved:
+            raise CommandError(f"มี {unresolved} แถวที่ยังย้ายไม่ได้ ตรวจแล้วรันใหม่")
+        self.stdout.write(self.style.SUCCESS("เสร็จแล้ว"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from production.ingest import purge_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = "ลบ Idempotency-Key ของการ Scan ที่หมดอายุแล้ว (ตั้ง cron ไว้รันเป็นระยะได้)"
+
+    def handle(self, *args, **options):
+        deleted = purge_idempotency_keys()
+        self.stdout.write(self.style.SUCCESS(f"ลบ key ที่หมดอายุแล้ว {deleted} รายการ"))
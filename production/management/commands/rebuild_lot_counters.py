@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from production.db_router import use_shard
+from production.ingest import rebuild_lot_counters
+from production.models import Lot
+from production.shards import all_shards
+
+
+class Command(BaseCommand):
+    help = "คำนวณยอดสะสม produced_qty / scan_count ของ Lot ใหม่จาก ScanRecord"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "lot_no",
+            nargs="*",
+            help="Lot No. ที่ต้องการซ่อม (ไม่ระบุ = ทุก Lot)",
+        )
+
+    def handle(self, *args, **options):
+        lot_nos = options["lot_no"]
+
+        # ทำทีละ shard (แยก database ตามแผนก) ไม่แยก = default อย่างเดียว
+        updated = 0
+        found = 0
+        for alias in all_shards():
+            with use_shard(alias):
+                lot_ids = None
+                if lot_nos:
+                    lot_ids = list(
+                        Lot.objects.filter(lot_no__in=lot_nos).values_list("id", flat=True)
+                    )
+                    found += len(lot_ids)
+                    if not lot_ids:
+                        continue
+                updated += rebuild_lot_counters(lot_ids)
+
+        if lot_nos and found != len(set(lot_nos)):
+            self.stdout.write(self.style.WARNING("บาง Lot No. ไม่พบในระบบ"))
+        self.stdout.write(self.style.SUCCESS(f"อัปเดตยอดสะสมแล้ว {updated} lots"))
@@ -0,0 +1,68 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from production.db_router import use_shard
+from production.models import Lot
+from production.rollups import rebuild_daily, rebuild_rollups
+from production.shards import all_shards
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise CommandError(f"{name} ต้องเป็นรูปแบบ YYYY-MM-DD")
+
+
+class Command(BaseCommand):
+    help = "คำนวณตาราง rollup (ScanHourly / MachineDaily) ใหม่จาก ScanRecord"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "lot_no",
+            nargs="*",
+            help="Lot No. ที่ต้องการคำนวณใหม่ (ไม่ระบุ = ทุก Lot)",
+        )
+        parser.add_argument("--from", dest="date_from", help="ตั้งแต่วันที่ (YYYY-MM-DD)")
+        parser.add_argument("--to", dest="date_to", help="ถึงวันที่ (YYYY-MM-DD)")
+        parser.add_argument(
+            "--daily-only",
+            action="store_true",
+            help="คำนวณเฉพาะ MachineDaily จาก ScanHourly (เช่น หลังแก้แผนกของ Lot)",
+        )
+
+    def handle(self, *args, **options):
+        lot_nos = options["lot_no"]
+        date_from = options["date_from"] and _parse_date(options["date_from"], "--from")
+        date_to = options["date_to"] and _parse_date(options["date_to"], "--to")
+
+        # ทำทีละ shard (แยก database ตามแผนก) ไม่แยก = default อย่างเดียว
+        if options["daily_only"]:
+            created = 0
+            for alias in all_shards():
+                with use_shard(alias):
+                    created += rebuild_daily(date_from, date_to)
+            self.stdout.write(self.style.SUCCESS(f"MachineDaily: สร้างใหม่ {created} แถว"))
+            return
+
+        hourly = daily = found = 0
+        for alias in all_shards():
+            with use_shard(alias):
+                lot_ids = None
+                if lot_nos:
+                    lot_ids = list(
+                        Lot.objects.filter(lot_no__in=lot_nos).values_list("id", flat=True)
+                    )
+                    found += len(lot_ids)
+                    if not lot_ids:
+                        continue
+                shard_hourly, shard_daily = rebuild_rollups(lot_ids, date_from, date_to)
+                hourly += shard_hourly
+                daily += shard_daily
+
+        if lot_nos and found != len(set(lot_nos)):
+            self.stdout.write(self.style.WARNING("บาง Lot No. ไม่พบในระบบ"))
+        self.stdout.write(
+            self.style.SUCCESS(f"ScanHourly: สร้างใหม่ {hourly} แถว, MachineDaily: {daily} แถว")
+        )
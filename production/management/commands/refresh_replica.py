@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from production.sqlite_maintenance import refresh_replica, replica_path, sqlite_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        "อัปเดตไฟล์ snapshot ของ SQLite ที่ใช้เป็น replica ให้หน้า dashboard / รายงาน "
+        "(ทุกไฟล์: default / scans / shard_N, ตั้ง cron ไว้ หรือใช้ --every ให้รันวนไปเรื่อย ๆ)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            action="append",
+            default=None,
+            help="alias ของ database ต้นทาง (ใส่ซ้ำได้) default = ทุก database ที่เป็น SQLite",
+        )
+        parser.add_argument(
+            "--path",
+            default=None,
+            help="ไฟล์ replica (ใช้ได้เมื่อระบุ --database ตัวเดียว, default ตาม SQLITE_REPLICA_PATH / "
+            "<ชื่อไฟล์>_replica.sqlite3)",
+        )
+        parser.add_argument(
+            "--every",
+            type=int,
+            default=0,
+            help="รันซ้ำทุกกี่วินาที (0 = รันครั้งเดียว)",
+        )
+
+    def handle(self, *args, **options):
+        aliases = options["database"] or sqlite_aliases()
+        if not aliases:
+            raise CommandError("ใช้กับ SQLite เท่านั้น (PostgreSQL ใช้ streaming replica ผ่าน REPLICA_DATABASE_URL)")
+        unknown = [alias for alias in aliases if alias not in sqlite_aliases()]
+        if unknown:
+            raise CommandError(f"ไม่ใช่ database SQLite ที่เขียนได้: {', '.join(unknown)}")
+        if options["path"] and len(aliases) != 1:
+            raise CommandError("--path ใช้ได้เมื่อระบุ --database ตัวเดียว")
+
+        while True:
+            for alias in aliases:
+                path = options["path"] or replica_path(alias)
+                started = time.perf_counter()
+                pages = refresh_replica(path, using=alias)
+                self.stdout.write(
+                    f"{time.strftime('%H:%M:%S')} replica {alias} -> {path}: {pages} page "
+                    f"({time.perf_counter() - started:.2f}s)"
+                )
+            if not options["every"]:
+                break
+            time.sleep(options["every"])
@@ -0,0 +1,241 @@
+# production/management/commands/scan_listener.py
+# TCP listener สำหรับเครื่องสแกนแบบติดตั้งประจำสถานี (fixed-mount)
+#
+# เครื่องสแกนส่งมาทีละบรรทัด รูปแบบเดียวกับ QR ที่ qr_export สร้าง:  LotNo|Qty|UniqueID
+# ตอบกลับทีละบรรทัดตามลำดับที่ส่งมา:
+#   ACK|LotNo|Qty|UniqueID|Machine         บันทึกแล้ว
+#   NAK|<code>|<ข้อความเดิม>                ไม่บันทึก (bad_format / lot_not_found / duplicate / error)
+#
+# scan จากทุก connection จะถูกรวมเป็น micro-batch แล้วบันทึกผ่าน ingest.ingest_scans
+# ตัวเดียวกับ api (lot_cache / เช็คซ้ำ / ยอดสะสม / first_scan-last_scan เหมือนกันทุกทาง)
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from production import ingest
+
+
+MAX_LINE_BYTES = 1024
+
+
+class ScanListener:
+    def __init__(self, machine_no=None, flush_ms=50, max_batch=500, log=None):
+        self.machine_no = machine_no
+        self.flush_seconds = flush_ms / 1000.0
+        self.max_batch = max_batch
+        self.log = log or (lambda msg: None)
+
+        # ORM ทำงานใน thread เดียวเสมอ (ใช้ DB connection เดิมซ้ำ ไม่เปิดใหม่ทุก batch)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="scan-listener-db")
+        self._queue = None
+        self.connections = 0
+        self.acked = 0
+        self.nacked = 0
+        self.batches = 0
+
+    # ---------- แปลงบรรทัด ----------
+
+    def parse_line(self, line):
+        """คืน item (dict แบบ ingest.normalize_item) หรือ None ถ้ารูปแบบไม่ถูกต้อง"""
+        parts = [p.strip() for p in line.split("|")]
+        if len(parts) != 3 or not all(parts):
+            return None
+        try:
+            qty = int(parts[1])
+        except ValueError:
+            return None
+        if qty <= 0:
+            return None
+        return ingest.normalize_item({
+            "qr_code": line,
+            "qty": qty,
+            "machine_no": self.machine_no,
+        })
+
+    # ---------- micro-batch ----------
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_seconds
+            while len(batch) < self.max_batch:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = await loop.run_in_executor(self._executor, self._flush, items)
+            except Exception as exc:
+                self.log(f"บันทึก batch ไม่สำเร็จ: {exc}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+
+            self.batches += 1
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    @staticmethod
+    def _flush(items):
+        close_old_connections()
+        return ingest.ingest_scans(items)
+
+    # ---------- connection ----------
+
+    async def handle_client(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        self.connections += 1
+        self.log(f"เชื่อมต่อ: {peer}")
+
+        # ตอบกลับตามลำดับบรรทัด แม้ผลของแต่ละบรรทัดจะเสร็จไม่พร้อมกัน
+        replies = asyncio.Queue()
+        sender = asyncio.create_task(self._send_replies(replies, writer))
+        loop = asyncio.get_running_loop()
+
+        overrun = False
+        try:
+            while True:
+                try:
+                    raw = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as e:
+                    raw = e.partial
+                    if not raw.strip():
+                        break
+                except asyncio.LimitOverrunError as e:
+                    # บรรทัดยาวผิดปกติ -> ทิ้งไปจนถึงท้ายบรรทัดแล้ว NAK
+                    await reader.readexactly(e.consumed)
+                    overrun = True
+                    continue
+
+                if overrun:
+                    overrun = False
+                    replies.put_nowait(("NAK|bad_format|", None))
+                    continue
+
+                line = raw.decode("utf-8", errors="replace").strip()
+                if not line:
+                    continue
+
+                item = self.parse_line(line)
+                if item is None:
+                    replies.put_nowait((f"NAK|bad_format|{line}", None))
+                    continue
+
+                future = loop.create_future()
+                self._queue.put_nowait((item, future))
+                replies.put_nowait((line, future))
+
+                if reader.at_eof():
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            replies.put_nowait(None)
+            await sender
+            writer.close()
+            self.log(f"ปิดการเชื่อมต่อ: {peer}")
+
+    async def _send_replies(self, replies, writer):
+        while True:
+            entry = await replies.get()
+            if entry is None:
+                break
+            line, future = entry
+
+            if future is None:
+                reply = line
+                self.nacked += 1
+            else:
+                try:
+                    result = await future
+                except Exception:
+                    result = {"status": "error", "code": "error"}
+                reply = self.format_reply(line, result)
+
+            try:
+                writer.write(reply.encode("utf-8") + b"\n")
+                await writer.drain()
+            except ConnectionError:
+                break
+
+    def format_reply(self, line, result):
+        if result.get("status") == "success":
+            self.acked += 1
+            return f"ACK|{line}|{result['machine']}"
+        self.nacked += 1
+        return f"NAK|{result.get('code', 'error')}|{line}"
+
+    # ---------- start ----------
+
+    async def serve(self, host, port):
+        self._queue = asyncio.Queue()
+        batcher = asyncio.create_task(self._batcher())
+        server = await asyncio.start_server(
+            self.handle_client, host, port, limit=MAX_LINE_BYTES
+        )
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self._executor.shutdown(wait=True)
+
+
+class Command(BaseCommand):
+    help = "เปิด TCP listener รับ scan จากเครื่องสแกนประจำสถานี (บรรทัดละ LotNo|Qty|UniqueID)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="0.0.0.0", help="IP ที่จะ listen (default 0.0.0.0)")
+        parser.add_argument("--port", type=int, default=9100, help="Port (default 9100)")
+        parser.add_argument(
+            "--machine",
+            default=None,
+            help="เลขเครื่องของสถานีนี้ (ไม่ระบุ = ใช้เครื่อง Default ของ Lot)",
+        )
+        parser.add_argument(
+            "--flush-ms",
+            type=int,
+            default=50,
+            help="รอรวม scan เป็นกลุ่มนานสุดกี่ ms ก่อนบันทึก (default 50)",
+        )
+        parser.add_argument(
+            "--max-batch",
+            type=int,
+            default=500,
+            help="จำนวน scan สูงสุดต่อการบันทึก 1 ครั้ง (default 500)",
+        )
+
+    def handle(self, *args, **options):
+        listener = ScanListener(
+            machine_no=options["machine"],
+            flush_ms=options["flush_ms"],
+            max_batch=options["max_batch"],
+            log=lambda msg: self.stdout.write(msg),
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"scan_listener: listen ที่ {options['host']}:{options['port']}"
+        ))
+
+        started = time.monotonic()
+        try:
+            asyncio.run(listener.serve(options["host"], options["port"]))
+        except KeyboardInterrupt:
+            pass
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"หยุดแล้ว: {listener.connections} connections, {listener.batches} batches, "
+            f"ACK {listener.acked} / NAK {listener.nacked} ใน {elapsed:.0f} วินาที"
+        )
@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from production.scan_metrics import metrics, read_snapshots, snapshot_dir, summarize
+
+
+class Command(BaseCommand):
+    help = "แสดงเวลาแต่ละขั้นของการบันทึก Scan (p50/p95/p99) รวมจาก snapshot ของทุก process"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--window",
+            type=int,
+            default=metrics.window_minutes,
+            help="ย้อนหลังกี่นาที (default ตาม SCAN_METRICS_WINDOW_MINUTES)",
+        )
+        parser.add_argument("--dir", default=None, help="โฟลเดอร์ snapshot (default ตาม SCAN_METRICS_DIR)")
+        parser.add_argument("--json", action="store_true", help="แสดงผลเป็น JSON")
+
+    def handle(self, *args, **options):
+        window = options["window"]
+        path = options["dir"] or snapshot_dir()
+        snapshots = read_snapshots(path, max_age=window * 60)
+        data = summarize(snapshots, window)
+        data["processes"] = len(snapshots)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(data, ensure_ascii=False, indent=2))
+            return
+
+        if not snapshots:
+            self.stdout.write(self.style.WARNING(f"ไม่พบ snapshot ใน {path}"))
+            return
+
+        self.stdout.write(f"ย้อนหลัง {window} นาที จาก {len(snapshots)} process ({path})")
+        self.stdout.write(
+            f"{'stage':<12}{'count':>9}{'avg':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)"
+        )
+        for stage, s in data["stages"].items():
+            self.stdout.write(
+                f"{stage:<12}{s['count']:>9}{s['avg_ms']:>10.2f}{s['p50_ms']:>10.2f}"
+                f"{s['p95_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['max_ms']:>10.2f}"
+            )
+        if data["counters"]:
+            self.stdout.write(
+                "counters: " + ", ".join(f"{k}={v}" for k, v in sorted(data["counters"].items()))
+            )
@@ -2,7 +2,10 @@ import os
 import pandas as pd
 
 from django.core.management.base import BaseCommand
+from production.db_router import use_shard
+from production.lot_cache import lot_cache
 from production.models import Lot
+from production.shards import shard_for_lot
 
 
 class Command(BaseCommand):
@@ -35,7 +38,8 @@ class Command(BaseCommand):
 
             # ---- 4) หา Lot ใน DB ----
             try:
-                lot = Lot.objects.get(lot_no=lot_no)
+                with use_shard(shard_for_lot(lot_no)):
+                    lot = Lot.objects.get(lot_no=lot_no)
             except Lot.DoesNotExist:
                 self.stdout.write(self.style.WARNING(f"[MISS] ไม่พบ Lot ใน DB: {lot_no}"))
                 skipped += 1
@@ -83,6 +87,8 @@ class Command(BaseCommand):
             else:
                 skipped += 1  # ไม่มีอะไรเปลี่ยน
 
+        lot_cache.clear()
+
         # ---- 9) สรุปผล ----
         self.stdout.write(
             self.style.SUCCESS(
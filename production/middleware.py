@@ -2,6 +2,43 @@ import time
 
 from django.conf import settings
 from django.contrib.auth import logout
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.http import JsonResponse
+
+from . import device_auth
+
+
+class DeviceSessionMiddleware(SessionMiddleware):
+    """
+    ใช้แทน SessionMiddleware ของ Django
+    - request ปกติ (browser) -> ทำงานเหมือนเดิมทุกอย่าง
+    - request จากเครื่องสแกน / kiosk ที่ส่ง header Authorization: Device <token>
+      -> ไม่โหลด / ไม่บันทึก django_session เลย, ไม่ตั้ง cookie, ไม่ต้องใช้ CSRF token
+         (เครื่องที่ยืนยันแล้วอยู่ที่ request.device)
+    """
+
+    def process_request(self, request):
+        token = device_auth.token_from_request(request)
+        if token is None:
+            request.device = None
+            return super().process_request(request)
+
+        device = device_auth.authenticate(token)
+        if device is None:
+            return JsonResponse(
+                {"status": "error", "message": "invalid device token"}, status=401
+            )
+
+        request.device = device
+        # session ว่างที่ไม่ผูกกับแถวใน DB (request.user จะเป็น AnonymousUser)
+        request.session = self.SessionStore()
+        # token ส่งทาง header เท่านั้น (browser แนบให้เองไม่ได้) จึงไม่ต้องเช็ค CSRF
+        request._dont_enforce_csrf_checks = True
+
+    def process_response(self, request, response):
+        if getattr(request, "device", None) is not None:
+            return response
+        return super().process_response(request, response)
 
 
 class IdleTimeoutMiddleware:
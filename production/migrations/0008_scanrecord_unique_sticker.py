@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-16 20:36
+
+from django.db import migrations, models, router
+from django.db.models import Count, Min
+
+
+def clear_duplicate_stickers(apps, schema_editor):
+    """
+    ก่อนสร้าง unique index: ถ้ามี sticker ซ้ำใน lot เดียวกันอยู่แล้ว
+    ให้เก็บ Unique ID ไว้เฉพาะแถวแรก แถวที่เหลือเคลียร์เป็น NULL (ยอด qty ยังอยู่ครบ)
+    """
+    ScanRecord = apps.get_model("production", "ScanRecord")
+    db = schema_editor.connection.alias
+    if not all(
+        router.allow_migrate_model(db, model) for model in (ScanRecord,)
+    ):
+        # ตารางอยู่คนละ database (ScanStoreRouter) -> ข้าม
+        return
+    dupes = (
+        ScanRecord.objects.using(db).filter(sticker_unique_id__isnull=False)
+        .values("lot_id", "sticker_unique_id")
+        .annotate(n=Count("id"), keep_id=Min("id"))
+        .filter(n__gt=1)
+    )
+    for row in dupes:
+        ScanRecord.objects.using(db).filter(
+            lot_id=row["lot_id"],
+            sticker_unique_id=row["sticker_unique_id"],
+        ).exclude(id=row["keep_id"]).update(sticker_unique_id=None)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("production", "0007_scanrecord_sticker_unique_id"),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_duplicate_stickers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="scanrecord",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("sticker_unique_id__isnull", False)),
+                fields=("lot", "sticker_unique_id"),
+                name="uniq_scan_lot_sticker",
+            ),
+        ),
+    ]
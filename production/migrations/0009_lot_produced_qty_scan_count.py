@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-16 20:37
+
+from django.db import migrations, models, router
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_lot_counters(apps, schema_editor):
+    """เติมยอดสะสมของ Lot ที่มีอยู่แล้วจาก ScanRecord"""
+    Lot = apps.get_model("production", "Lot")
+    ScanRecord = apps.get_model("production", "ScanRecord")
+    db = schema_editor.connection.alias
+    if not all(
+        router.allow_migrate_model(db, model) for model in (Lot, ScanRecord)
+    ):
+        # ตารางอยู่คนละ database (ScanStoreRouter) -> ข้าม
+        return
+
+    scans = ScanRecord.objects.using(db).filter(lot=OuterRef("pk")).order_by().values("lot")
+    Lot.objects.using(db).update(
+        produced_qty=Coalesce(Subquery(scans.annotate(s=Sum("qty")).values("s")), 0),
+        scan_count=Coalesce(Subquery(scans.annotate(n=Count("id")).values("n")), 0),
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("production", "0008_scanrecord_unique_sticker"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="lot",
+            name="produced_qty",
+            field=models.IntegerField(default=0, help_text="ผลรวม qty ของทุก scan"),
+        ),
+        migrations.AddField(
+            model_name="lot",
+            name="scan_count",
+            field=models.IntegerField(
+                default=0, help_text="จำนวนครั้งที่ scan (กล่อง)"
+            ),
+        ),
+        migrations.RunPython(backfill_lot_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.8 on 2026-10-16 20:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("production", "0009_lot_produced_qty_scan_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="IdempotencyKey",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=64, unique=True)),
+                ("response", models.JSONField(help_text="ผลลัพธ์ที่ตอบกลับไปครั้งแรก")),
+                ("expires_at", models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.8 on 2026-10-16 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("production", "0010_idempotencykey"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Device",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        max_length=100, unique=True, verbose_name="ชื่อสถานี"
+                    ),
+                ),
+                (
+                    "machine_no",
+                    models.CharField(
+                        blank=True,
+                        help_text="ใช้เป็นเครื่องของ scan ที่ส่งมาจากสถานีนี้ ถ้าไม่ได้ระบุเครื่องมา",
+                        max_length=50,
+                        verbose_name="เครื่อง Default",
+                    ),
+                ),
+                ("is_active", models.BooleanField(default=True, verbose_name="ใช้งาน")),
+                (
+                    "token_version",
+                    models.PositiveIntegerField(
+                        default=0,
+                        help_text="เพิ่มทุกครั้งที่ออก token ใหม่ (token เก่าใช้ไม่ได้ทันที)",
+                    ),
+                ),
+                ("token_issued_at", models.DateTimeField(blank=True, null=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
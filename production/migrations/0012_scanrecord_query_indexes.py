@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-16 20:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("production", "0011_device"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="scanrecord",
+            index=models.Index(
+                fields=["machine_no", "scanned_at"], name="scan_machine_time_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="scanrecord",
+            index=models.Index(fields=["lot", "scanned_at"], name="scan_lot_time_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="scanrecord",
+            index=models.Index(fields=["scanned_at"], name="scan_time_idx"),
+        ),
+    ]
@@ -0,0 +1,172 @@
+# Generated by Django 5.2.8 on 2026-10-16 21:05
+
+import django.db.models.deletion
+from django.db import migrations, models, router
+
+
+def make_key(machine_no):
+    return (machine_no or "").strip().casefold()
+
+
+def fill_machine_keys(apps, schema_editor):
+    """
+    ตั้ง key ให้ Machine เดิม
+    ถ้ามีเครื่องชื่อซ้ำกันแค่ตัวพิมพ์ / ช่องว่าง (เช่น M226 / m226) หยุด migration
+    ให้รวม / แก้ชื่อใน Machine List เองก่อน (ไม่ลบข้อมูลเครื่องให้อัตโนมัติ) แล้วรัน migrate ใหม่
+    """
+    Machine = apps.get_model("production", "Machine")
+    if not all(
+        router.allow_migrate_model(schema_editor.connection.alias, model) for model in (Machine,)
+    ):
+        # ตารางอยู่คนละ database (ScanStoreRouter) -> ข้าม
+        return
+    names = {}
+    for pk, machine_no in Machine.objects.order_by("id").values_list("id", "machine_no"):
+        names.setdefault(make_key(machine_no), []).append(f"{machine_no!r} (id={pk})")
+    duplicates = [", ".join(rows) for rows in names.values() if len(rows) > 1]
+    if duplicates:
+        raise RuntimeError(
+            "Machine ชื่อซ้ำกัน (ต่างกันแค่ตัวพิมพ์ / ช่องว่าง) แก้ให้เหลือชื่อเดียวก่อนแล้วรัน migrate ใหม่: "
+            + "; ".join(duplicates)
+        )
+    for machine in Machine.objects.order_by("id"):
+        machine.machine_no = machine.machine_no.strip()
+        machine.key = make_key(machine.machine_no)
+        machine.save(update_fields=["machine_no", "key"])
+
+
+def link_machines(apps, schema_editor):
+    """
+    แปลง machine_no (ข้อความ) ของ Lot / ScanRecord เป็น FK ไปที่ Machine (UPDATE 1 ครั้งต่อชื่อที่ไม่ซ้ำกัน)
+    ชื่อเครื่องใน ScanRecord ที่ไม่มีใน Machine List (พิมพ์ผิด / ชื่อแผนก / "Unknown-Machine")
+    -> สร้าง Machine (in_machine_list=False) ให้ 1 แถวต่อชื่อ ก่อนลบคอลัมน์ข้อความทิ้ง
+    ชื่อเครื่องของ scan เดิมจึงไม่หาย และย้อน migration กลับได้ครบ
+    """
+    if schema_editor.connection.vendor == "postgresql":
+        # PostgreSQL: ตรวจ FK ทันทีทีละคำสั่ง ไม่งั้น ALTER TABLE / CREATE INDEX ต่อจากนี้
+        # ใน transaction เดียวกันจะ error "pending trigger events"
+        schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+    Machine = apps.get_model("production", "Machine")
+    Lot = apps.get_model("production", "Lot")
+    ScanRecord = apps.get_model("production", "ScanRecord")
+    alias = schema_editor.connection.alias
+    if not router.allow_migrate_model(alias, Machine):
+        return
+
+    def distinct_names(model):
+        return list(
+            model.objects.exclude(machine_no__isnull=True)
+            .values_list("machine_no", flat=True)
+            .order_by("machine_no")
+            .distinct()
+        )
+
+    ids = dict(Machine.objects.values_list("key", "id"))
+    if router.allow_migrate_model(alias, ScanRecord):
+        for name in distinct_names(ScanRecord):
+            key = make_key(name)
+            if key and key not in ids:
+                ids[key] = Machine.objects.create(
+                    machine_no=name.strip(), key=key, in_machine_list=False
+                ).id
+
+    for model in (Lot, ScanRecord):
+        if not router.allow_migrate_model(alias, model):
+            continue
+        for name in distinct_names(model):
+            machine_id = ids.get(make_key(name))
+            if machine_id is not None:
+                model.objects.filter(machine_no=name).update(machine_id=machine_id)
+
+
+def unlink_machines(apps, schema_editor):
+    """
+    ย้อนกลับ: เขียนชื่อเครื่อง (machine.machine_no) กลับเข้าคอลัมน์ข้อความของ ScanRecord
+    แล้วลบ Machine ที่ link_machines สร้างจากชื่อใน scan (in_machine_list=False)
+    """
+    if schema_editor.connection.vendor == "postgresql":
+        # เหตุผลเดียวกับ link_machines (ต่อจากนี้ลบ FK column ใน transaction เดียวกัน)
+        schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+    Machine = apps.get_model("production", "Machine")
+    Lot = apps.get_model("production", "Lot")
+    ScanRecord = apps.get_model("production", "ScanRecord")
+    if not all(
+        router.allow_migrate_model(schema_editor.connection.alias, model) for model in (Machine, ScanRecord)
+    ):
+        # ตารางอยู่คนละ database (ScanStoreRouter) -> ข้าม
+        return
+    for machine_id, machine_no in Machine.objects.values_list("id", "machine_no"):
+        ScanRecord.objects.filter(machine_id=machine_id).update(machine_no=machine_no)
+
+    created = list(Machine.objects.filter(in_machine_list=False).values_list("id", flat=True))
+    if created:
+        ScanRecord.objects.filter(machine_id__in=created).update(machine_id=None)
+        Lot.objects.filter(machine_id__in=created).update(machine_id=None)
+        Machine.objects.filter(id__in=created).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("production", "0012_scanrecord_query_indexes"),
+    ]
+
+    operations = [
+        # ---------- Machine.key ----------
+        migrations.AddField(
+            model_name="machine",
+            name="key",
+            field=models.CharField(max_length=50, null=True),
+        ),
+        migrations.RunPython(fill_machine_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="machine",
+            name="key",
+            field=models.CharField(editable=False, max_length=50, unique=True),
+        ),
+        migrations.AddField(
+            model_name="machine",
+            name="in_machine_list",
+            field=models.BooleanField(default=True, verbose_name="อยู่ใน Machine List"),
+        ),
+        # ---------- FK ไปที่ Machine ----------
+        migrations.AddField(
+            model_name="lot",
+            name="machine",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="lots",
+                to="production.machine",
+            ),
+        ),
+        migrations.AddField(
+            model_name="scanrecord",
+            name="machine",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="scans",
+                to="production.machine",
+            ),
+        ),
+        migrations.RunPython(link_machines, unlink_machines),
+        # ---------- เลิกเก็บ machine_no เป็นข้อความใน ScanRecord ----------
+        migrations.RemoveIndex(
+            model_name="scanrecord",
+            name="scan_machine_time_idx",
+        ),
+        migrations.RemoveField(
+            model_name="scanrecord",
+            name="machine_no",
+        ),
+        migrations.AddIndex(
+            model_name="scanrecord",
+            index=models.Index(
+                fields=["machine", "scanned_at"], name="scan_machine_id_time_idx"
+            ),
+        ),
+    ]
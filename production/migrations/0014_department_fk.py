@@ -0,0 +1,88 @@
+# Generated by Django 5.2.8 on 2026-10-16 20:58
+
+import django.db.models.deletion
+from django.db import migrations, models, router
+
+
+def normalize(text):
+    return " ".join(str(text or "").split()).casefold()
+
+
+def link_departments(apps, schema_editor):
+    """
+    แปลง department (ข้อความ) ของ Lot / Machine เป็น FK ไปที่ Department (UPDATE 1 ครั้งต่อชื่อ)
+    จับคู่กับ code หรือ name ของแผนกแบบไม่สนตัวพิมพ์/ช่องว่าง (เดิม filter ด้วย icontains)
+    ชื่อที่ยังไม่มีใน Department -> สร้างแผนกให้ (code = name = ชื่อนั้น) Lot / เครื่องจึงไม่หายจากหน้าแผนก
+    """
+    if schema_editor.connection.vendor == "postgresql":
+        # PostgreSQL: ตรวจ FK ทันทีทีละคำสั่ง ไม่งั้น ALTER TABLE / CREATE INDEX ต่อจากนี้
+        # ใน transaction เดียวกันจะ error "pending trigger events"
+        schema_editor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+    Department = apps.get_model("production", "Department")
+    Lot = apps.get_model("production", "Lot")
+    Machine = apps.get_model("production", "Machine")
+    if not all(
+        router.allow_migrate_model(schema_editor.connection.alias, model) for model in (Department, Lot, Machine)
+    ):
+        # ตารางอยู่คนละ database (ScanStoreRouter) -> ข้าม
+        return
+
+    ids = {}
+    for pk, code, name in Department.objects.order_by("id").values_list("id", "code", "name"):
+        ids.setdefault(normalize(code), pk)
+        ids.setdefault(normalize(name), pk)
+
+    for model in (Lot, Machine):
+        names = (
+            model.objects.exclude(department__isnull=True)
+            .values_list("department", flat=True)
+            .order_by("department")
+            .distinct()
+        )
+        for name in list(names):
+            key = normalize(name)
+            if not key:
+                continue
+            if key not in ids:
+                label = " ".join(name.split())
+                ids[key] = Department.objects.create(code=label[:50], name=label[:100]).pk
+            model.objects.filter(department=name).update(dept_id=ids[key])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("production", "0013_machine_fk"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="lot",
+            name="dept",
+            field=models.ForeignKey(
+                blank=True,
+                db_index=False,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="lots",
+                to="production.department",
+            ),
+        ),
+        migrations.AddField(
+            model_name="machine",
+            name="dept",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="machines",
+                to="production.department",
+            ),
+        ),
+        migrations.RunPython(link_departments, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="lot",
+            index=models.Index(fields=["dept", "type"], name="lot_dept_type_idx"),
+        ),
+    ]
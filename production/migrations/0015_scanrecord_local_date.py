@@ -0,0 +1,86 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:10
+
+from datetime import timedelta
+
+from django.db import migrations, models, router
+from django.db.models import Max, Min
+from django.utils import timezone
+
+
+def fill_local_date(apps, schema_editor):
+    """
+    เติม scan_date / scan_hour ให้ ScanRecord เดิม
+    UPDATE ทีละชั่วโมง (ตามเวลาท้องถิ่น) ด้วยช่วง scanned_at -> ใช้ index scan_time_idx
+    ไม่ต้องโหลดทุกแถวขึ้นมาใน Python
+    """
+    ScanRecord = apps.get_model("production", "ScanRecord")
+    db = schema_editor.connection.alias
+    if not all(
+        router.allow_migrate_model(db, model) for model in (ScanRecord,)
+    ):
+        # ตารางอยู่คนละ database (ScanStoreRouter) -> ข้าม
+        return
+    bounds = ScanRecord.objects.using(db).aggregate(
+        first=Min("scanned_at"), last=Max("scanned_at")
+    )
+    if bounds["first"] is None:
+        return
+
+    start = timezone.localtime(bounds["first"]).replace(
+        minute=0, second=0, microsecond=0
+    )
+    last = bounds["last"]
+    while start <= last:
+        end = timezone.localtime(start + timedelta(hours=1))
+        ScanRecord.objects.using(db).filter(scanned_at__gte=start, scanned_at__lt=end).update(
+            scan_date=start.date(), scan_hour=start.hour
+        )
+        start = end
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("production", "0014_department_fk"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="scanrecord",
+            name="scan_date",
+            field=models.DateField(null=True),
+        ),
+        migrations.AddField(
+            model_name="scanrecord",
+            name="scan_hour",
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.RunPython(fill_local_date, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="scanrecord",
+            name="scan_date",
+            field=models.DateField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name="scanrecord",
+            name="scan_hour",
+            field=models.PositiveSmallIntegerField(editable=False),
+        ),
+        # ---------- index ตามวันที่ท้องถิ่น แทน index ของ scanned_at ล้วน ----------
+        migrations.RemoveIndex(
+            model_name="scanrecord",
+            name="scan_time_idx",
+        ),
+        migrations.AddIndex(
+            model_name="scanrecord",
+            index=models.Index(
+                fields=["scan_date", "machine"], name="scan_date_machine_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="scanrecord",
+            index=models.Index(
+                fields=["machine", "scan_date", "scanned_at"],
+                name="scan_machine_date_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.8 on 2026-10-16 23:05
+
+from django.db import migrations, router
+
+# index ที่ใช้ได้เฉพาะ PostgreSQL (SQLite ข้ามไป ไม่ต้องทำอะไร)
+# - BRIN ของ scanned_at: scan เขียนเรียงตามเวลาอยู่แล้ว index เล็กมาก (ไม่กี่ KB ต่อหลายล้านแถว)
+#   ใช้กับการ query ช่วงเวลากว้าง ๆ ของทั้งตาราง (รายงาน / archive)
+# - partial index ของ BREAK ที่ยังไม่ปิด: มีแค่ไม่กี่แถวตลอดเวลา แต่ถูกถามทุกครั้งที่เปิดหน้า OEE
+POSTGRES_INDEXES = [
+    ("ScanRecord", "scan_time_brin", "USING brin (scanned_at)"),
+    ("DowntimeLog", "downtime_open_lot_idx", "(lot_id) WHERE end_time IS NULL"),
+]
+
+
+def create_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for model_name, name, definition in POSTGRES_INDEXES:
+        model = apps.get_model("production", model_name)
+        if not router.allow_migrate_model(schema_editor.connection.alias, model):
+            continue
+        table = model._meta.db_table
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {schema_editor.quote_name(table)} {definition}"
+        )
+
+
+def drop_postgres_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for model_name, name, _ in POSTGRES_INDEXES:
+        model = apps.get_model("production", model_name)
+        if not router.allow_migrate_model(schema_editor.connection.alias, model):
+            continue
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("production", "0015_scanrecord_local_date"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_postgres_indexes, drop_postgres_indexes),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.8 on 2026-10-16 21:09
+
+from django.db import migrations, models, router
+
+
+def drop_postgres_open_break_index(apps, schema_editor):
+    """
+    0016 สร้าง downtime_open_lot_idx ไว้เฉพาะ PostgreSQL ด้วย SQL ตรง ๆ
+    ตอนนี้ย้ายมาเป็น index ของ model (ใช้ได้ทั้ง SQLite / PostgreSQL) จึงลบตัวเดิมก่อน
+    """
+    DowntimeLog = apps.get_model("production", "DowntimeLog")
+    if not router.allow_migrate_model(schema_editor.connection.alias, DowntimeLog):
+        return
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS downtime_open_lot_idx")
+
+
+def create_postgres_open_break_index(apps, schema_editor):
+    DowntimeLog = apps.get_model("production", "DowntimeLog")
+    if not router.allow_migrate_model(schema_editor.connection.alias, DowntimeLog):
+        return
+    if schema_editor.connection.vendor == "postgresql":
+        table = DowntimeLog._meta.db_table
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS downtime_open_lot_idx "
+            f"ON {schema_editor.quote_name(table)} (lot_id) WHERE end_time IS NULL"
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("production", "0016_postgres_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            drop_postgres_open_break_index, create_postgres_open_break_index
+        ),
+        migrations.AddIndex(
+            model_name="downtimelog",
+            index=models.Index(
+                condition=models.Q(("end_time__isnull", True)),
+                fields=["lot"],
+                name="downtime_open_lot_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="lot",
+            index=models.Index(
+                condition=models.Q(("end_time__isnull", True)),
+                fields=["start_time"],
+                name="lot_open_start_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="lot",
+            index=models.Index(
+                fields=["end_time", "start_time"], name="lot_end_start_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.2.8 on 2026-10-16 21:12
+
+import django.db.models.deletion
+from django.db import migrations, models, router
+from django.db.models import Count, Sum
+
+
+def fill_scan_hourly(apps, schema_editor):
+    """สร้าง ScanHourly จาก ScanRecord ที่มีอยู่แล้ว (group ครั้งเดียวทั้งตาราง)"""
+    ScanRecord = apps.get_model("production", "ScanRecord")
+    ScanHourly = apps.get_model("production", "ScanHourly")
+    db = schema_editor.connection.alias
+    if not all(
+        router.allow_migrate_model(db, model) for model in (ScanRecord, ScanHourly)
+    ):
+        # ตารางอยู่คนละ database (ScanStoreRouter) -> ข้าม
+        return
+    grouped = (
+        ScanRecord.objects.using(db).order_by()
+        .values("lot_id", "machine_id", "scan_date", "scan_hour")
+        .annotate(total_qty=Sum("qty"), n=Count("id"))
+    )
+    ScanHourly.objects.using(db).bulk_create(
+        (
+            ScanHourly(
+                lot_id=row["lot_id"],
+                machine_id=row["machine_id"],
+                scan_date=row["scan_date"],
+                scan_hour=row["scan_hour"],
+                qty=row["total_qty"] or 0,
+                scan_count=row["n"],
+            )
+            for row in grouped.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("production", "0017_oee_partial_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ScanHourly",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("scan_date", models.DateField()),
+                ("scan_hour", models.PositiveSmallIntegerField()),
+                ("qty", models.IntegerField(default=0)),
+                ("scan_count", models.IntegerField(default=0)),
+                (
+                    "lot",
+                    models.ForeignKey(
+                        db_index=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="hourly",
+                        to="production.lot",
+                    ),
+                ),
+                (
+                    "machine",
+                    models.ForeignKey(
+                        blank=True,
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="hourly",
+                        to="production.machine",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["machine", "scan_date", "scan_hour"],
+                        name="hourly_machine_date_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("lot", "scan_date", "scan_hour", "machine"),
+                        name="uniq_hourly_lot_hour_machine",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("machine__isnull", True)),
+                        fields=("lot", "scan_date", "scan_hour"),
+                        name="uniq_hourly_lot_hour_no_machine",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(fill_scan_hourly, migrations.RunPython.noop),
+    ]
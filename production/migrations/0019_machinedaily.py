@@ -0,0 +1,119 @@
+# Generated by Django 5.2.8 on 2026-10-16 21:19
+
+import django.db.models.deletion
+from django.db import migrations, models, router
+from django.db.models import Count, Sum
+
+
+def fill_machine_daily(apps, schema_editor):
+    """สร้าง MachineDaily จาก ScanHourly ที่มีอยู่แล้ว (group ครั้งเดียวทั้งตาราง)"""
+    ScanHourly = apps.get_model("production", "ScanHourly")
+    MachineDaily = apps.get_model("production", "MachineDaily")
+    Lot = apps.get_model("production", "Lot")
+    db = schema_editor.connection.alias
+    if not all(
+        router.allow_migrate_model(db, model) for model in (ScanHourly, MachineDaily, Lot)
+    ):
+        # ตารางอยู่คนละ database (ScanStoreRouter) -> ข้าม
+        return
+    grouped = (
+        ScanHourly.objects.using(db).order_by()
+        .values("machine_id", "lot__dept_id", "scan_date")
+        .annotate(
+            total_qty=Sum("qty"),
+            n=Sum("scan_count"),
+            lots=Count("lot_id", distinct=True),
+        )
+    )
+    MachineDaily.objects.using(db).bulk_create(
+        (
+            MachineDaily(
+                machine_id=row["machine_id"],
+                dept_id=row["lot__dept_id"],
+                scan_date=row["scan_date"],
+                qty=row["total_qty"] or 0,
+                scan_count=row["n"] or 0,
+                lots_touched=row["lots"],
+            )
+            for row in grouped.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("production", "0018_scanhourly"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MachineDaily",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("scan_date", models.DateField()),
+                ("qty", models.IntegerField(default=0)),
+                ("scan_count", models.IntegerField(default=0)),
+                ("lots_touched", models.IntegerField(default=0)),
+                (
+                    "dept",
+                    models.ForeignKey(
+                        blank=True,
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="machine_daily",
+                        to="production.department",
+                    ),
+                ),
+                (
+                    "machine",
+                    models.ForeignKey(
+                        blank=True,
+                        db_index=False,
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        related_name="daily",
+                        to="production.machine",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["scan_date", "dept"], name="daily_date_dept_idx"
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("machine", "scan_date", "dept"),
+                        name="uniq_daily_machine_date_dept",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("dept__isnull", False), ("machine__isnull", True)),
+                        fields=("scan_date", "dept"),
+                        name="uniq_daily_date_dept_no_machine",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("dept__isnull", True), ("machine__isnull", False)),
+                        fields=("machine", "scan_date"),
+                        name="uniq_daily_machine_date_no_dept",
+                    ),
+                    models.UniqueConstraint(
+                        condition=models.Q(("dept__isnull", True), ("machine__isnull", True)),
+                        fields=("scan_date",),
+                        name="uniq_daily_date_no_machine_dept",
+                    ),
+                ],
+            },
+        ),
+        migrations.RunPython(fill_machine_daily, migrations.RunPython.noop),
+    ]
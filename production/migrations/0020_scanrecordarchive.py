@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:13
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0019_machinedaily'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lot',
+            name='has_archived_scans',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.CreateModel(
+            name='ScanRecordArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('qty', models.IntegerField(default=0)),
+                ('scanned_at', models.DateTimeField()),
+                ('scan_date', models.DateField()),
+                ('scan_hour', models.PositiveSmallIntegerField()),
+                ('sticker_unique_id', models.CharField(blank=True, max_length=50, null=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lot', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_scans', to='production.lot')),
+                ('machine', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='archived_scans', to='production.machine')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['lot', 'scanned_at'], name='archive_lot_time_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('sticker_unique_id__isnull', False)), fields=('lot', 'sticker_unique_id'), name='uniq_archive_lot_sticker')],
+            },
+        ),
+    ]
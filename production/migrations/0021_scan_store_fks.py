@@ -0,0 +1,59 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0020_scanrecordarchive'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='downtimelog',
+            name='lot',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='downtime_logs', to='production.lot'),
+        ),
+        migrations.AlterField(
+            model_name='machinedaily',
+            name='dept',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='machine_daily', to='production.department'),
+        ),
+        migrations.AlterField(
+            model_name='machinedaily',
+            name='machine',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='daily', to='production.machine'),
+        ),
+        migrations.AlterField(
+            model_name='scanhourly',
+            name='lot',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='hourly', to='production.lot'),
+        ),
+        migrations.AlterField(
+            model_name='scanhourly',
+            name='machine',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='hourly', to='production.machine'),
+        ),
+        migrations.AlterField(
+            model_name='scanrecord',
+            name='lot',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='scans', to='production.lot'),
+        ),
+        migrations.AlterField(
+            model_name='scanrecord',
+            name='machine',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='scans', to='production.machine'),
+        ),
+        migrations.AlterField(
+            model_name='scanrecordarchive',
+            name='lot',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_scans', to='production.lot'),
+        ),
+        migrations.AlterField(
+            model_name='scanrecordarchive',
+            name='machine',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_scans', to='production.machine'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-16 22:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('production', '0021_scan_store_fks'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='lot',
+            name='dept',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='lots', to='production.department'),
+        ),
+        migrations.AlterField(
+            model_name='lot',
+            name='machine',
+            field=models.ForeignKey(blank=True, db_constraint=False, editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='lots', to='production.machine'),
+        ),
+    ]
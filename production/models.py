@@ -4,7 +4,6 @@
 
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models import Sum
 from django.utils.timezone import now
 from django.utils import timezone
 
@@ -16,6 +15,40 @@ class Department(models.Model):
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def normalize(text):
+        """ชื่อแผนกแบบตัดช่องว่างซ้ำ + ตัวพิมพ์เล็ก ใช้จับคู่ "Paint" / " paint  " เป็นแผนกเดียวกัน"""
+        return " ".join(str(text or "").split()).casefold()
+
+    @classmethod
+    def match(cls, name, departments):
+        """id ของแผนกใน departments [(id, code, name), ...] ที่ code / name ตรงกับ name (ไม่สนตัวพิมพ์/ช่องว่าง)"""
+        key = cls.normalize(name)
+        if not key:
+            return None
+        for pk, code, dept_name in departments:
+            if key in (cls.normalize(code), cls.normalize(dept_name)):
+                return pk
+        return None
+
+    @classmethod
+    def for_name(cls, name, create=False):
+        """
+        หา Department จากชื่อ/code ที่มากับ Excel / หน้า admin (ไม่สนตัวพิมพ์/ช่องว่าง)
+        create=True (ใช้ตอน import) = ไม่พบแล้วสร้างแผนกใหม่ให้ (code = name = ชื่อที่มากับไฟล์)
+        ไม่งั้นไม่สร้าง (กันชื่อพิมพ์ผิดใน admin กลายเป็นแผนก) ไม่พบ / ชื่อว่าง = None
+        """
+        name = " ".join(str(name or "").split())
+        if not name:
+            return None
+        departments = {dept.pk: dept for dept in cls.objects.order_by("id")}
+        dept_id = cls.match(name, ((dept.pk, dept.code, dept.name) for dept in departments.values()))
+        if dept_id is not None:
+            return departments[dept_id]
+        if create:
+            return cls.objects.create(code=name[:50], name=name[:100])
+        return None
+
 
 class UserProfile(models.Model):
     ROLE_CHOICES = [
@@ -37,12 +70,99 @@ class Machine(models.Model):
     """ใช้เก็บข้อมูลจากชีท Machine List"""
 
     machine_no = models.CharField(max_length=50, unique=True)
+    # machine_no แบบตัดช่องว่าง + ตัวพิมพ์เล็ก ใช้จับคู่ "M226" / "m226 " เป็นเครื่องเดียวกัน
+    key = models.CharField(max_length=50, unique=True, editable=False)
     machine_name = models.CharField(max_length=100, blank=True)
     department = models.CharField(max_length=100, blank=True)
+    # False = เครื่องที่ migrate 0013 สร้างจากชื่อเครื่องใน scan เดิมที่ไม่มีใน Machine List
+    # (เก็บชื่อไว้ไม่ให้ข้อมูลหาย / รายงานแยกแถวตามชื่อเหมือนเดิม แต่ไม่แสดงเป็นการ์ดใน Machine View)
+    # import Machine List ที่มีชื่อนี้ -> กลายเป็นเครื่องปกติ
+    in_machine_list = models.BooleanField(default=True, verbose_name="อยู่ใน Machine List")
+    # แผนกแบบ FK (ตั้งจาก department อัตโนมัติตอน save) ใช้ filter ด้วย id
+    dept = models.ForeignKey(
+        Department,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="machines",
+    )
 
     def __str__(self):
         return f"{self.machine_no} - {self.machine_name}"
 
+    @staticmethod
+    def make_key(machine_no):
+        return (machine_no or "").strip().casefold()
+
+    @classmethod
+    def for_machine_no(cls, machine_no):
+        """
+        หา Machine จากชื่อ (ไม่สนตัวพิมพ์) เฉพาะเครื่องที่มีใน Machine List
+        ไม่สร้างเครื่องใหม่ให้ ไม่พบ / ชื่อว่าง = None
+        """
+        key = cls.make_key(machine_no)
+        if not key:
+            return None
+        return cls.objects.filter(key=key).first()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.machine_no = (self.machine_no or "").strip()
+        self.key = self.make_key(self.machine_no)
+        update_fields = kwargs.get("update_fields")
+        if (update_fields is None or "department" in update_fields) and _needs_link(
+            self, "department", "dept_id"
+        ):
+            self.dept = Department.for_name(self.department)
+        if update_fields is not None:
+            extra = set()
+            if "machine_no" in update_fields:
+                extra.add("key")
+            if "department" in update_fields:
+                extra.add("dept")
+            kwargs["update_fields"] = {*update_fields, *extra}
+        super().save(*args, **kwargs)
+        _remember_loaded(self, "department")
+
+
+def _needs_link(instance, field, fk_attname):
+    """
+    ต้องหา FK จากข้อความใหม่หรือไม่: instance ใหม่ / ข้อความเปลี่ยนจากตอนโหลด
+    หรือยังไม่ได้ผูก (เผื่อเพิ่มเครื่อง / แผนกนั้นทีหลัง) ข้อความว่าง = ตั้งเป็น None เสมอ
+    save ที่ข้อความเดิมและผูกไว้แล้ว (เช่น แก้ field อื่นใน admin) จึงไม่ query เพิ่ม
+    """
+    loaded = getattr(instance, "_loaded_values", None)
+    if loaded is None or loaded.get(field) != getattr(instance, field):
+        return True
+    return bool((getattr(instance, field) or "").strip()) and getattr(instance, fk_attname) is None
+
+
+def _remember_loaded(instance, *fields):
+    loaded = getattr(instance, "_loaded_values", None)
+    if loaded is None:
+        instance._loaded_values = loaded = {}
+    for field in fields:
+        loaded[field] = getattr(instance, field)
+
+
+class LotQuerySet(models.QuerySet):
+    def create(self, **kwargs):
+        """
+        Lot.objects.create() ที่ไม่ได้ระบุ .using(): ให้ router เลือก database จาก instance
+        (แยก shard ตามแผนก: Lot ใหม่ไป shard ของแผนก ดู db_router.ShardRouter)
+        """
+        if self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
 
 class Lot(models.Model):
     lot_no = models.CharField(max_length=100, unique=True)
@@ -62,7 +182,31 @@ class Lot(models.Model):
 
     # ผูกกับสายการผลิต
     department = models.CharField(max_length=100, blank=True, null=True)
+    # แผนกแบบ FK (ตั้งจาก department อัตโนมัติตอน save) ใช้ filter ด้วย id
+    # ไม่สร้าง index เดี่ยว ใช้ index (dept, type) แทน
+    # FK ไป Department / Machine ไม่มี constraint ใน database (Lot อาจอยู่ shard ของแผนก, ดู db_router.py)
+    # ลบ Department / Machine -> ตั้งเป็น NULL ทุก shard ใน signals.py (เหมือน SET_NULL)
+    dept = models.ForeignKey(
+        Department,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        editable=False,
+        db_index=False,
+        related_name="lots",
+    )
     machine_no = models.CharField(max_length=100, blank=True, null=True)
+    # เครื่อง Default ของ Lot (ตั้งจาก machine_no อัตโนมัติตอน save) ใช้ filter ด้วย id
+    machine = models.ForeignKey(
+        Machine,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name="lots",
+    )
     type = models.CharField(max_length=50, blank=True, null=True)
 
     # ---------- โหมดการทำงานหลัก (Setup / Production) ----------
@@ -101,6 +245,12 @@ class Lot(models.Model):
         help_text="เก็บโหมดที่เลือกจากหน้า Operator ตอนกด Start / Continue",
     )
 
+    # ---------- ยอดสะสมจากการ Scan (อัปเดตพร้อมกับการบันทึก ScanRecord) ----------
+    produced_qty = models.IntegerField(default=0, help_text="ผลรวม qty ของทุก scan")
+    scan_count = models.IntegerField(default=0, help_text="จำนวนครั้งที่ scan (กล่อง)")
+    # scan เก่าของ Lot นี้ถูกย้ายไป ScanRecordArchive แล้ว (manage.py archive_scans)
+    has_archived_scans = models.BooleanField(default=False, editable=False)
+
     # ---------- เวลา Scan จากระบบ ----------
     first_scan = models.DateTimeField(null=True, blank=True)
     last_scan = models.DateTimeField(null=True, blank=True)
@@ -109,14 +259,56 @@ class Lot(models.Model):
     start_time = models.DateTimeField(null=True, blank=True)
     end_time = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # dashboard: filter แผนก + ปุ่มแยกประเภท (Order / Sample / ...)
+            models.Index(fields=["dept", "type"], name="lot_dept_type_idx"),
+            # OEE: LOT ที่เริ่มแล้วแต่ยังไม่จบ (มีไม่กี่แถว index เลยเล็กมาก)
+            models.Index(
+                fields=["start_time"],
+                condition=models.Q(end_time__isnull=True),
+                name="lot_open_start_idx",
+            ),
+            # OEE รายวัน: LOT ที่จบในช่วงวันนั้นหรือหลังจากนั้น
+            models.Index(fields=["end_time", "start_time"], name="lot_end_start_idx"),
+        ]
+
+    objects = LotQuerySet.as_manager()
+
     def __str__(self):
         return self.lot_no
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # ผูก FK เครื่อง / แผนก ตามข้อความเมื่อ machine_no / department เปลี่ยน
+        # (หาเฉพาะแถวที่มีอยู่แล้ว ชื่อที่ไม่มีใน Machine List / Department = NULL)
+        update_fields = kwargs.get("update_fields")
+        extra = set()
+        if (update_fields is None or "machine_no" in update_fields) and _needs_link(
+            self, "machine_no", "machine_id"
+        ):
+            self.machine = Machine.for_machine_no(self.machine_no)
+            extra.add("machine")
+        if (update_fields is None or "department" in update_fields) and _needs_link(
+            self, "department", "dept_id"
+        ):
+            self.dept = Department.for_name(self.department)
+            extra.add("dept")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, *extra}
+        super().save(*args, **kwargs)
+        _remember_loaded(self, "machine_no", "department")
+
     # ------------------- Computed Fields (Production) -------------------
     @property
     def produced(self):
-        """ยอดผลิตรวมทั้งหมด (sum qty ของทุก scan)"""
-        return self.scans.aggregate(total=Sum("qty"))["total"] or 0
+        """ยอดผลิตรวมทั้งหมด (sum qty ของทุก scan) อ่านจากยอดสะสม produced_qty"""
+        return self.produced_qty or 0
 
     @property
     def progress(self):
@@ -218,22 +410,254 @@ class Lot(models.Model):
 
 
 class ScanRecord(models.Model):
-    lot = models.ForeignKey(Lot, on_delete=models.CASCADE, related_name="scans")
-    machine_no = models.CharField(max_length=50, null=True, blank=True)
+    # FK ไป Lot / Machine ไม่มี constraint ใน database (ตารางนี้อาจอยู่คนละ database, ดู db_router.py)
+    # ลบ Lot -> ลบ scan ตามใน signals.py, ลบ Machine ที่มี scan อ้างอิงอยู่ไม่ได้ (เหมือน PROTECT)
+    lot = models.ForeignKey(
+        Lot, on_delete=models.DO_NOTHING, db_constraint=False, related_name="scans"
+    )
+    # index ของ FK ตัวเดียวไม่จำเป็น ใช้ index (machine, scanned_at) แทน
+    machine = models.ForeignKey(
+        Machine,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        db_index=False,
+        related_name="scans",
+    )
     qty = models.IntegerField(default=0)
     scanned_at = models.DateTimeField(default=now)
+    # วันที่ / ชั่วโมงตามเวลาท้องถิ่น (Asia/Bangkok) ของ scanned_at เก็บไว้ตอนบันทึก
+    # รายงานรายวัน / รายชั่วโมง filter + group ด้วยคอลัมน์นี้ได้ตรง ๆ ไม่ต้องแปลง timezone ทุกแถว
+    scan_date = models.DateField(editable=False)
+    scan_hour = models.PositiveSmallIntegerField(editable=False)
 
     # --- เพิ่มบรรทัดนี้ครับ ---
     sticker_unique_id = models.CharField(max_length=50, blank=True, null=True, help_text="เก็บเลข Unique ID จาก QR Code ป้องกันซ้ำ")
 
+    class Meta:
+        constraints = [
+            # กัน sticker ซ้ำในระดับ database (เฉพาะ scan ที่มี Unique ID)
+            models.UniqueConstraint(
+                fields=["lot", "sticker_unique_id"],
+                condition=models.Q(sticker_unique_id__isnull=False),
+                name="uniq_scan_lot_sticker",
+            ),
+        ]
+        indexes = [
+            # log / กราฟของเครื่อง: machine + ช่วงเวลาของวัน
+            models.Index(fields=["machine", "scanned_at"], name="scan_machine_id_time_idx"),
+            # lot_detail / lot_chart_data: scan ของ Lot เรียงตามเวลา
+            models.Index(fields=["lot", "scanned_at"], name="scan_lot_time_idx"),
+            # productivity: ช่วงวันที่ของทุกเครื่อง (group ต่อเครื่องต่อวัน)
+            models.Index(fields=["scan_date", "machine"], name="scan_date_machine_idx"),
+            # log วันนี้ (เรียงตามเวลา) / กราฟรายชั่วโมงของเครื่อง
+            models.Index(fields=["machine", "scan_date", "scanned_at"], name="scan_machine_date_idx"),
+        ]
+
+    @staticmethod
+    def local_date_hour(dt):
+        """(วันที่, ชั่วโมง) ตามเวลาท้องถิ่นของ dt (datetime ที่ไม่มี timezone ถือว่าเป็นเวลาท้องถิ่น)"""
+        if timezone.is_naive(dt):
+            dt = timezone.make_aware(dt)
+        local = timezone.localtime(dt)
+        return local.date(), local.hour
+
+    def set_local_time(self):
+        self.scan_date, self.scan_hour = self.local_date_hour(self.scanned_at)
+
+    def save(self, *args, **kwargs):
+        self.set_local_time()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "scanned_at" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "scan_date", "scan_hour"}
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.lot.lot_no} +{self.qty} @ {self.machine_no}"
 
+    @property
+    def machine_no(self):
+        """ชื่อเครื่อง (ใช้ select_related("machine") ถ้าวนหลายแถว)"""
+        return self.machine.machine_no if self.machine_id else None
+
+
+# === Scan เก่าของ Lot ที่จบแล้ว (ย้ายออกจาก ScanRecord ด้วย manage.py archive_scans) ===
+class ScanRecordArchive(models.Model):
+    """
+    คอลัมน์เหมือน ScanRecord (id เดิม) แต่มี index แค่ที่หน้า lot_detail ใช้
+    ตาราง ScanRecord จึงเหลือแค่ scan ของ Lot ที่ยังเดิน / เพิ่งจบ -> index เล็กพอจะอยู่ใน cache
+    ยอด / กราฟอ่านจาก Lot.produced_qty และ rollup อยู่แล้ว ไม่ต้องอ่านตารางนี้
+    """
+
+    id = models.BigIntegerField(primary_key=True)
+    lot = models.ForeignKey(
+        Lot,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name="archived_scans",
+    )
+    machine = models.ForeignKey(
+        Machine,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        db_index=False,
+        related_name="archived_scans",
+    )
+    qty = models.IntegerField(default=0)
+    scanned_at = models.DateTimeField()
+    scan_date = models.DateField()
+    scan_hour = models.PositiveSmallIntegerField()
+    sticker_unique_id = models.CharField(max_length=50, blank=True, null=True)
+    archived_at = models.DateTimeField(default=now)
+
+    class Meta:
+        constraints = [
+            # กัน sticker ซ้ำกับ scan ใหม่ของ Lot เดียวกัน (ingest เช็คก่อน insert)
+            models.UniqueConstraint(
+                fields=["lot", "sticker_unique_id"],
+                condition=models.Q(sticker_unique_id__isnull=False),
+                name="uniq_archive_lot_sticker",
+            ),
+        ]
+        indexes = [
+            # lot_detail: scan ของ Lot เรียงตามเวลา
+            models.Index(fields=["lot", "scanned_at"], name="archive_lot_time_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.lot_id} +{self.qty} @ {self.scanned_at}"
+
+    @property
+    def machine_no(self):
+        return self.machine.machine_no if self.machine_id else None
+
+
+# === ยอด Scan รวมรายชั่วโมง (rollup สำหรับกราฟ) ===
+class ScanHourly(models.Model):
+    """
+    ยอดรวมต่อ Lot ต่อเครื่องต่อชั่วโมง (วันที่ / ชั่วโมงตามเวลาท้องถิ่น เหมือน ScanRecord.scan_date / scan_hour)
+    อัปเดตใน transaction เดียวกับการบันทึก Scan (production/rollups.py)
+    กราฟอ่านจากตารางนี้แทน ScanRecord -> จำนวนแถวที่อ่านขึ้นกับจำนวนชั่วโมง ไม่ใช่จำนวน scan
+    """
+
+    # index ของ lot ใช้ unique constraint (lot, scan_date, ...) แทน
+    lot = models.ForeignKey(
+        Lot,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        related_name="hourly",
+    )
+    machine = models.ForeignKey(
+        Machine,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        db_index=False,
+        related_name="hourly",
+    )
+    scan_date = models.DateField()
+    scan_hour = models.PositiveSmallIntegerField()
+    qty = models.IntegerField(default=0)
+    scan_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # ใช้เป็น index ของกราฟ Lot (lot + ช่วงวันที่) ด้วย
+            models.UniqueConstraint(
+                fields=["lot", "scan_date", "scan_hour", "machine"],
+                name="uniq_hourly_lot_hour_machine",
+            ),
+            # NULL ไม่เท่ากับ NULL ใน unique constraint ปกติ -> scan ที่ไม่ระบุเครื่องต้องมี constraint แยก
+            # (ไม่งั้น _upsert ที่ชนกัน 2 process สร้างแถวซ้ำได้)
+            models.UniqueConstraint(
+                fields=["lot", "scan_date", "scan_hour"],
+                condition=models.Q(machine__isnull=True),
+                name="uniq_hourly_lot_hour_no_machine",
+            ),
+        ]
+        indexes = [
+            # กราฟของเครื่อง: machine + วันที่
+            models.Index(fields=["machine", "scan_date", "scan_hour"], name="hourly_machine_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.lot_id} {self.scan_date} {self.scan_hour:02d}:00 +{self.qty}"
+
+
+class MachineDaily(models.Model):
+    """
+    ยอดรวมต่อเครื่องต่อแผนกต่อวัน (แผนก = แผนกของ Lot เหมือนที่หน้า Productivity filter)
+    อัปเดตพร้อม ScanHourly ตอนบันทึก Scan, คำนวณใหม่ตามช่วงวันที่ด้วย rollups.rebuild_daily()
+    หน้า Productivity / Export อ่านจากตารางนี้ -> ช่วง 1 ปีมีแค่ (จำนวนเครื่อง x 365) แถว
+    """
+
+    # index ของ machine ใช้ unique constraint (machine, scan_date, ...) แทน
+    machine = models.ForeignKey(
+        Machine,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        db_index=False,
+        related_name="daily",
+    )
+    dept = models.ForeignKey(
+        Department,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        db_index=False,
+        related_name="machine_daily",
+    )
+    scan_date = models.DateField()
+    qty = models.IntegerField(default=0)
+    scan_count = models.IntegerField(default=0)
+    # จำนวน Lot ที่มี scan บนเครื่องนี้ในวันนั้น
+    lots_touched = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["machine", "scan_date", "dept"],
+                name="uniq_daily_machine_date_dept",
+            ),
+            # เครื่อง / แผนกเป็น NULL ได้ (NULL ไม่ชนกันใน constraint ข้างบน) -> แยก constraint ตามคอลัมน์ที่เป็น NULL
+            models.UniqueConstraint(
+                fields=["scan_date", "dept"],
+                condition=models.Q(machine__isnull=True, dept__isnull=False),
+                name="uniq_daily_date_dept_no_machine",
+            ),
+            models.UniqueConstraint(
+                fields=["machine", "scan_date"],
+                condition=models.Q(machine__isnull=False, dept__isnull=True),
+                name="uniq_daily_machine_date_no_dept",
+            ),
+            models.UniqueConstraint(
+                fields=["scan_date"],
+                condition=models.Q(machine__isnull=True, dept__isnull=True),
+                name="uniq_daily_date_no_machine_dept",
+            ),
+        ]
+        indexes = [
+            # หน้า Productivity: ช่วงวันที่ (+ แผนก)
+            models.Index(fields=["scan_date", "dept"], name="daily_date_dept_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.machine_id} {self.scan_date} +{self.qty}"
+
 
 # === ตารางเก็บประวัติการหยุดเครื่อง (Downtime) ===
 class DowntimeLog(models.Model):
     lot = models.ForeignKey(
-        Lot, on_delete=models.CASCADE, related_name="downtime_logs"
+        Lot, on_delete=models.DO_NOTHING, db_constraint=False, related_name="downtime_logs"
     )
     start_time = models.DateTimeField(verbose_name="เวลาเริ่มหยุด")
     end_time = models.DateTimeField(
@@ -243,6 +667,16 @@ class DowntimeLog(models.Model):
         max_length=200, blank=True, null=True, verbose_name="สาเหตุ"
     )
 
+    class Meta:
+        indexes = [
+            # BREAK ที่ยังไม่ปิดของ LOT (ถามทุกครั้งที่เปิด / กดปุ่มหน้า OEE)
+            models.Index(
+                fields=["lot"],
+                condition=models.Q(end_time__isnull=True),
+                name="downtime_open_lot_idx",
+            ),
+        ]
+
     def __str__(self):
         return f"{self.lot.lot_no} Break: {self.start_time.strftime('%H:%M')}"
 
@@ -256,3 +690,33 @@ class DowntimeLog(models.Model):
     def duration_minutes(self):
         """คำนวณเวลาหยุดของครั้งนี้ (นาที จากวินาที)"""
         return self.duration_seconds // 60
+
+
+# === Idempotency-Key ของการ Scan (กันเครื่องสแกน retry แล้วยอดเบิ้ล) ===
+class IdempotencyKey(models.Model):
+    key = models.CharField(max_length=64, unique=True)
+    response = models.JSONField(help_text="ผลลัพธ์ที่ตอบกลับไปครั้งแรก")
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.key
+
+
+# === เครื่องสแกน / kiosk ประจำสถานี (ยืนยันตัวตนด้วย Device token แทน session) ===
+class Device(models.Model):
+    name = models.CharField(max_length=100, unique=True, verbose_name="ชื่อสถานี")
+    machine_no = models.CharField(
+        max_length=50,
+        blank=True,
+        verbose_name="เครื่อง Default",
+        help_text="ใช้เป็นเครื่องของ scan ที่ส่งมาจากสถานีนี้ ถ้าไม่ได้ระบุเครื่องมา",
+    )
+    is_active = models.BooleanField(default=True, verbose_name="ใช้งาน")
+    token_version = models.PositiveIntegerField(
+        default=0, help_text="เพิ่มทุกครั้งที่ออก token ใหม่ (token เก่าใช้ไม่ได้ทันที)"
+    )
+    token_issued_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,245 @@
+# production/rollups.py
+# ตารางยอดรวม (rollup) ที่คำนวณจาก ScanRecord ไว้ล่วงหน้าให้กราฟ / รายงานอ่าน
+#
+# - ScanHourly   : ยอดต่อ Lot ต่อเครื่องต่อชั่วโมง (กราฟ lot_detail / lot_chart_data / กราฟเครื่อง)
+# - MachineDaily : ยอดต่อเครื่องต่อแผนกต่อวัน (หน้า Productivity / Export Excel)
+#
+# ingest เรียก add_scans() ใน transaction เดียวกับ insert ScanRecord (ยอดตรงกันเสมอ)
+# import / mock / แก้ scan หรือแผนกของ Lot ตรง ๆ ใน admin
+# ให้เรียก rebuild_rollups() หรือ manage.py rebuild_rollups
+#
+# rollup อยู่ database เดียวกับ ScanRecord (db_router.SCAN_STORE_MODELS) แต่ Lot อาจอยู่อีก database
+# -> แผนกของ Lot ดึงแยกแล้วจับคู่ใน Python ไม่ join lot__dept
+
+from django.db import IntegrityError, router, transaction
+from django.db.models import Count, F, Max, Min, Sum
+
+from .db_router import scan_db
+from .models import Lot, MachineDaily, ScanHourly, ScanRecord, ScanRecordArchive
+
+
+def _upsert(model, keys, **increments):
+    """
+    บวกค่าเข้าแถวของ rollup: UPDATE ก่อน ถ้ายังไม่มีแถวค่อยสร้าง
+    (ถ้าอีก process สร้างแถวเดียวกันไปก่อน -> IntegrityError -> บวกเข้าไปแทน)
+    """
+    rows = model.objects.filter(**keys)
+    changes = {name: F(name) + value for name, value in increments.items()}
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic(using=router.db_for_write(model)):
+            model.objects.create(**keys, **increments)
+    except IntegrityError:
+        rows.update(**changes)
+
+
+def add_scans(records):
+    """
+    บวกยอดของ ScanRecord ชุดใหม่เข้า ScanHourly / MachineDaily (ต้องเรียกภายใน transaction เดียวกับ insert)
+    UPDATE ครั้งเดียวต่อ (lot, เครื่อง, ชั่วโมง) และต่อ (เครื่อง, แผนก, วัน)
+    """
+    buckets = {}
+    for rec in records:
+        key = (rec.lot_id, rec.machine_id, rec.scan_date, rec.scan_hour)
+        qty, n = buckets.get(key, (0, 0))
+        buckets[key] = (qty + (rec.qty or 0), n + 1)
+    if not buckets:
+        return
+
+    # Lot ที่ยังไม่เคยมี scan บนเครื่องนี้ในวันนี้ -> lots_touched +1 (เช็กก่อนบวก ScanHourly)
+    touched = {(lot_id, machine_id, day) for lot_id, machine_id, day, _ in buckets}
+    new_touch = {
+        key
+        for key in touched
+        if not ScanHourly.objects.filter(
+            lot_id=key[0], machine_id=key[1], scan_date=key[2]
+        ).exists()
+    }
+    lot_dept = dict(
+        Lot.objects.filter(id__in={key[0] for key in touched}).values_list("id", "dept_id")
+    )
+
+    daily = {}
+    for (lot_id, machine_id, scan_date, scan_hour), (qty, n) in buckets.items():
+        _upsert(
+            ScanHourly,
+            dict(lot_id=lot_id, machine_id=machine_id, scan_date=scan_date, scan_hour=scan_hour),
+            qty=qty,
+            scan_count=n,
+        )
+        key = (machine_id, lot_dept.get(lot_id), scan_date)
+        d_qty, d_n, d_lots = daily.get(key, (0, 0, 0))
+        daily[key] = (d_qty + qty, d_n + n, d_lots)
+
+    for lot_id, machine_id, scan_date in new_touch:
+        key = (machine_id, lot_dept.get(lot_id), scan_date)
+        d_qty, d_n, d_lots = daily[key]
+        daily[key] = (d_qty, d_n, d_lots + 1)
+
+    for (machine_id, dept_id, scan_date), (qty, n, lots) in daily.items():
+        _upsert(
+            MachineDaily,
+            dict(machine_id=machine_id, dept_id=dept_id, scan_date=scan_date),
+            qty=qty,
+            scan_count=n,
+            lots_touched=lots,
+        )
+
+
+def rebuild_hourly(lot_ids=None, date_from=None, date_to=None):
+    """
+    คำนวณ ScanHourly ใหม่จาก ScanRecord + ScanRecordArchive (ลบของเดิมในขอบเขตแล้วสร้างใหม่)
+    lot_ids=None = ทุก Lot, date_from / date_to = ช่วง scan_date (ไม่ระบุ = ทั้งหมด)
+    คืนค่าจำนวนแถว ScanHourly ที่สร้าง
+    """
+    rollup = _in_range(ScanHourly.objects.all(), lot_ids, date_from, date_to)
+
+    with transaction.atomic(using=scan_db()):
+        rollup.delete()
+        created = ScanHourly.objects.bulk_create(
+            (
+                ScanHourly(
+                    lot_id=lot_id,
+                    machine_id=machine_id,
+                    scan_date=scan_date,
+                    scan_hour=scan_hour,
+                    qty=qty,
+                    scan_count=n,
+                )
+                for (lot_id, machine_id, scan_date, scan_hour), (qty, n) in _hourly_buckets(
+                    lot_ids, date_from, date_to
+                )
+            ),
+            batch_size=1000,
+        )
+    return len(created)
+
+
+def _in_range(qs, lot_ids=None, date_from=None, date_to=None):
+    if lot_ids is not None:
+        qs = qs.filter(lot_id__in=list(lot_ids))
+    if date_from:
+        qs = qs.filter(scan_date__gte=date_from)
+    if date_to:
+        qs = qs.filter(scan_date__lte=date_to)
+    return qs
+
+
+def _hourly_buckets(lot_ids, date_from, date_to):
+    """
+    ยอดต่อ (lot, เครื่อง, วัน, ชั่วโมง) จาก ScanRecord แล้วค่อยรวม ScanRecordArchive
+    (scan ของ Lot หนึ่งอาจอยู่ทั้งสองตาราง ถ้ามี scan เข้ามาหลังถูก archive)
+    """
+    def grouped(model):
+        return (
+            _in_range(model.objects.all(), lot_ids, date_from, date_to)
+            .order_by()
+            .values_list("lot_id", "machine_id", "scan_date", "scan_hour")
+            .annotate(total_qty=Sum("qty"), n=Count("id"))
+        )
+
+    archived = {}
+    for *key, qty, n in grouped(ScanRecordArchive).iterator():
+        archived[tuple(key)] = (qty or 0, n)
+
+    for *key, qty, n in grouped(ScanRecord).iterator():
+        a_qty, a_n = archived.pop(tuple(key), (0, 0))
+        yield tuple(key), ((qty or 0) + a_qty, n + a_n)
+    yield from archived.items()
+
+
+def rebuild_daily(date_from=None, date_to=None):
+    """
+    คำนวณ MachineDaily ใหม่จาก ScanHourly ในช่วง scan_date (ไม่ระบุ = ทั้งหมด)
+    ใช้แผนกปัจจุบันของ Lot, คืนค่าจำนวนแถว MachineDaily ที่สร้าง
+    """
+    hourly = ScanHourly.objects.all()
+    rollup = MachineDaily.objects.all()
+    if date_from:
+        hourly = hourly.filter(scan_date__gte=date_from)
+        rollup = rollup.filter(scan_date__gte=date_from)
+    if date_to:
+        hourly = hourly.filter(scan_date__lte=date_to)
+        rollup = rollup.filter(scan_date__lte=date_to)
+
+    # ยอดต่อ (เครื่อง, Lot, วัน) ก่อน แล้วค่อยรวมเป็นต่อแผนกด้วยแผนกปัจจุบันของ Lot
+    grouped = (
+        hourly.order_by()
+        .values_list("machine_id", "lot_id", "scan_date")
+        .annotate(total_qty=Sum("qty"), n=Sum("scan_count"))
+    )
+    per_lot = list(grouped.iterator())
+    lot_dept = _lot_departments({lot_id for _, lot_id, *_ in per_lot})
+
+    daily = {}
+    for machine_id, lot_id, scan_date, qty, n in per_lot:
+        key = (machine_id, lot_dept.get(lot_id), scan_date)
+        d_qty, d_n, d_lots = daily.get(key, (0, 0, 0))
+        daily[key] = (d_qty + (qty or 0), d_n + (n or 0), d_lots + 1)
+
+    with transaction.atomic(using=scan_db()):
+        rollup.delete()
+        created = MachineDaily.objects.bulk_create(
+            (
+                MachineDaily(
+                    machine_id=machine_id,
+                    dept_id=dept_id,
+                    scan_date=scan_date,
+                    qty=qty,
+                    scan_count=n,
+                    lots_touched=lots,
+                )
+                for (machine_id, dept_id, scan_date), (qty, n, lots) in daily.items()
+            ),
+            batch_size=1000,
+        )
+    return len(created)
+
+
+def _lot_departments(lot_ids, chunk_size=500):
+    """{lot_id: dept_id} ทีละ chunk (จำนวน parameter ต่อ query ของ SQLite มีจำกัด)"""
+    lot_ids = sorted(lot_ids)
+    result = {}
+    for start in range(0, len(lot_ids), chunk_size):
+        result.update(
+            Lot.objects.filter(id__in=lot_ids[start:start + chunk_size]).values_list("id", "dept_id")
+        )
+    return result
+
+
+def _date_bounds(qs):
+    bounds = qs.aggregate(first=Min("scan_date"), last=Max("scan_date"))
+    return bounds["first"], bounds["last"]
+
+
+def rebuild_rollups(lot_ids=None, date_from=None, date_to=None):
+    """
+    คำนวณ ScanHourly ของ Lot ที่ระบุใหม่ แล้วคำนวณ MachineDaily ใหม่เฉพาะช่วงวันที่ที่ Lot เหล่านั้นเคยมี / มี scan
+    (MachineDaily รวมหลาย Lot ต่อแถว จึงคำนวณใหม่ทั้งวัน)
+    คืนค่า (จำนวนแถว ScanHourly, จำนวนแถว MachineDaily) ที่สร้าง
+    """
+    if lot_ids is not None:
+        lot_ids = list(lot_ids)
+        if not lot_ids:
+            return 0, 0
+
+    with transaction.atomic(using=scan_db()):
+        days = []
+        if lot_ids is not None:
+            # ช่วงวันที่ของ rollup เดิม (ก่อนลบ) + ของ scan ปัจจุบัน
+            days.extend(_date_bounds(ScanHourly.objects.filter(lot_id__in=lot_ids)))
+            days.extend(_date_bounds(ScanRecord.objects.filter(lot_id__in=lot_ids)))
+            days.extend(_date_bounds(ScanRecordArchive.objects.filter(lot_id__in=lot_ids)))
+            days = [d for d in days if d is not None]
+            if not days:
+                return 0, 0
+
+        hourly = rebuild_hourly(lot_ids, date_from, date_to)
+
+        first = max(filter(None, [min(days, default=None), date_from]), default=None)
+        last = min(filter(None, [max(days, default=None), date_to]), default=None)
+        if first and last and first > last:
+            return hourly, 0
+        daily = rebuild_daily(first, last)
+    return hourly, daily
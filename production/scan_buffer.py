@@ -0,0 +1,179 @@
+# production/scan_buffer.py
+# Write-behind buffer สำหรับ api action=scan
+#
+# แนวคิด: request ที่เข้ามาพร้อม ๆ กันจะถูกต่อคิวไว้ใน memory แล้วมี thread เดียว
+# คอยรวบไป commit เป็นกลุ่ม (1 bulk_create + อัปเดต Lot ครั้งเดียวต่อกลุ่ม)
+# แทนที่ทุก scan จะเปิด write transaction + fsync ของตัวเอง (คอขวดของ SQLite)
+#
+# - ตอบกลับหน้าเว็บ (ack) หลัง commit เสร็จแล้วเท่านั้น
+# - การเช็คซ้ำยังเหมือนเดิม เพราะ flush ใช้ ingest.ingest_scans ตัวเดียวกับ scan_batch
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import ingest
+
+
+class BufferFull(Exception):
+    """คิวเต็ม (รับ scan ไม่ทัน) ให้ผู้เรียกไปบันทึกตรงแทน"""
+
+
+class ScanBuffer:
+    def __init__(self, flush_ms=50, max_batch=200, max_queue=5000):
+        self.flush_seconds = flush_ms / 1000.0
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # สถิติ (อ่านผ่าน stats())
+        self._flush_count = 0
+        self._scans_flushed = 0
+        self._rejected_full = 0
+        self._errors = 0
+        self._last_flush_size = 0
+        self._last_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._max_flush_size = 0
+
+    # ---------- ฝั่ง request ----------
+
+    def submit(self, item):
+        """
+        ใส่ scan (dict จาก ingest.normalize_item) เข้าคิว
+        คืนค่า Future -> .result() ได้ผลลัพธ์เดียวกับ ingest.ingest_scan หลัง commit แล้ว
+        """
+        self._ensure_started()
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future))
+        except queue.Full:
+            with self._lock:
+                self._rejected_full += 1
+            raise BufferFull()
+        return future
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="scan-buffer-flusher", daemon=True
+                )
+                self._thread.start()
+
+    # ---------- ฝั่ง flusher thread ----------
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+
+            # รอเก็บเพิ่มจนครบ max_batch หรือครบเวลา flush_ms นับจากตัวแรก
+            deadline = time.monotonic() + self.flush_seconds
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._flush(batch)
+
+    def _flush(self, batch):
+        started = time.perf_counter()
+        close_old_connections()
+        try:
+            results = ingest.ingest_scans([item for item, _ in batch])
+        except Exception as exc:  # ส่ง error กลับไปให้ทุก request ในกลุ่มนี้
+            with self._lock:
+                self._errors += 1
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        finally:
+            close_old_connections()
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._flush_count += 1
+            self._scans_flushed += len(batch)
+            self._last_flush_size = len(batch)
+            self._last_flush_ms = elapsed_ms
+            self._total_flush_ms += elapsed_ms
+            self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+            self._max_flush_size = max(self._max_flush_size, len(batch))
+
+    # ---------- สถิติ ----------
+
+    def stats(self):
+        with self._lock:
+            avg = self._total_flush_ms / self._flush_count if self._flush_count else 0.0
+            return {
+                "running": bool(self._thread and self._thread.is_alive()),
+                "queue_depth": self._queue.qsize(),
+                "queue_max": self.max_queue,
+                "flush_ms": int(self.flush_seconds * 1000),
+                "max_batch": self.max_batch,
+                "flush_count": self._flush_count,
+                "scans_flushed": self._scans_flushed,
+                "rejected_full": self._rejected_full,
+                "errors": self._errors,
+                "last_flush_size": self._last_flush_size,
+                "max_flush_size": self._max_flush_size,
+                "last_flush_ms": round(self._last_flush_ms, 2),
+                "avg_flush_ms": round(avg, 2),
+                "max_flush_ms": round(self._max_flush_ms, 2),
+            }
+
+
+# ---------- instance เดียวต่อ process ----------
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    """คืน ScanBuffer ของ process นี้ (None ถ้าไม่ได้เปิด SCAN_BUFFER_ENABLED)"""
+    global _buffer
+    if not getattr(settings, "SCAN_BUFFER_ENABLED", False):
+        return None
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = ScanBuffer(
+                    flush_ms=getattr(settings, "SCAN_BUFFER_FLUSH_MS", 50),
+                    max_batch=getattr(settings, "SCAN_BUFFER_MAX_BATCH", 200),
+                    max_queue=getattr(settings, "SCAN_BUFFER_MAX_QUEUE", 5000),
+                )
+    return _buffer
+
+
+def submit_and_wait(item):
+    """
+    ส่ง scan เข้า buffer แล้วรอจน commit เสร็จ (ack หลัง commit)
+    ถ้าไม่ได้เปิด buffer หรือคิวเต็ม -> บันทึกตรงแบบเดิม
+    รอเกิน SCAN_BUFFER_ACK_TIMEOUT = TimeoutError, flush ของกลุ่มล้มเหลว = exception เดิมของ flush
+    (api แปลงทั้งสองแบบเป็น JSON error ให้เครื่องสแกนส่งซ้ำ)
+    """
+    buf = get_buffer()
+    if buf is None:
+        return ingest.ingest_scan(item)
+    try:
+        future = buf.submit(item)
+    except BufferFull:
+        return ingest.ingest_scan(item)
+    return future.result(timeout=getattr(settings, "SCAN_BUFFER_ACK_TIMEOUT", 10))
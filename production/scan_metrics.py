@@ -0,0 +1,227 @@
+# production/scan_metrics.py
+# จับเวลาแต่ละขั้นของการบันทึก Scan (parse / resolve_lot / dedup / resolve_machine / insert / lot_update / rollup / commit / total)
+#
+# - เก็บเป็น histogram ราย "นาที" ใน memory แล้วคิด p50 / p95 / p99 ย้อนหลัง N นาที
+#   (bucket แบบ log-scale ห่างกัน 20% -> ค่า percentile คลาดได้ไม่เกิน ~20%)
+# - ต่อการบันทึก 1 ครั้งใช้แค่ perf_counter + lock สั้น ๆ จึงแทบไม่มี overhead
+# - แต่ละ process เขียน snapshot ลงไฟล์เป็นระยะ ให้ manage.py scan_metrics อ่านรวมกันได้
+
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+STAGES = (
+    "parse", "resolve_lot", "dedup", "resolve_machine", "insert", "lot_update", "rollup", "commit",
+    "total", "total_batch",
+)
+
+# ขอบบนของแต่ละ bucket (มิลลิวินาที): 0.01ms ... ~130 วินาที
+BOUNDS_MS = [0.01 * 1.2 ** k for k in range(90)]
+
+
+class ScanMetrics:
+    def __init__(self, window_minutes=15, snapshot_dir=None, snapshot_interval=30):
+        self.window_minutes = window_minutes
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_interval = snapshot_interval
+        self.enabled = True
+
+        # minute (epoch // 60) -> {"stages": {stage: [count, sum_ms, max_ms, {bucket: count}]},
+        #                          "counters": {name: n}}
+        self._minutes = {}
+        self._lock = threading.Lock()
+        self._last_snapshot = time.monotonic()
+
+    # ---------- บันทึก ----------
+
+    def _current(self):
+        minute = int(time.time() // 60)
+        data = self._minutes.get(minute)
+        if data is None:
+            data = self._minutes[minute] = {"stages": {}, "counters": {}}
+            oldest = minute - self.window_minutes
+            for m in [m for m in self._minutes if m <= oldest]:
+                del self._minutes[m]
+        return data
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        ms = seconds * 1000.0
+        bucket = bisect_left(BOUNDS_MS, ms)
+        with self._lock:
+            stages = self._current()["stages"]
+            entry = stages.get(stage)
+            if entry is None:
+                entry = stages[stage] = [0, 0.0, 0.0, {}]
+            entry[0] += 1
+            entry[1] += ms
+            if ms > entry[2]:
+                entry[2] = ms
+            entry[3][bucket] = entry[3].get(bucket, 0) + 1
+        self._maybe_snapshot()
+
+    def incr(self, name, n=1):
+        if not self.enabled or not n:
+            return
+        with self._lock:
+            counters = self._current()["counters"]
+            counters[name] = counters.get(name, 0) + n
+
+    @contextmanager
+    def timed(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def count_results(self, results):
+        """นับผลลัพธ์ของ ingest แยกตาม code (success / duplicate / lot_not_found / replayed)"""
+        if not self.enabled:
+            return
+        counts = {}
+        for r in results:
+            name = "replayed" if r.get("replayed") else r.get("code") or r.get("status")
+            counts[name] = counts.get(name, 0) + 1
+        with self._lock:
+            counters = self._current()["counters"]
+            for name, n in counts.items():
+                counters[name] = counters.get(name, 0) + n
+
+    # ---------- อ่านค่า ----------
+
+    def snapshot(self):
+        """ข้อมูลดิบของ process นี้ (ใช้รวมข้าม process ด้วย summarize)"""
+        with self._lock:
+            oldest = int(time.time() // 60) - self.window_minutes
+            minutes = {
+                str(m): {
+                    "stages": {
+                        s: [e[0], e[1], e[2], {str(b): c for b, c in e[3].items()}]
+                        for s, e in data["stages"].items()
+                    },
+                    "counters": dict(data["counters"]),
+                }
+                for m, data in self._minutes.items()
+                if m > oldest
+            }
+        return {
+            "pid": os.getpid(),
+            "written_at": time.time(),
+            "window_minutes": self.window_minutes,
+            "minutes": minutes,
+        }
+
+    def summary(self):
+        return summarize([self.snapshot()], self.window_minutes)
+
+    # ---------- snapshot ลงไฟล์ ----------
+
+    def _maybe_snapshot(self):
+        if not self.snapshot_dir:
+            return
+        now = time.monotonic()
+        if now - self._last_snapshot < self.snapshot_interval:
+            return
+        self._last_snapshot = now
+        try:
+            self.write_snapshot()
+        except OSError:
+            pass  # เขียนไม่ได้ก็ไม่ต้องทำให้การ scan ล้ม
+
+    def write_snapshot(self):
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        path = os.path.join(self.snapshot_dir, f"scan-metrics-{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, path)
+
+
+# ---------- รวม / สรุปผล ----------
+
+def _percentile(buckets, total, q):
+    target = total * q
+    seen = 0
+    for b in sorted(buckets):
+        seen += buckets[b]
+        if seen >= target:
+            return BOUNDS_MS[min(b, len(BOUNDS_MS) - 1)]
+    return 0.0
+
+
+def summarize(snapshots, window_minutes):
+    """รวม snapshot หลาย process -> p50/p95/p99 ต่อ stage + counters ย้อนหลัง window_minutes นาที"""
+    oldest = int(time.time() // 60) - window_minutes
+    stages = {}
+    counters = {}
+    for snap in snapshots:
+        for minute, data in snap.get("minutes", {}).items():
+            if int(minute) <= oldest:
+                continue
+            for stage, (count, sum_ms, max_ms, buckets) in data["stages"].items():
+                acc = stages.setdefault(stage, [0, 0.0, 0.0, {}])
+                acc[0] += count
+                acc[1] += sum_ms
+                acc[2] = max(acc[2], max_ms)
+                for b, c in buckets.items():
+                    acc[3][int(b)] = acc[3].get(int(b), 0) + c
+            for name, n in data["counters"].items():
+                counters[name] = counters.get(name, 0) + n
+
+    result = {}
+    for stage in sorted(stages, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+        count, sum_ms, max_ms, buckets = stages[stage]
+        result[stage] = {
+            "count": count,
+            "avg_ms": round(sum_ms / count, 3) if count else 0.0,
+            "p50_ms": round(min(_percentile(buckets, count, 0.50), max_ms), 3),
+            "p95_ms": round(min(_percentile(buckets, count, 0.95), max_ms), 3),
+            "p99_ms": round(min(_percentile(buckets, count, 0.99), max_ms), 3),
+            "max_ms": round(max_ms, 3),
+        }
+    return {"window_minutes": window_minutes, "stages": result, "counters": counters}
+
+
+def snapshot_dir():
+    return getattr(settings, "SCAN_METRICS_DIR", None) or os.path.join(
+        tempfile.gettempdir(), "abest-scan-metrics"
+    )
+
+
+def read_snapshots(path=None, max_age=None):
+    """อ่าน snapshot ของทุก process จากโฟลเดอร์ (ข้ามไฟล์ที่เก่ากว่า max_age วินาที)"""
+    path = path or snapshot_dir()
+    snapshots = []
+    if not os.path.isdir(path):
+        return snapshots
+    for name in os.listdir(path):
+        if not (name.startswith("scan-metrics-") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(path, name), encoding="utf-8") as f:
+                snap = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if max_age is not None and time.time() - snap.get("written_at", 0) > max_age:
+            continue
+        snapshots.append(snap)
+    return snapshots
+
+
+# ---------- instance เดียวต่อ process ----------
+
+metrics = ScanMetrics(
+    window_minutes=getattr(settings, "SCAN_METRICS_WINDOW_MINUTES", 15),
+    snapshot_dir=snapshot_dir(),
+    snapshot_interval=getattr(settings, "SCAN_METRICS_SNAPSHOT_INTERVAL", 30),
+)
+metrics.enabled = getattr(settings, "SCAN_METRICS_ENABLED", True)
@@ -0,0 +1,103 @@
+# production/scan_store.py
+# ย้ายตาราง scan เดิม (SCAN_STORE_MODELS) จาก default ไป database "scans" (manage.py move_scan_store)
+#
+# ใช้ครั้งเดียวตอนเริ่มแยก database:
+#   1) ตั้ง SCAN_DATABASE_URL หรือ SQLITE_SCAN_DB=1 แล้ว manage.py migrate --database scans
+#   2) manage.py move_scan_store  (คัดลอกทีละ batch เรียงตาม id รันซ้ำต่อจากเดิมได้)
+#   3) ตรวจยอดแล้ว manage.py move_scan_store --clear-source ลบแถวเดิมใน default
+# ระหว่างคัดลอกควรหยุดเครื่องสแกน (scan ใหม่เข้า "scans" ทันทีที่ตั้งค่า ส่วนของเดิมยังอยู่ default)
+#
+# "scans" อาจมีแถวอยู่แล้ว (scan ใหม่ / คัดลอกรอบก่อน) -> เทียบทีละ id ไม่ใช้ id สูงสุดเป็นเส้นแบ่ง
+# - id ที่ยังไม่มีใน "scans" = คัดลอก
+# - id ที่มีแล้วและข้อมูลตรงกัน = คัดลอกไปแล้ว (ลบจาก default ได้)
+# - id ที่มีแล้วแต่ข้อมูลไม่ตรง (scan ใหม่ได้ id ชนกับของเดิม) = ไม่คัดลอกและไม่ลบ นับเป็น conflict ให้แก้เอง
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import connections, transaction
+
+from .db_router import SCAN_DB, SCAN_STORE_MODELS
+
+
+def scan_store_models():
+    return [apps.get_model("production", name) for name in sorted(SCAN_STORE_MODELS)]
+
+
+def _source_batches(model, source, batch_size):
+    """แถวของ model ใน source ทีละ batch เรียงตาม id"""
+    last_id = None
+    while True:
+        rows = model.objects.using(source).order_by("pk")
+        if last_id is not None:
+            rows = rows.filter(pk__gt=last_id)
+        rows = list(rows[:batch_size])
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].pk
+
+
+def _values(model, row):
+    return tuple(getattr(row, field.attname) for field in model._meta.concrete_fields)
+
+
+def _compare_with_target(model, rows):
+    """แยกแถวของ source เป็น (ยังไม่มีใน SCAN_DB, มีแล้วข้อมูลตรงกัน, มีแล้วข้อมูลไม่ตรง)"""
+    existing = {
+        row.pk: _values(model, row)
+        for row in model.objects.using(SCAN_DB).filter(pk__in=[row.pk for row in rows])
+    }
+    missing, copied, conflicts = [], [], []
+    for row in rows:
+        if row.pk not in existing:
+            missing.append(row)
+        elif existing[row.pk] == _values(model, row):
+            copied.append(row)
+        else:
+            conflicts.append(row)
+    return missing, copied, conflicts
+
+
+def copy_model(model, batch_size=2000, source="default"):
+    """
+    คัดลอกแถวของ model จาก source ไป SCAN_DB (id เดิม) เฉพาะ id ที่ยังไม่มีใน SCAN_DB
+    คืนค่า (จำนวนแถวที่คัดลอก, จำนวน id ที่ชนกับแถวอื่นใน SCAN_DB)
+    """
+    copied = conflicts = 0
+    for rows in _source_batches(model, source, batch_size):
+        missing, _, clashed = _compare_with_target(model, rows)
+        if missing:
+            with transaction.atomic(using=SCAN_DB):
+                model.objects.using(SCAN_DB).bulk_create(missing)
+        copied += len(missing)
+        conflicts += len(clashed)
+
+    if copied:
+        _reset_sequence(model)
+    return copied, conflicts
+
+
+def _reset_sequence(model):
+    """PostgreSQL: ให้ sequence ของ id ต่อจากแถวที่คัดลอกมา (SQLite ไม่ต้องทำ)"""
+    connection = connections[SCAN_DB]
+    statements = connection.ops.sequence_reset_sql(no_style(), [model])
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def clear_source(model, batch_size=2000, source="default"):
+    """
+    ลบแถวใน source เฉพาะ id ที่อยู่ใน SCAN_DB แล้วและข้อมูลตรงกัน (ทีละ batch)
+    คืนค่า (จำนวนที่ลบ, จำนวนที่เก็บไว้เพราะยังไม่ได้คัดลอก / ข้อมูลไม่ตรง)
+    """
+    deleted = kept = 0
+    for rows in _source_batches(model, source, batch_size):
+        missing, copied, conflicts = _compare_with_target(model, rows)
+        if copied:
+            with transaction.atomic(using=source):
+                model.objects.using(source).filter(pk__in=[row.pk for row in copied]).delete()
+        deleted += len(copied)
+        kept += len(missing) + len(conflicts)
+    return deleted, kept
@@ -0,0 +1,168 @@
+# production/shards.py
+# แผนกไหนอยู่ database (shard) ไหน ตาม settings.DEPARTMENT_SHARDS (router อยู่ใน db_router.ShardRouter)
+#
+# - แผนก -> shard: จับคู่ code / name ของ Department กับ key ใน DEPARTMENT_SHARDS
+#   (ตาราง Department อยู่ default, cache ไว้ทั้ง process ล้างผ่าน signals.py / หมดอายุตาม SHARD_MAP_TTL)
+# - Lot -> shard: ถามทีละ shard (default ก่อน) ใช้กับ lot_cache / view ที่รับ lot_no
+# - เครื่อง -> shard: ตามแผนกของเครื่อง (Machine.dept)
+# - ไม่ได้ตั้ง DEPARTMENT_SHARDS = ทุกอย่างอยู่ shard "default" ฟังก์ชันในนี้ไม่ query อะไรเพิ่ม
+
+import json
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .db_router import shard_aliases, use_shard
+from .models import Department, Lot, Machine
+
+
+_lock = threading.Lock()
+_dept_shards = None   # (expires_at, {dept_id: alias})
+
+
+def all_shards():
+    """default + shard ของแผนก (ลำดับตาม DEPARTMENT_SHARDS)"""
+    return [DEFAULT_DB_ALIAS, *shard_aliases()]
+
+
+def department_shards():
+    """{dept_id: alias} เฉพาะแผนกที่มี shard ของตัวเอง"""
+    global _dept_shards
+    mapping = getattr(settings, "DEPARTMENT_SHARDS", {})
+    if not mapping:
+        return {}
+    now = time.monotonic()
+    with _lock:
+        if _dept_shards and _dept_shards[0] > now:
+            return _dept_shards[1]
+
+    loaded = {}
+    for pk, code, name in Department.objects.values_list("id", "code", "name"):
+        alias = mapping.get(code) or mapping.get(name)
+        if alias:
+            loaded[pk] = alias
+    with _lock:
+        _dept_shards = (now + getattr(settings, "SHARD_MAP_TTL", 300), loaded)
+    return loaded
+
+
+def clear_cache():
+    global _dept_shards
+    with _lock:
+        _dept_shards = None
+
+
+def shard_for_department(dept_id):
+    if dept_id is None:
+        return DEFAULT_DB_ALIAS
+    return department_shards().get(dept_id, DEFAULT_DB_ALIAS)
+
+
+def shard_for_department_name(name):
+    """shard ของแผนกจากข้อความ (code หรือ name จับคู่แบบ Department.for_name) ใช้ตอน import Lot"""
+    if not Department.normalize(name) or not shard_aliases():
+        return DEFAULT_DB_ALIAS
+    dept_id = Department.match(name, Department.objects.order_by("id").values_list("id", "code", "name"))
+    return shard_for_department(dept_id)
+
+
+def shard_for_import(lot_no, department):
+    """
+    shard ที่ใช้ update_or_create Lot ตอน import: Lot เดิมอยู่ shard ไหนใช้ shard นั้น
+    (ไม่ย้าย shard ตามแผนกที่เปลี่ยน) Lot ใหม่ไป shard ของแผนก
+    """
+    if not shard_aliases():
+        return DEFAULT_DB_ALIAS
+    return locate_lots([lot_no]).get(lot_no) or shard_for_department_name(department)
+
+
+def shards_for_departments(dept_ids):
+    """
+    shard ที่ต้องถามสำหรับแผนกที่เลือก (None = Overall = ทุก shard)
+    default อยู่ในทุกชุด: Lot ที่สร้างก่อนตั้ง shard ของแผนกยังอยู่ default (ไม่ย้ายให้)
+    """
+    if not shard_aliases():
+        return [DEFAULT_DB_ALIAS]
+    if dept_ids is None:
+        return all_shards()
+    return list(dict.fromkeys([DEFAULT_DB_ALIAS, *(shard_for_department(pk) for pk in dept_ids)]))
+
+
+def locate_lots(lot_nos):
+    """{lot_no: alias} ของ Lot ที่มีอยู่จริง (ไม่พบ = ไม่อยู่ใน dict)"""
+    remaining = set(lot_nos)
+    found = {}
+    for alias in all_shards():
+        if not remaining:
+            break
+        hits = Lot.objects.using(alias).filter(lot_no__in=remaining).values_list("lot_no", flat=True)
+        for lot_no in hits:
+            found[lot_no] = alias
+            remaining.discard(lot_no)
+    return found
+
+
+def shard_for_lot(lot_no):
+    if not shard_aliases():
+        return DEFAULT_DB_ALIAS
+    return locate_lots([lot_no]).get(lot_no, DEFAULT_DB_ALIAS)
+
+
+def group_by_shard(lots):
+    """{alias: [lot_id, ...]} ของ Lot ที่โหลดมาแล้ว (ตาม database ที่โหลดมา) ใช้กับงานที่ทำทีละ shard"""
+    groups = {}
+    for lot in lots:
+        groups.setdefault(lot._state.db or DEFAULT_DB_ALIAS, []).append(lot.pk)
+    return groups
+
+
+def shard_for_machine(machine_no):
+    key = Machine.make_key(machine_no)
+    if not key or not shard_aliases():
+        return DEFAULT_DB_ALIAS
+    dept_id = Machine.objects.filter(key=key).values_list("dept_id", flat=True).first()
+    return shard_for_department(dept_id)
+
+
+def _json_lot_no(request):
+    """lot_no จาก JSON body (เช่น oee_do_action) อ่าน body ไม่ได้ / ไม่ใช่ JSON = None"""
+    if request.method != "POST" or "application/json" not in (request.content_type or ""):
+        return None
+    try:
+        payload = json.loads(request.body.decode("utf-8") or "{}")
+    except (ValueError, UnicodeDecodeError):
+        return None
+    lot_no = payload.get("lot_no") if isinstance(payload, dict) else None
+    return lot_no if isinstance(lot_no, str) else None
+
+
+def route_request(view_func):
+    """
+    view ของ Lot / เครื่องเดียว: query ทั้ง view ไปที่ shard ของ lot_no หรือ machine_no
+    (จาก URL, GET, POST หรือ JSON body) ไม่ได้แยก shard = ไม่ทำอะไร
+    """
+
+    @wraps(view_func)
+    def _wrapped(request, *args, **kwargs):
+        if not shard_aliases():
+            return view_func(request, *args, **kwargs)
+        lot_no = (
+            kwargs.get("lot_no")
+            or request.GET.get("lot_no")
+            or request.POST.get("lot_no")
+            or _json_lot_no(request)
+        )
+        machine_no = kwargs.get("machine_no") or request.GET.get("machine_no")
+        if lot_no:
+            alias = shard_for_lot(lot_no.strip())
+        elif machine_no:
+            alias = shard_for_machine(machine_no)
+        else:
+            alias = DEFAULT_DB_ALIAS
+        with use_shard(alias):
+            return view_func(request, *args, **kwargs)
+
+    return _wrapped
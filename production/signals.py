@@ -0,0 +1,108 @@
+# production/signals.py
+# ล้าง cache ของ Lot / Machine / Device เมื่อข้อมูลเปลี่ยน
+# + ทำแทน on_delete ของ FK จากตาราง Lot / Scan / Downtime (db_constraint=False อาจอยู่คนละ database)
+#   Lot / Scan แยก shard ตามแผนก -> ลบ Machine / Department ต้องไล่ทุก shard
+
+from django.db.models import ProtectedError
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import device_auth, rollups, shards
+from .db_router import use_shard
+from .lot_cache import lot_cache
+from .machine_cache import machine_cache
+from .models import (
+    Department,
+    Device,
+    DowntimeLog,
+    Lot,
+    Machine,
+    MachineDaily,
+    ScanHourly,
+    ScanRecord,
+    ScanRecordArchive,
+)
+
+
+@receiver(post_save, sender=Lot)
+@receiver(post_delete, sender=Lot)
+def invalidate_lot_cache(sender, instance, **kwargs):
+    lot_cache.invalidate(lot_no=instance.lot_no, lot_id=instance.pk)
+
+
+@receiver(post_save, sender=Machine)
+@receiver(post_delete, sender=Machine)
+def invalidate_machine_cache(sender, instance, **kwargs):
+    machine_cache.invalidate(instance.pk, key=instance.key)
+
+
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+def invalidate_device_cache(sender, instance, **kwargs):
+    device_auth.invalidate_device(instance.pk)
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def invalidate_department_shards(sender, instance, **kwargs):
+    shards.clear_cache()
+
+
+@receiver(post_save, sender=Department)
+def link_department(sender, instance, **kwargs):
+    """
+    เพิ่ม / แก้ชื่อแผนก -> ผูก Lot / เครื่องที่ยังไม่มีแผนก (dept = NULL) และข้อความแผนกตรงกับแผนกนี้ (ทุก shard)
+    แล้วคำนวณ rollup ของ Lot เหล่านั้นใหม่ (MachineDaily แยกแถวตามแผนกของ Lot)
+    """
+    departments = [(instance.pk, instance.code, instance.name)]
+
+    def unlinked(qs):
+        names = qs.filter(dept__isnull=True).exclude(department="").values_list("department", flat=True)
+        return [name for name in names.order_by().distinct() if Department.match(name, departments)]
+
+    names = unlinked(Machine.objects.all())
+    if names:
+        Machine.objects.filter(dept__isnull=True, department__in=names).update(dept=instance)
+        machine_cache.clear()
+    for alias in shards.all_shards():
+        with use_shard(alias):
+            lots = Lot.objects.filter(dept__isnull=True, department__in=unlinked(Lot.objects.all()))
+            lot_ids = list(lots.values_list("id", flat=True))
+            if lot_ids:
+                Lot.objects.filter(id__in=lot_ids).update(dept=instance)
+                rollups.rebuild_rollups(lot_ids)
+                lot_cache.clear()
+
+
+@receiver(pre_delete, sender=Lot)
+def delete_lot_scans(sender, instance, **kwargs):
+    """แทน CASCADE: ลบ scan / rollup รายชั่วโมง / downtime ของ Lot (MachineDaily คงไว้เหมือนเดิม)"""
+    with use_shard(instance._state.db):
+        for model in (ScanRecord, ScanRecordArchive, ScanHourly, DowntimeLog):
+            model.objects.filter(lot_id=instance.pk).delete()
+
+
+@receiver(pre_delete, sender=Machine)
+def protect_machine_scans(sender, instance, **kwargs):
+    """แทน PROTECT: เครื่องที่มี scan / rollup อ้างอิงอยู่ลบไม่ได้ + แทน SET_NULL ของ Lot.machine"""
+    for alias in shards.all_shards():
+        with use_shard(alias):
+            for model in (ScanRecord, ScanRecordArchive, ScanHourly, MachineDaily):
+                used = model.objects.filter(machine_id=instance.pk)[:1]
+                if used:
+                    raise ProtectedError(
+                        f"ลบเครื่อง {instance.machine_no} ไม่ได้ ยังมี {model.__name__} อ้างอิงอยู่",
+                        set(used),
+                    )
+    for alias in shards.all_shards():
+        with use_shard(alias):
+            Lot.objects.filter(machine_id=instance.pk).update(machine=None)
+
+
+@receiver(pre_delete, sender=Department)
+def unlink_department(sender, instance, **kwargs):
+    """แทน SET_NULL ของ Lot.dept / MachineDaily.dept (ทุก shard)"""
+    for alias in shards.all_shards():
+        with use_shard(alias):
+            Lot.objects.filter(dept_id=instance.pk).update(dept=None)
+            MachineDaily.objects.filter(dept_id=instance.pk).update(dept=None)
@@ -0,0 +1,223 @@
+# production/sqlite_maintenance.py
+# งานดูแลไฟล์ SQLite เป็นระยะ (manage.py db_maintain) รันระหว่างที่เครื่องสแกนกำลังเขียนได้
+#
+# - ANALYZE (จำกัดจำนวนแถวที่สุ่มด้วย analysis_limit) + PRAGMA optimize
+#   ให้ query planner มีสถิติของ index ที่เพิ่มไว้ (scan_*_idx / rollup ฯลฯ)
+# - incremental_vacuum ทีละไม่กี่ page ต่อ transaction คืนพื้นที่หลังลบ scan (mock / archive_scans)
+#   แต่ละรอบถือ write lock สั้น ๆ แล้วพักให้ ingest เขียนแทรก
+# - wal_checkpoint(PASSIVE) ไม่รอ reader / writer
+# - quick_check / integrity_check เป็นการอ่านอย่างเดียว (WAL ไม่ block การเขียน)
+# - รายงานจำนวนแถว / ขนาด table + index / พื้นที่ว่างใน page จาก virtual table dbstat
+# - refresh_replica: snapshot ทั้งไฟล์ให้ replica ของ db_router (manage.py refresh_replica)
+#
+# ทุกฟังก์ชันรับ using = alias ของ database (default, scans, shard_N) ไฟล์ที่โตเร็วที่สุด
+# (ScanRecord / rollup / IdempotencyKey) อยู่ใน scans / shard_N ไม่ใช่ default -> ต้องดูแลทุกไฟล์
+
+import sqlite3
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+
+def sqlite_aliases():
+    """
+    alias ของ database ที่เป็นไฟล์ SQLite และเขียนได้ (ไม่รวม replica snapshot ที่เปิดแบบ read-only)
+    ตอนรัน test ชื่อไฟล์ของ replica ถูกแทนด้วย database ต้นทาง -> ดู TEST MIRROR ด้วย
+    """
+    return [
+        alias
+        for alias in connections
+        if connections[alias].vendor == "sqlite"
+        and "mode=ro" not in str(connections[alias].settings_dict["NAME"])
+        and not connections[alias].settings_dict.get("TEST", {}).get("MIRROR")
+    ]
+
+
+def _pragma(cursor, sql):
+    cursor.execute(f"PRAGMA {sql}")
+    return cursor.fetchall()
+
+
+def _pragma_value(cursor, sql):
+    rows = _pragma(cursor, sql)
+    return rows[0][0] if rows else None
+
+
+def analyze(analysis_limit=None, using=DEFAULT_DB_ALIAS):
+    """ANALYZE + PRAGMA optimize, analysis_limit = จำนวนแถวที่สุ่มต่อ index (0 = ทั้งหมด)"""
+    if analysis_limit is None:
+        analysis_limit = getattr(settings, "SQLITE_ANALYSIS_LIMIT", 1000)
+    with connections[using].cursor() as cursor:
+        _pragma(cursor, f"analysis_limit = {int(analysis_limit or 0)}")
+        cursor.execute("ANALYZE")
+        _pragma(cursor, "optimize")
+
+
+def auto_vacuum_mode(using=DEFAULT_DB_ALIAS):
+    """0 = NONE, 1 = FULL, 2 = INCREMENTAL"""
+    with connections[using].cursor() as cursor:
+        return _pragma_value(cursor, "auto_vacuum")
+
+
+def enable_incremental_vacuum(using=DEFAULT_DB_ALIAS):
+    """
+    เปลี่ยนไฟล์เดิมเป็น auto_vacuum = INCREMENTAL (ต้อง VACUUM ทั้งไฟล์ 1 ครั้ง ถือ lock ตลอด)
+    ไฟล์ที่สร้างใหม่ได้ค่านี้จาก SQLITE_AUTO_VACUUM ใน sqlite_tuning อยู่แล้ว
+    """
+    with connections[using].cursor() as cursor:
+        _pragma(cursor, "auto_vacuum = INCREMENTAL")
+        cursor.execute("VACUUM")
+
+
+def incremental_vacuum(step_pages=None, max_pages=None, pause=None, using=DEFAULT_DB_ALIAS):
+    """
+    คืน page ว่าง (freelist) ทีละ step_pages ต่อ transaction จนหมดหรือครบ max_pages
+    คืนค่าจำนวน page ที่คืนให้ระบบ (0 ถ้าไฟล์ไม่ได้ตั้ง auto_vacuum = INCREMENTAL)
+    """
+    step_pages = step_pages or getattr(settings, "SQLITE_VACUUM_STEP_PAGES", 500)
+    pause = getattr(settings, "SQLITE_VACUUM_PAUSE", 0.05) if pause is None else pause
+
+    freed = 0
+    with connections[using].cursor() as cursor:
+        if _pragma_value(cursor, "auto_vacuum") != 2:
+            return 0
+        while max_pages is None or freed < max_pages:
+            before = _pragma_value(cursor, "freelist_count")
+            if not before:
+                break
+            step = step_pages if max_pages is None else min(step_pages, max_pages - freed)
+            # autocommit: PRAGMA แต่ละครั้งเป็น transaction ของตัวเอง ถือ write lock แค่ช่วงนี้
+            # (cursor.execute ของ sqlite3 step แค่ครั้งเดียว = คืนแค่ 1 page ต้องใช้ executescript)
+            connections[using].connection.executescript(f"PRAGMA incremental_vacuum({step});")
+            done = before - _pragma_value(cursor, "freelist_count")
+            if done <= 0:
+                break
+            freed += done
+            time.sleep(pause)
+    return freed
+
+
+def wal_checkpoint(using=DEFAULT_DB_ALIAS):
+    """(busy, page ใน WAL, page ที่ checkpoint แล้ว) แบบ PASSIVE ไม่รอใคร"""
+    with connections[using].cursor() as cursor:
+        rows = _pragma(cursor, "wal_checkpoint(PASSIVE)")
+    return tuple(rows[0]) if rows else None
+
+
+def integrity_check(full=False, using=DEFAULT_DB_ALIAS):
+    """คืน list ข้อความปัญหา (ว่าง = ปกติ), full=False ใช้ quick_check (ไม่เช็ค index ตรงกับ table)"""
+    with connections[using].cursor() as cursor:
+        rows = _pragma(cursor, "integrity_check" if full else "quick_check")
+    messages = [row[0] for row in rows]
+    return [] if messages == ["ok"] else messages
+
+
+def database_stats(using=DEFAULT_DB_ALIAS):
+    """ขนาดไฟล์ / page ว่างทั้งไฟล์"""
+    with connections[using].cursor() as cursor:
+        page_size = _pragma_value(cursor, "page_size")
+        page_count = _pragma_value(cursor, "page_count")
+        freelist = _pragma_value(cursor, "freelist_count")
+        mode = _pragma_value(cursor, "auto_vacuum")
+    return {
+        "page_size": page_size,
+        "page_count": page_count,
+        "size_bytes": page_size * page_count,
+        "freelist_pages": freelist,
+        "free_pct": round(freelist * 100 / page_count, 1) if page_count else 0,
+        "auto_vacuum": {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}.get(mode, mode),
+    }
+
+
+def table_stats(using=DEFAULT_DB_ALIAS):
+    """
+    ต่อ table: จำนวนแถว, ขนาด table / index รวม (bytes), ที่ว่างใน page (%)
+    และสัดส่วน leaf page ที่ไม่อยู่ติดกับ page ก่อนหน้า (fragmentation, %)
+    คืน [] ถ้า SQLite ที่ใช้ไม่ได้ compile dbstat มา
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            "SELECT name, tbl_name, type FROM sqlite_schema "
+            "WHERE type IN ('table', 'index') "
+            "AND (name NOT LIKE 'sqlite_%' OR name LIKE 'sqlite_autoindex_%')"
+        )
+        objects = {name: (tbl_name, kind) for name, tbl_name, kind in cursor.fetchall()}
+
+        try:
+            cursor.execute("SELECT name, pageno, pagetype, pgsize, unused FROM dbstat")
+        except DatabaseError:
+            return []
+
+        pages = {}  # name -> [bytes, unused, leaf, jumps, prev pageno]
+        for name, pageno, pagetype, pgsize, unused in cursor:
+            entry = pages.setdefault(name, [0, 0, 0, 0, None])
+            entry[0] += pgsize
+            entry[1] += unused
+            if pagetype == "leaf":
+                entry[2] += 1
+                if entry[4] is not None and pageno != entry[4] + 1:
+                    entry[3] += 1
+                entry[4] = pageno
+
+        tables = {}
+        for name, (tbl_name, kind) in objects.items():
+            size, unused, leaf, jumps, _ = pages.get(name, [0, 0, 0, 0, None])
+            row = tables.setdefault(
+                tbl_name,
+                {"table": tbl_name, "rows": 0, "table_bytes": 0, "index_bytes": 0,
+                 "indexes": 0, "_unused": 0, "_leaf": 0, "_jumps": 0},
+            )
+            if kind == "table":
+                row["table_bytes"] += size
+            else:
+                row["index_bytes"] += size
+                row["indexes"] += 1
+            row["_unused"] += unused
+            row["_leaf"] += leaf
+            row["_jumps"] += jumps
+
+        for tbl_name, row in tables.items():
+            cursor.execute(f'SELECT COUNT(*) FROM "{tbl_name}"')
+            row["rows"] = cursor.fetchone()[0]
+            total = row["table_bytes"] + row["index_bytes"]
+            row["unused_pct"] = round(row.pop("_unused") * 100 / total, 1) if total else 0
+            leaf, jumps = row.pop("_leaf"), row.pop("_jumps")
+            row["fragmented_pct"] = round(jumps * 100 / leaf, 1) if leaf else 0
+
+    return sorted(
+        tables.values(), key=lambda r: r["table_bytes"] + r["index_bytes"], reverse=True
+    )
+
+
+def replica_path(using=DEFAULT_DB_ALIAS):
+    """
+    ไฟล์ snapshot ของ database using: default = SQLITE_REPLICA_PATH
+    scans / shard_N = <ชื่อไฟล์>_replica.sqlite3 ข้างไฟล์เดิม (ตรงกับที่ settings.py ตั้ง <alias>_replica ไว้)
+    """
+    if using == DEFAULT_DB_ALIAS:
+        return Path(settings.SQLITE_REPLICA_PATH)
+    path = Path(connections[using].settings_dict["NAME"])
+    return path.with_name(f"{path.stem}_replica{path.suffix}")
+
+
+def refresh_replica(path=None, using=DEFAULT_DB_ALIAS):
+    """
+    คัดลอก database using ทั้งไฟล์ไปที่ไฟล์ replica (replica_path) ด้วย backup API ของ SQLite
+    - อ่านต้นทางใน read transaction เดียว (WAL: ไม่ block เครื่องสแกน) ได้ snapshot ที่ตรงกันทั้งไฟล์
+    - เขียนทับไฟล์ replica เดิมใน transaction เดียว หน้า dashboard ที่อ่านอยู่เห็นชุดเก่าจนกว่าจะเสร็จ
+    คืนค่าจำนวน page ที่คัดลอก
+    """
+    path = str(path or replica_path(using))
+    connection = connections[using]
+    connection.ensure_connection()
+    timeout = getattr(settings, "SQLITE_BUSY_TIMEOUT_MS", 5000) / 1000
+    target = sqlite3.connect(path, timeout=timeout)
+    try:
+        connection.connection.backup(target)
+        # backup เขียนทุก page ลง -wal ของ replica -> checkpoint ให้ไฟล์ -wal ไม่โตค้าง
+        target.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchall()
+        return target.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        target.close()
@@ -0,0 +1,44 @@
+# production/sqlite_tuning.py
+# ตั้งค่า SQLite ทุกครั้งที่เปิด connection ใหม่ (ผูกกับ signal connection_created ใน apps.py)
+#
+# - journal_mode=WAL   : dashboard อ่านได้ระหว่างที่เครื่องสแกนกำลังเขียน (ไม่ block กัน)
+# - synchronous=NORMAL : ใน WAL ปลอดภัยพอ (ไฟดับเสียได้แค่ transaction ล่าสุด) แต่ commit เร็วกว่ามาก
+# - busy_timeout       : ถ้ามีคนถือ write lock อยู่ให้รอคิวแทนการ error "database is locked" ทันที
+# - mmap_size / cache_size : ลดการอ่านไฟล์ซ้ำของ index ที่ใช้บ่อย
+# - auto_vacuum=INCREMENTAL : มีผลกับไฟล์ที่สร้างใหม่ (ไฟล์เดิมใช้ manage.py db_maintain --enable-incremental)
+#   ให้ db_maintain คืนพื้นที่ทีละน้อยด้วย incremental_vacuum ได้
+#
+# ส่วน BEGIN IMMEDIATE ตั้งที่ DATABASES["default"]["OPTIONS"]["transaction_mode"] ใน settings.py
+# (ทุก transaction.atomic() จอง write lock ตั้งแต่ต้น ไม่ต้องอัปเกรดจาก read -> write กลางทาง)
+
+from django.conf import settings
+
+
+def sqlite_pragmas():
+    """PRAGMA ที่จะรันต่อ connection ตามค่าใน settings (None = ไม่ตั้ง)"""
+    pragmas = {
+        # auto_vacuum ต้องมาก่อน journal_mode: เปลี่ยน journal_mode เป็น WAL จะเขียน header ของไฟล์ใหม่
+        # หลังจากนั้นตั้ง auto_vacuum ไม่มีผลแล้ว
+        "auto_vacuum": getattr(settings, "SQLITE_AUTO_VACUUM", "INCREMENTAL"),
+        "journal_mode": getattr(settings, "SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": getattr(settings, "SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": getattr(settings, "SQLITE_BUSY_TIMEOUT_MS", 5000),
+        "mmap_size": getattr(settings, "SQLITE_MMAP_SIZE", 256 * 1024 * 1024),
+        "cache_size": getattr(settings, "SQLITE_CACHE_SIZE", -64000),
+    }
+    return {name: value for name, value in pragmas.items() if value is not None}
+
+
+# PRAGMA ที่ต้องเขียนไฟล์ ตั้งกับ connection แบบ read-only (replica snapshot ?mode=ro) ไม่ได้
+WRITE_PRAGMAS = {"journal_mode", "synchronous", "auto_vacuum"}
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    read_only = "mode=ro" in str(connection.settings_dict["NAME"])
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            if read_only and name in WRITE_PRAGMAS:
+                continue
+            cursor.execute(f"PRAGMA {name} = {value}")
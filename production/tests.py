@@ -1 +1,1316 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from concurrent.futures import TimeoutError as FuturesTimeout
+from contextlib import ExitStack
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection, connections, router, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.models import QuerySet
+from django.db.migrations.executor import MigrationExecutor
+from django.http import HttpResponse
+from django.test import (
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import device_auth, ingest, rollups, scan_buffer, shards, sqlite_maintenance
+from .archive import archive_cutoff, archive_lot
+from .db_router import (
+    PIN_COOKIE,
+    SCAN_DB,
+    current_shard,
+    fan_out,
+    pin_primary,
+    read_from_replica,
+    use_replica,
+    use_shard,
+)
+from .lot_cache import lot_cache
+from .management.commands import scan_listener
+from .machine_cache import machine_cache
+from .models import (
+    Department,
+    Device,
+    DowntimeLog,
+    IdempotencyKey,
+    Lot,
+    Machine,
+    MachineDaily,
+    ScanHourly,
+    ScanRecord,
+    ScanRecordArchive,
+)
+from .scan_metrics import ScanMetrics, summarize
+from .scan_store import clear_source, copy_model
+from .views import _build_type_totals, _day_range, _department_ids
+
+
+def _at(day, hour, minute=0):
+    """เวลาท้องถิ่น (Asia/Bangkok) วันที่ 2025-01-day"""
+    return timezone.make_aware(datetime(2025, 1, day, hour, minute))
+
+
+def _item(lot_no, qty=10, sticker=None, machine_no=None, scanned_at=None, key=None):
+    """dict ของ scan 1 รายการแบบเดียวกับที่ api ส่งเข้า ingest"""
+    qr_code = f"{lot_no}|{qty}|{sticker}" if sticker else ""
+    return ingest.normalize_item(
+        {
+            "lot_no": lot_no,
+            "qty": qty,
+            "qr_code": qr_code,
+            "machine_no": machine_no,
+            "scanned_at": scanned_at.isoformat() if scanned_at else None,
+        },
+        key,
+    )
+
+
+# database ที่ test เขียนได้: default + scans / shard_N ถ้าตั้งไว้ (replica = mirror ของ test database ไม่นับ)
+WRITABLE_DATABASES = {
+    alias for alias, config in settings.DATABASES.items() if not config.get("TEST", {}).get("MIRROR")
+}
+
+
+@override_settings(DEPARTMENT_SHARDS={})  # ทุก Lot อยู่ shard default (routing ของ shard ทดสอบใน ShardRouterTests)
+class ScanTestCase(TestCase):
+    """Lot + เครื่อง 2 เครื่องสำหรับทดสอบการบันทึก scan (cache ทั้ง process ล้างทุก test)"""
+
+    databases = WRITABLE_DATABASES
+
+    def setUp(self):
+        lot_cache.clear()
+        machine_cache.clear()
+        self.addCleanup(lot_cache.clear)
+        self.addCleanup(machine_cache.clear)
+        self.dept = Department.objects.create(code="PF", name="พรีฟอร์ม")
+        self.mc1 = Machine.objects.create(machine_no="MC-01", department="PF")
+        self.mc2 = Machine.objects.create(machine_no="MC-02", department="PF")
+        self.lot = Lot.objects.create(
+            lot_no="LOT-1", machine_no="MC-01", department="PF", target=1000
+        )
+
+    def reload_lot(self):
+        return Lot.objects.get(pk=self.lot.pk)
+
+
+# ---------- กันสแกนซ้ำ (sticker) ----------
+
+class StickerDedupTests(ScanTestCase):
+    def test_batch_rejects_repeated_sticker(self):
+        results = ingest.ingest_scans([
+            _item("LOT-1", sticker="S1"),
+            _item("LOT-1", sticker="S2"),
+            _item("LOT-1", sticker="S1"),
+        ])
+        self.assertEqual([r["status"] for r in results], ["success", "success", "error"])
+        self.assertEqual(results[2]["code"], "duplicate")
+
+        # ส่ง batch เดิมซ้ำ -> ซ้ำทั้งหมด (เช็คล่วงหน้าด้วย query เดียว)
+        again = ingest.ingest_scans([_item("LOT-1", sticker="S1"), _item("LOT-1", sticker="S2")])
+        self.assertEqual([r["code"] for r in again], ["duplicate", "duplicate"])
+        self.assertEqual(ScanRecord.objects.count(), 2)
+        self.assertEqual(self.reload_lot().scan_count, 2)
+
+    def test_single_scan_duplicate_uses_unique_index(self):
+        self.assertEqual(ingest.ingest_scan(_item("LOT-1", sticker="S1"))["status"], "success")
+        with mock.patch.object(ingest, "_insert_each", wraps=ingest._insert_each) as fallback:
+            result = ingest.ingest_scan(_item("LOT-1", sticker="S1"))
+        fallback.assert_called_once()
+        self.assertEqual(result["code"], "duplicate")
+        self.assertEqual(ScanRecord.objects.count(), 1)
+        self.assertEqual(self.reload_lot().produced_qty, 10)
+
+    def test_concurrent_insert_falls_back_per_row(self):
+        """อีกเครื่องบันทึก sticker เดียวกันหลังเช็คล่วงหน้า -> ชน unique index แล้วแยกตัวซ้ำออก"""
+        real_get_many = machine_cache.get_many
+
+        def racing_get_many(names):
+            ScanRecord.objects.create(lot=self.lot, qty=10, sticker_unique_id="S1")
+            return real_get_many(names)
+
+        with mock.patch.object(machine_cache, "get_many", side_effect=racing_get_many):
+            results = ingest.ingest_scans([_item("LOT-1", sticker="S1"), _item("LOT-1", sticker="S2")])
+
+        self.assertEqual(results[0]["code"], "duplicate")
+        self.assertEqual(results[1]["status"], "success")
+        self.assertEqual(ScanRecord.objects.filter(sticker_unique_id="S2").count(), 1)
+        # ยอดสะสมนับเฉพาะรายการที่ ingest บันทึกได้
+        self.assertEqual(self.reload_lot().scan_count, 1)
+
+    def test_unknown_lot(self):
+        result = ingest.ingest_scan(_item("LOT-X", sticker="S1"))
+        self.assertEqual(result["code"], "lot_not_found")
+        self.assertFalse(ScanRecord.objects.exists())
+
+
+    def test_lot_deleted_after_caching_answers_lot_not_found(self):
+        Lot.objects.create(lot_no="LOT-2")
+        lot_cache.get_many({"LOT-1", "LOT-2"})
+        # ลบจากอีก process: cache ของ process นี้ยังมี LOT-2 อยู่
+        with mock.patch.object(lot_cache, "invalidate"):
+            Lot.objects.filter(lot_no="LOT-2").delete()
+
+        with mock.patch.object(ingest, "_insert_each", wraps=ingest._insert_each) as insert_each:
+            results = ingest.ingest_scans([_item("LOT-1", sticker="S1"), _item("LOT-2", sticker="S1")])
+        self.assertEqual([r["status"] for r in results], ["success", "error"])
+        self.assertEqual(results[1]["code"], "lot_not_found")
+        insert_each.assert_not_called()
+        self.assertEqual(ScanRecord.objects.count(), 1)
+        self.assertEqual(self.reload_lot().scan_count, 1)
+
+# ---------- ยอดสะสมใน Lot ----------
+
+class LotCounterTests(ScanTestCase):
+    def test_counters_follow_every_scan(self):
+        ingest.ingest_scans([
+            _item("LOT-1", qty=10, sticker="S1", scanned_at=_at(6, 9)),
+            _item("LOT-1", qty=25, sticker="S2", scanned_at=_at(6, 8)),
+        ])
+        ingest.ingest_scan(_item("LOT-1", qty=5, scanned_at=_at(7, 10)))
+
+        lot = self.reload_lot()
+        self.assertEqual((lot.produced_qty, lot.scan_count), (40, 3))
+        self.assertEqual((lot.first_scan, lot.last_scan), (_at(6, 8), _at(7, 10)))
+
+    def test_rebuild_matches_incremental_counts(self):
+        ingest.ingest_scans([_item("LOT-1", qty=n, sticker=f"S{n}") for n in range(1, 6)])
+        ingest.ingest_scan(_item("LOT-1", qty=7))
+        ingest.ingest_scan(_item("LOT-1", qty=7, sticker="S1"))  # ซ้ำ ไม่นับ
+        incremental = self.reload_lot()
+
+        # ล้างยอดแล้วคำนวณใหม่จาก ScanRecord ต้องได้เท่ากับที่นับไว้ตอนบันทึก
+        Lot.objects.filter(pk=self.lot.pk).update(produced_qty=0, scan_count=0)
+        self.assertEqual(ingest.rebuild_lot_counters([self.lot.pk]), 1)
+        rebuilt = self.reload_lot()
+        self.assertEqual(
+            (rebuilt.produced_qty, rebuilt.scan_count),
+            (incremental.produced_qty, incremental.scan_count),
+        )
+        self.assertEqual((rebuilt.produced_qty, rebuilt.scan_count), (22, 6))
+
+
+# ---------- api action=scan ----------
+
+class ScanApiTests(ScanTestCase):
+    def post_scan(self, **headers):
+        return self.client.post(
+            "/api/",
+            {"action": "scan", "lot_no": "LOT-1", "qty": 10, "qr_code": "LOT-1|10|S1"},
+            headers=headers,
+        )
+
+    def test_scan_ok(self):
+        response = self.post_scan()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["machine"], "MC-01")
+        self.assertEqual(self.reload_lot().produced_qty, 10)
+
+    def test_write_failure_answers_json(self):
+        failing = mock.patch.object(
+            scan_buffer, "submit_and_wait", side_effect=OperationalError("database is locked")
+        )
+        with failing, self.assertLogs("production.views", "ERROR"):
+            response = self.post_scan(**{"Idempotency-Key": "k-1"})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "1")
+        body = response.json()
+        self.assertEqual((body["code"], body["retry"], body["idempotency_key"]), ("write_failed", True, "k-1"))
+
+    def test_flush_timeout_asks_for_retry(self):
+        with mock.patch.object(scan_buffer, "submit_and_wait", side_effect=FuturesTimeout()):
+            response = self.post_scan()
+        self.assertEqual(response.status_code, 503)
+        body = response.json()
+        self.assertEqual((body["status"], body["code"], body["retry"]), ("error", "timeout", True))
+        self.assertNotIn("idempotency_key", body)
+
+
+    def post_batch(self, scans):
+        return self.client.post(
+            "/api/", {"action": "scan_batch", "scans": scans}, content_type="application/json"
+        )
+
+    def test_scan_batch_reports_each_item(self):
+        at = _at(6, 9).isoformat()
+        response = self.post_batch([
+            {"qr_code": "LOT-1|10|S1", "lot_no": "LOT-1", "qty": 10, "scanned_at": at},
+            {"qr_code": "LOT-1|10|S1", "lot_no": "LOT-1", "qty": 10, "scanned_at": at},
+            {"qr_code": "LOT-X|5|S1", "lot_no": "LOT-X", "qty": 5},
+            {"qr_code": "LOT-1|7|S2", "lot_no": "LOT-1", "qty": 7, "machine_no": "mc-02"},
+        ])
+        body = response.json()
+        self.assertEqual((body["accepted"], body["rejected"]), (2, 2))
+        self.assertEqual(
+            [r.get("code", r["status"]) for r in body["results"]],
+            ["success", "duplicate", "lot_not_found", "success"],
+        )
+        self.assertEqual(body["results"][3]["machine"], "MC-02")
+        lot = self.reload_lot()
+        self.assertEqual((lot.produced_qty, lot.scan_count, lot.first_scan), (17, 2, _at(6, 9)))
+
+    def test_scan_batch_queries_do_not_grow_with_batch_size(self):
+        def queries(first, count):
+            at = _at(6, 9).isoformat()
+            scans = [
+                {"qr_code": f"LOT-1|1|S{n}", "lot_no": "LOT-1", "qty": 1, "scanned_at": at}
+                for n in range(first, first + count)
+            ]
+            lot_cache.clear()
+            with CaptureQueriesContext(connections[router.db_for_write(ScanRecord)]) as ctx:
+                self.assertEqual(self.post_batch(scans).json()["accepted"], count)
+            return len(ctx)
+
+        queries(0, 1)  # สร้างแถว rollup ของชั่วโมงนี้ก่อน
+        self.assertEqual(queries(100, 50), queries(10, 2))
+
+# ---------- scan_date / scan_hour (เวลาท้องถิ่น) ----------
+
+class LocalScanDateTests(ScanTestCase):
+    def test_ingest_stores_local_date_and_hour(self):
+        # 17:30 UTC = 00:30 ของวันถัดไปที่ Asia/Bangkok
+        utc = datetime(2025, 1, 5, 17, 30, tzinfo=dt_timezone.utc)
+        ingest.ingest_scans([_item("LOT-1", sticker="S1", scanned_at=utc)])
+
+        rec = ScanRecord.objects.get()
+        self.assertEqual((rec.scan_date, rec.scan_hour), (_at(6, 0).date(), 0))
+
+    def test_save_follows_changed_scanned_at(self):
+        rec = ScanRecord.objects.create(lot=self.lot, qty=1, scanned_at=_at(6, 23, 59))
+        self.assertEqual((rec.scan_date, rec.scan_hour), (_at(6, 0).date(), 23))
+
+        rec.scanned_at = _at(7, 0, 1)
+        rec.save(update_fields=["scanned_at"])
+        rec = ScanRecord.objects.get(pk=rec.pk)
+        self.assertEqual((rec.scan_date, rec.scan_hour), (_at(7, 0).date(), 0))
+
+
+# ---------- PRAGMA ของ SQLite ----------
+
+class SqliteTuningTests(SimpleTestCase):
+    def connect(self, name):
+        """เปิด connection ใหม่ของ SQLite ไปที่ไฟล์ name (signal connection_created ตั้ง PRAGMA ให้)"""
+        config = {**connections["default"].settings_dict, "ENGINE": "django.db.backends.sqlite3"}
+        wrapper = SQLiteDatabaseWrapper({**config, "NAME": name, "OPTIONS": {}}, alias="tuning")
+        wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragmas(self, wrapper, *names):
+        with wrapper.cursor() as cursor:
+            return [cursor.execute(f"PRAGMA {name}").fetchone()[0] for name in names]
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "tuning.sqlite3")
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path))
+
+    def test_new_connection_gets_pragmas(self):
+        wrapper = self.connect(self.path)
+        self.assertEqual(
+            self.pragmas(wrapper, "journal_mode", "synchronous", "busy_timeout", "auto_vacuum"),
+            ["wal", 1, 5000, 2],  # synchronous 1 = NORMAL, auto_vacuum 2 = INCREMENTAL
+        )
+
+    @override_settings(SQLITE_JOURNAL_MODE=None, SQLITE_BUSY_TIMEOUT_MS=250)
+    def test_settings_override_and_skip_pragmas(self):
+        wrapper = self.connect(self.path)
+        self.assertEqual(self.pragmas(wrapper, "journal_mode", "busy_timeout"), ["delete", 250])
+
+    def test_read_only_connection_skips_write_pragmas(self):
+        self.connect(self.path).close()
+        wrapper = self.connect(f"file:{self.path}?mode=ro")
+        self.assertEqual(self.pragmas(wrapper, "journal_mode", "busy_timeout"), ["wal", 5000])
+
+    def test_sqlite_databases_begin_immediate(self):
+        for alias, config in settings.DATABASES.items():
+            if config["ENGINE"] == "django.db.backends.sqlite3" and not config.get("TEST", {}).get("MIRROR"):
+                self.assertEqual(config.get("OPTIONS", {}).get("transaction_mode"), "IMMEDIATE", alias)
+
+
+# ---------- index + ช่วงวันของ scan ----------
+
+class ScanDayRangeTests(ScanTestCase):
+    def test_day_range_is_local_midnight_to_midnight(self):
+        start, end = _day_range(_at(6, 12).date(), _at(7, 12).date())
+        self.assertEqual((start, end), (_at(6, 0), _at(8, 0)))
+
+    def test_lot_log_date_filter_keeps_whole_local_day(self):
+        ingest.ingest_scans([
+            _item("LOT-1", qty=1, sticker="S1", scanned_at=_at(5, 23, 59)),
+            _item("LOT-1", qty=2, sticker="S2", scanned_at=_at(6, 0)),
+            _item("LOT-1", qty=4, sticker="S3", scanned_at=_at(6, 23, 59)),
+            _item("LOT-1", qty=8, sticker="S4", scanned_at=_at(7, 0)),
+        ])
+        self.client.force_login(User.objects.create_user("viewer"))
+
+        response = self.client.get("/lot/LOT-1/", {"scan_from": "2025-01-06", "scan_to": "2025-01-06"})
+        self.assertEqual(sorted(s.qty for s in response.context["scan_logs"]), [2, 4])
+
+    def test_sqlite_scan_filters_use_indexes(self):
+        db = router.db_for_read(ScanRecord)
+        if connections[db].vendor != "sqlite":
+            self.skipTest("plan ของ PostgreSQL ขึ้นกับสถิติของตาราง")
+        start, end = _day_range(_at(6, 0).date())
+        scans = ScanRecord.objects.using(db).filter(scanned_at__gte=start, scanned_at__lt=end)
+
+        self.assertIn("scan_machine_id_time_idx", scans.filter(machine=self.mc1).order_by("scanned_at").explain())
+        self.assertIn("scan_lot_time_idx", scans.filter(lot=self.lot).order_by("-scanned_at").explain())
+
+
+# ---------- scan_listener (เครื่องสแกน TCP) ----------
+
+@override_settings(DEPARTMENT_SHARDS={})
+class ScanListenerTests(TransactionTestCase):
+    """บันทึกผ่าน ingest จริงใน thread ของ listener (TransactionTestCase: thread อื่นต้องเห็นข้อมูล)"""
+
+    databases = WRITABLE_DATABASES
+
+    def setUp(self):
+        lot_cache.clear()
+        machine_cache.clear()
+        self.addCleanup(lot_cache.clear)
+        self.addCleanup(machine_cache.clear)
+        Department.objects.create(code="PF", name="พรีฟอร์ม")
+        Machine.objects.create(machine_no="MC-01", department="PF")
+        Lot.objects.create(lot_no="LOT-1", machine_no="MC-01", department="PF", target=1000)
+
+    def exchange(self, listener, lines):
+        """ส่งบรรทัดผ่าน TCP จริง 1 connection แล้วคืนบรรทัดที่ตอบกลับ"""
+
+        async def run():
+            listener._queue = asyncio.Queue()
+            batcher = asyncio.create_task(listener._batcher())
+            server = await asyncio.start_server(
+                listener.handle_client, "127.0.0.1", 0, limit=scan_listener.MAX_LINE_BYTES
+            )
+            port = server.sockets[0].getsockname()[1]
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.write("".join(line + "\n" for line in lines).encode("utf-8"))
+                writer.write_eof()
+                replies = (await reader.read()).decode("utf-8").splitlines()
+                writer.close()
+                return replies
+            finally:
+                server.close()
+                batcher.cancel()
+
+        try:
+            return asyncio.run(asyncio.wait_for(run(), 10))
+        finally:
+            # ปิด connection ของ thread บันทึก ไม่ให้ค้างตอนลบ test database
+            listener._executor.submit(connections.close_all).result()
+            listener._executor.shutdown(wait=True)
+
+    def test_parse_line_rejects_bad_format(self):
+        listener = scan_listener.ScanListener(machine_no="MC-01")
+        self.addCleanup(listener._executor.shutdown)
+        for line in ["LOT-1|5", "LOT-1|5|A|B", "LOT-1||A", "LOT-1|x|A", "LOT-1|0|A"]:
+            self.assertIsNone(listener.parse_line(line), line)
+        item = listener.parse_line("LOT-1|5|A")
+        self.assertEqual((item["lot_no"], item["qty"], item["machine_no"]), ("LOT-1", 5, "MC-01"))
+
+    def test_lines_are_ingested_and_answered_in_order(self):
+        listener = scan_listener.ScanListener(flush_ms=20)
+        replies = self.exchange(listener, ["LOT-1|5|A", "garbage", "LOT-1|5|A", "NOPE|1|X", "LOT-1|3|B"])
+
+        self.assertEqual(replies, [
+            "ACK|LOT-1|5|A|MC-01",
+            "NAK|bad_format|garbage",
+            "NAK|duplicate|LOT-1|5|A",
+            "NAK|lot_not_found|NOPE|1|X",
+            "ACK|LOT-1|3|B|MC-01",
+        ])
+        self.assertEqual((listener.acked, listener.nacked), (2, 3))
+        self.assertEqual(
+            sorted(ScanRecord.objects.values_list("sticker_unique_id", "qty")), [("A", 5), ("B", 3)]
+        )
+        lot = Lot.objects.get(lot_no="LOT-1")
+        self.assertEqual((lot.produced_qty, lot.scan_count), (8, 2))
+
+
+# ---------- scan_metrics ----------
+
+class ScanMetricsTests(SimpleTestCase):
+    def test_percentiles_stay_within_bucket_error(self):
+        m = ScanMetrics(snapshot_dir=None)
+        for ms in range(1, 101):
+            m.record("insert", ms / 1000.0)
+
+        s = m.summary()["stages"]["insert"]
+        self.assertEqual((s["count"], s["avg_ms"], s["max_ms"]), (100, 50.5, 100.0))
+        # bucket ห่างกัน 20% -> ค่าที่ได้คือขอบบนของ bucket (ไม่ต่ำกว่าค่าจริง และไม่เกิน max)
+        for key, exact in [("p50_ms", 50), ("p95_ms", 95), ("p99_ms", 99)]:
+            self.assertGreaterEqual(s[key], exact)
+            self.assertLessEqual(s[key], exact * 1.2)
+        self.assertLessEqual(s["p99_ms"], s["max_ms"])
+
+    def test_snapshots_of_processes_are_merged(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+
+        first = ScanMetrics(snapshot_dir=path)
+        first.record("total", 0.002)
+        first.count_results([{"status": "success"}, {"status": "error", "code": "duplicate"}])
+        first.write_snapshot()
+        # แต่ละ process เขียนไฟล์ตาม pid ของตัวเอง
+        os.rename(
+            os.path.join(path, f"scan-metrics-{os.getpid()}.json"), os.path.join(path, "scan-metrics-1.json")
+        )
+        second = ScanMetrics(snapshot_dir=path)
+        second.record("total", 0.040)
+        second.count_results([{"status": "success", "replayed": True}, {"status": "success"}])
+        second.write_snapshot()
+
+        out = io.StringIO()
+        call_command("scan_metrics", "--dir", path, "--json", stdout=out)
+        data = json.loads(out.getvalue())
+
+        self.assertEqual(data["processes"], 2)
+        self.assertEqual(data["counters"], {"success": 2, "duplicate": 1, "replayed": 1})
+        total = data["stages"]["total"]
+        self.assertEqual((total["count"], total["max_ms"]), (2, 40.0))
+
+    def test_minutes_outside_window_are_dropped(self):
+        m = ScanMetrics(snapshot_dir=None)
+        m.record("total", 0.001)
+        snap = m.snapshot()
+        old = str(int(time.time() // 60) - 20)
+        snap["minutes"][old] = {"stages": {"total": [5, 50.0, 30.0, {"10": 5}]}, "counters": {"success": 5}}
+
+        data = summarize([snap], 15)
+        self.assertEqual(data["stages"]["total"]["count"], 1)
+        self.assertEqual(data["counters"], {})
+
+
+# ---------- lot_cache + sticker ที่ถูก archive ----------
+
+class ArchivedStickerTests(ScanTestCase):
+    def test_archived_sticker_is_duplicate_with_cached_lot(self):
+        ingest.ingest_scan(_item("LOT-1", sticker="S1"))
+        self.assertIsNotNone(lot_cache.get("LOT-1"))  # Lot อยู่ใน cache ก่อน archive
+
+        # archive_scans อีก process: cache ของ process นี้ไม่ถูกล้าง
+        with mock.patch.object(lot_cache, "invalidate"):
+            self.assertEqual(archive_lot(self.lot), 1)
+        self.assertFalse(ScanRecord.objects.exists())
+
+        self.assertEqual(ingest.ingest_scan(_item("LOT-1", sticker="S1"))["code"], "duplicate")
+        results = ingest.ingest_scans([_item("LOT-1", sticker="S1"), _item("LOT-1", sticker="S2")])
+        self.assertEqual([r["status"] for r in results], ["error", "success"])
+        self.assertEqual(self.reload_lot().scan_count, 2)
+
+
+# ---------- archive_scans ----------
+
+class ArchiveScansTests(ScanTestCase):
+    def setUp(self):
+        super().setUp()
+        recent = timezone.now() - timedelta(days=3)
+        for lot_no, target in [("LOT-RUN", 1000), ("LOT-FULL", 20), ("LOT-RECENT", 10)]:
+            Lot.objects.create(lot_no=lot_no, machine_no="MC-01", department="PF", target=target)
+        ingest.ingest_scans([
+            _item("LOT-1", qty=10, sticker="S1", scanned_at=_at(6, 8)),
+            _item("LOT-1", qty=20, sticker="S2", scanned_at=_at(6, 9)),
+            _item("LOT-RUN", qty=5, sticker="R1", scanned_at=_at(6, 8)),
+            _item("LOT-FULL", qty=20, sticker="F1", scanned_at=_at(6, 8)),
+            _item("LOT-RECENT", qty=10, sticker="N1", scanned_at=recent),
+        ])
+        # LOT-1 กด END แล้ว / LOT-FULL ยอดถึงเป้า / LOT-RUN ยังเดิน / LOT-RECENT เพิ่งมี scan
+        Lot.objects.filter(lot_no="LOT-1").update(end_time=_at(6, 10))
+        Lot.objects.filter(lot_no="LOT-RECENT").update(end_time=recent)
+
+    def test_cutoff_is_first_day_of_month(self):
+        self.assertEqual(archive_cutoff(6, today=date(2025, 1, 15)), date(2024, 7, 1))
+        self.assertEqual(archive_cutoff(1, today=date(2025, 1, 31)), date(2024, 12, 1))
+
+    def test_moves_only_finished_cold_lots(self):
+        out = io.StringIO()
+        call_command("archive_scans", "--dry-run", stdout=out)
+        self.assertIn("จะย้าย 3 scan จาก 2 Lot", out.getvalue())
+        self.assertEqual(ScanRecordArchive.objects.count(), 0)
+
+        call_command("archive_scans", stdout=io.StringIO())
+        self.assertEqual(
+            sorted(ScanRecordArchive.objects.values_list("sticker_unique_id", flat=True)), ["F1", "S1", "S2"]
+        )
+        self.assertEqual(sorted(ScanRecord.objects.values_list("sticker_unique_id", flat=True)), ["N1", "R1"])
+        self.assertEqual(
+            sorted(Lot.objects.filter(has_archived_scans=True).values_list("lot_no", flat=True)),
+            ["LOT-1", "LOT-FULL"],
+        )
+
+    def test_lot_detail_merges_archived_scans(self):
+        archive_lot(self.lot)
+        Lot.objects.filter(pk=self.lot.pk).update(end_time=None)
+        ingest.ingest_scan(_item("LOT-1", qty=3, sticker="S3", scanned_at=_at(6, 8, 30)))
+        self.client.force_login(User.objects.create_user("viewer"))
+
+        response = self.client.get("/lot/LOT-1/")
+        self.assertEqual([s.qty for s in response.context["scan_logs"]], [20, 3, 10])
+        response = self.client.get("/lot/LOT-1/", {"scan_order": "qty_asc"})
+        self.assertEqual([s.qty for s in response.context["scan_logs"]], [3, 10, 20])
+
+
+# ---------- Idempotency-Key ----------
+
+class IdempotencyKeyTests(ScanTestCase):
+    def test_retry_replays_first_response(self):
+        first = ingest.ingest_scan(_item("LOT-1", qty=12, key="k-1"))
+        again = ingest.ingest_scan(_item("LOT-1", qty=12, key="k-1"))
+        self.assertEqual(first["status"], "success")
+        self.assertTrue(again["replayed"])
+        self.assertEqual(again["qty"], 12)
+        self.assertEqual(ScanRecord.objects.count(), 1)
+        self.assertEqual(self.reload_lot().produced_qty, 12)
+
+    def test_repeated_key_in_one_batch(self):
+        results = ingest.ingest_scans([_item("LOT-1", key="k-1"), _item("LOT-1", key="k-1")])
+        self.assertNotIn("replayed", results[0])
+        self.assertTrue(results[1]["replayed"])
+        self.assertEqual(ScanRecord.objects.count(), 1)
+
+    def test_long_key_is_hashed(self):
+        key = "x" * 100
+        ingest.ingest_scan(_item("LOT-1", key=key))
+        self.assertEqual(len(IdempotencyKey.objects.get().key), 64)
+        self.assertTrue(ingest.ingest_scan(_item("LOT-1", key=key))["replayed"])
+
+    def test_expired_key_is_not_replayed(self):
+        ingest.ingest_scan(_item("LOT-1", key="k-1"))
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        result = ingest.ingest_scan(_item("LOT-1", key="k-1"))
+        self.assertNotIn("replayed", result)
+        self.assertEqual(ScanRecord.objects.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_purge_removes_only_expired_keys(self):
+        ingest.ingest_scans([_item("LOT-1", key="old"), _item("LOT-1", key="new")])
+        IdempotencyKey.objects.filter(key="old").update(expires_at=timezone.now())
+        self.assertEqual(ingest.purge_idempotency_keys(), 1)
+        self.assertEqual(list(IdempotencyKey.objects.values_list("key", flat=True)), ["new"])
+
+    def test_purge_visits_every_shard(self):
+        visited = []
+        real_use_shard = ingest.use_shard
+
+        def recording_use_shard(alias):
+            visited.append(alias)
+            return real_use_shard(None)
+
+        shards = mock.patch.object(ingest, "all_shards", return_value=["default", "shard_1"])
+        with shards, mock.patch.object(ingest, "use_shard", side_effect=recording_use_shard):
+            ingest.purge_idempotency_keys()
+        self.assertEqual(visited, ["default", "shard_1"])
+
+
+# ---------- คิวออฟไลน์ของหน้า scan (api action=scan_batch) ----------
+
+class OfflineQueueTests(ScanTestCase):
+    def post_batch(self, scans):
+        """ส่งแบบเดียวกับ syncQueue() ใน scan.html"""
+        return self.client.post(
+            "/api/", {"action": "scan_batch", "scans": scans}, content_type="application/json"
+        )
+
+    def test_resent_batch_is_replayed_not_counted_twice(self):
+        scans = [
+            {"idempotency_key": "q-1", "qr_code": "LOT-1|10|S1", "lot_no": "LOT-1", "qty": "10"},
+            {"idempotency_key": "q-2", "qr_code": "LOT-X|5|S1", "lot_no": "LOT-X", "qty": "5"},
+        ]
+        first = self.post_batch(scans).json()["results"]
+        # ได้คำตอบไม่ทัน (network หลุด) -> คิวส่ง batch เดิมซ้ำด้วย key เดิม
+        again = self.post_batch(scans).json()["results"]
+        self.assertEqual([r["status"] for r in again], ["success", "error"])
+        self.assertTrue(again[0]["replayed"])
+        self.assertEqual(again[0]["qty"], first[0]["qty"])
+        self.assertEqual(again[1]["code"], "lot_not_found")
+        self.assertEqual((self.reload_lot().produced_qty, ScanRecord.objects.count()), (10, 1))
+
+    @override_settings(SCAN_BATCH_MAX_ITEMS=1)
+    def test_rejected_batch_is_4xx(self):
+        # 4xx = ส่งซ้ำก็ไม่ผ่าน -> หน้า scan ส่งทีละรายการแล้วพักรายการนั้นไว้
+        scans = [{"lot_no": "LOT-1", "qty": 1}, {"lot_no": "LOT-1", "qty": 2}]
+        self.assertEqual(self.post_batch(scans).status_code, 400)
+        self.assertEqual(self.post_batch(["LOT-1"]).status_code, 400)
+        self.assertEqual(self.post_batch(scans[:1]).status_code, 200)
+
+    @override_settings(IDEMPOTENCY_KEY_TTL=600)
+    def test_scan_page_keeps_seen_stickers_for_key_ttl(self):
+        self.client.force_login(User.objects.create_user("operator"))
+        response = self.client.get("/scan/")
+        self.assertContains(response, "const SEEN_TTL_MS = 600000;")
+
+
+# ---------- Device token ----------
+
+class DeviceTokenTests(ScanTestCase):
+    def setUp(self):
+        super().setUp()
+        self.device = Device.objects.create(name="Station 2", machine_no="MC-02")
+        self.addCleanup(device_auth.invalidate_device, self.device.pk)
+
+    def post_scan(self, token):
+        return self.client.post(
+            "/api/",
+            {"action": "scan", "lot_no": "LOT-1", "qty": 10},
+            headers={"Authorization": f"Device {token}"},
+        )
+
+    def test_token_authenticates_device(self):
+        token = device_auth.issue_token(self.device)
+        self.assertEqual(device_auth.authenticate(token), self.device)
+        self.assertIsNone(device_auth.authenticate(token + "x"))
+        self.assertIsNone(device_auth.authenticate("not-a-token"))
+
+    def test_new_token_revokes_old_one(self):
+        old = device_auth.issue_token(self.device)
+        self.assertIsNotNone(device_auth.authenticate(old))  # อยู่ใน cache แล้ว
+        new = device_auth.issue_token(self.device)
+        self.assertIsNone(device_auth.authenticate(old))
+        self.assertEqual(device_auth.authenticate(new), self.device)
+
+    def test_deactivated_device_is_rejected(self):
+        token = device_auth.issue_token(self.device)
+        self.assertIsNotNone(device_auth.authenticate(token))
+        self.device.is_active = False
+        self.device.save()
+        self.assertIsNone(device_auth.authenticate(token))
+
+    def test_scan_with_token_skips_session(self):
+        response = self.post_scan(device_auth.issue_token(self.device))
+        self.assertEqual(response.status_code, 200)
+        # ไม่ได้ระบุเครื่อง -> เครื่อง Default ของสถานี
+        self.assertEqual(response.json()["machine"], "MC-02")
+        self.assertNotIn("sessionid", response.cookies)
+        self.assertEqual(ScanRecord.objects.get().machine, self.mc2)
+
+    def test_revoked_token_gets_401(self):
+        token = device_auth.issue_token(self.device)
+        device_auth.issue_token(self.device)
+        response = self.post_scan(token)
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(ScanRecord.objects.exists())
+
+    def test_browser_keeps_session_and_csrf(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(User.objects.create_user("operator"))
+        action = {"action": "start", "lot_no": "LOT-1"}
+        self.assertEqual(client.post("/api/oee/action/", action).status_code, 403)  # ไม่มี CSRF token
+
+        response = client.get("/scan/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("sessionid", response.cookies)  # session ของ browser ยังบันทึกตามปกติ
+
+        # header Device ไม่ต้องมี CSRF token และไม่แตะ session
+        token = device_auth.issue_token(self.device)
+        response = Client(enforce_csrf_checks=True).post(
+            "/api/oee/action/", action, headers={"Authorization": f"Device {token}"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("sessionid", response.cookies)
+
+
+# ---------- OEE (START / BREAK / END) ----------
+
+# รายงาน OEE อ่านจาก replica: ใน TestCase เป็นอีก connection ที่ไม่เห็นข้อมูลใน transaction ของ test
+@override_settings(DATABASE_ROUTERS=[r for r in settings.DATABASE_ROUTERS if not r.endswith(".ReplicaRouter")])
+class OeeTests(ScanTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(User.objects.create_user("operator"))
+
+    def action(self, action):
+        return self.client.post("/api/oee/action/", {"action": action, "lot_no": "LOT-1"})
+
+    def test_break_resume_end_follow_the_open_break(self):
+        self.assertTrue(self.action("start").json()["actions"]["can_break"])
+        data = self.action("break").json()
+        self.assertTrue(data["lot"]["has_open_break"])
+        self.assertEqual(
+            data["actions"], {"can_start": False, "can_break": False, "can_resume": True, "can_end": True}
+        )
+
+        response = self.action("break")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(DowntimeLog.objects.count(), 1)
+
+        self.assertFalse(self.action("resume").json()["lot"]["has_open_break"])
+        self.action("break")
+        data = self.action("end").json()
+        self.assertFalse(data["lot"]["has_open_break"])
+        self.assertFalse(DowntimeLog.objects.filter(end_time__isnull=True).exists())
+
+    def test_status_probes_downtime_twice(self):
+        self.action("start")
+        self.action("break")
+        with ExitStack() as stack:
+            captured = [
+                stack.enter_context(CaptureQueriesContext(connections[alias])) for alias in self.databases
+            ]
+            data = self.client.get("/api/oee/status/", {"lot_no": "LOT-1"}).json()
+        self.assertTrue(data["actions"]["can_resume"])
+        table = DowntimeLog._meta.db_table
+        # BREAK ค้าง 1 + downtime รวมของ lot_time_payload 1
+        self.assertEqual(sum(table in q["sql"] for ctx in captured for q in ctx.captured_queries), 2)
+
+    def test_daily_report_lots_of_the_day(self):
+        Lot.objects.filter(pk=self.lot.pk).update(start_time=_at(5, 8))
+        for lot_no, start, end in [
+            ("LOT-E", _at(6, 8), _at(6, 10)),
+            ("LOT-OLD", _at(4, 8), _at(5, 10)),
+            ("LOT-NEXT", _at(7, 8), None),
+        ]:
+            Lot.objects.create(lot_no=lot_no, department="PF", start_time=start, end_time=end)
+
+        response = self.client.get("/oee/daily/", {"date": "2025-01-06"})
+        self.assertEqual(sorted(row["lot_no"] for row in response.context["rows"]), ["LOT-1", "LOT-E"])
+
+    def test_sqlite_open_break_probe_uses_partial_index(self):
+        db = router.db_for_read(DowntimeLog)
+        if connections[db].vendor != "sqlite":
+            self.skipTest("plan ของ PostgreSQL ขึ้นกับสถิติของตาราง")
+        plan = DowntimeLog.objects.using(db).filter(lot=self.lot, end_time__isnull=True).explain()
+        self.assertIn("downtime_open_lot_idx", plan)
+
+
+# ---------- Machine / Department FK ----------
+
+class MachineLinkTests(ScanTestCase):
+    def test_scan_matches_machine_ignoring_case(self):
+        result = ingest.ingest_scan(_item("LOT-1", machine_no=" mc-02 "))
+        self.assertEqual(result["machine"], "MC-02")
+        self.assertEqual(ScanRecord.objects.get().machine, self.mc2)
+
+    def test_unknown_machine_is_null_not_created(self):
+        result = ingest.ingest_scan(_item("LOT-1", machine_no="Unknown-Machine"))
+        self.assertEqual(result["machine"], "Unknown-Machine")
+        self.assertIsNone(ScanRecord.objects.get().machine_id)
+        self.assertEqual(Machine.objects.count(), 2)
+
+    def test_lot_links_only_existing_master_rows(self):
+        lot = Lot.objects.create(lot_no="LOT-2", machine_no="m999", department="ไม่มีแผนกนี้")
+        self.assertEqual((lot.machine_id, lot.dept_id), (None, None))
+        self.assertEqual(Machine.objects.count(), 2)
+        self.assertEqual(Department.objects.count(), 1)
+        self.assertEqual((self.lot.machine, self.lot.dept), (self.mc1, self.dept))
+
+        # เพิ่มเครื่องใน Machine List ทีหลัง -> save ครั้งถัดไปผูกให้
+        m999 = Machine.objects.create(machine_no="M999")
+        lot = Lot.objects.get(pk=lot.pk)
+        lot.save()
+        self.assertEqual(lot.machine, m999)
+
+    def test_lot_detail_filters_unassigned_scans(self):
+        ingest.ingest_scans([
+            _item("LOT-1", qty=10, sticker="S1"),
+            _item("LOT-1", qty=3, sticker="S2", machine_no="Unknown-Machine"),
+        ])
+        self.client.force_login(User.objects.create_user("viewer"))
+
+        response = self.client.get("/lot/LOT-1/")
+        self.assertEqual(response.context["scan_machines"], ["MC-01"])
+        self.assertContains(response, '<option value="__none__" >ไม่ระบุเครื่อง</option>', html=True)
+        self.assertNotContains(response, 'value="None"')
+
+        response = self.client.get("/lot/LOT-1/", {"scan_machine": "__none__"})
+        self.assertEqual([s.qty for s in response.context["scan_logs"]], [3])
+        self.assertEqual(sum(response.context["chart_daily"]), 3)
+
+    def test_saving_linked_lot_does_not_look_up_again(self):
+        lot = Lot.objects.get(pk=self.lot.pk)
+        lot.remark = "แก้หมายเหตุ"
+        with self.assertNumQueries(1):
+            lot.save()
+
+        lot.machine_no = "MC-02"
+        lot.save(update_fields=["machine_no"])
+        self.assertEqual(Lot.objects.get(pk=lot.pk).machine, self.mc2)
+
+
+class DepartmentLinkTests(ScanTestCase):
+    def test_department_text_ignores_case_and_spaces(self):
+        lot = Lot.objects.create(lot_no="LOT-2", department="  pf ")
+        machine = Machine.objects.create(machine_no="MC-03", department="พรีฟอร์ม  ")
+        self.assertEqual((lot.dept, machine.dept), (self.dept, self.dept))
+        self.assertEqual(Department.for_name(" Pf", create=True), self.dept)
+        self.assertEqual(_department_ids(" pF "), [self.dept.pk])
+
+    def test_import_creates_missing_department(self):
+        paint = Department.for_name("  Paint   Line ", create=True)
+        self.assertEqual((paint.code, paint.name), ("Paint Line", "Paint Line"))
+        self.assertEqual(Department.for_name("paint line"), paint)
+        self.assertIsNone(Department.for_name("", create=True))
+
+    def test_new_department_links_waiting_lots(self):
+        lot = Lot.objects.create(lot_no="LOT-2", machine_no="MC-02", department="Paint")
+        machine = Machine.objects.create(machine_no="MC-03", department="paint")
+        ingest.ingest_scan(_item("LOT-2", qty=7, machine_no="MC-02"))
+        self.assertEqual(MachineDaily.objects.get().dept_id, None)
+
+        paint = Department.objects.create(code="PAINT", name="พ่น")
+        self.assertEqual(Lot.objects.get(pk=lot.pk).dept, paint)
+        self.assertEqual(Machine.objects.get(pk=machine.pk).dept, paint)
+        self.assertEqual(list(MachineDaily.objects.values_list("dept_id", "qty")), [(paint.pk, 7)])
+        self.assertEqual(Lot.objects.get(pk=self.lot.pk).dept, self.dept)
+
+
+def _migrate(target):
+    executor = MigrationExecutor(connection)
+    executor.migrate(target)
+    return executor.loader.project_state(target).apps
+
+
+@unittest.skipIf(WRITABLE_DATABASES != {"default"}, "migration test ใช้ database default อย่างเดียว")
+@override_settings(DATABASE_ROUTERS=[])
+class MachineMigrationTests(TransactionTestCase):
+    """0013: ชื่อเครื่องใน scan เดิมที่ไม่มีใน Machine List ต้องไม่หาย (รายงานแยกแถวเหมือนก่อน migrate)"""
+
+    before = [("production", "0012_scanrecord_query_indexes")]
+    after = [("production", "0022_lot_shard_fks")]
+
+    def setUp(self):
+        apps = _migrate(self.before)
+        self.addCleanup(_migrate, self.after)
+        Machine = apps.get_model("production", "Machine")
+        Lot = apps.get_model("production", "Lot")
+        ScanRecord = apps.get_model("production", "ScanRecord")
+
+        Machine.objects.create(machine_no="M525", machine_name="Preform 1", department="พรีฟอร์ม")
+        lot = Lot.objects.create(lot_no="LOT-1", machine_no="M525", department="พรีฟอร์ม")
+        # ชื่อเครื่องแบบที่เจอใน database จริง: ไม่มีใน Machine List / เป็นชื่อแผนก
+        self.scans = [("M525", 10), ("M525", 20), ("MC-01", 5), ("MC-01", 7), ("พรีฟอร์ม", 3)]
+        for machine_no, qty in self.scans:
+            ScanRecord.objects.create(lot=lot, machine_no=machine_no, qty=qty, scanned_at=_at(6, 9))
+
+    def test_unlisted_names_keep_their_own_rows(self):
+        _migrate(self.after)
+        lot_cache.clear()
+        machine_cache.clear()
+
+        unlisted = Machine.objects.filter(in_machine_list=False)
+        self.assertEqual(sorted(unlisted.values_list("machine_no", flat=True)), ["MC-01", "พรีฟอร์ม"])
+        self.assertFalse(ScanRecord.objects.filter(machine__isnull=True).exists())
+
+        # Productivity ต่อเครื่อง = แบบก่อน migrate (group ตามข้อความ machine_no)
+        baseline = {}
+        for machine_no, qty in self.scans:
+            baseline[machine_no] = baseline.get(machine_no, 0) + qty
+        self.client.force_login(User.objects.create_user("viewer"))
+        response = self.client.get(
+            "/productivity/report/", {"department": "Overall", "from": "2025-01-06", "to": "2025-01-06"}
+        )
+        rows = {row["machine_no"]: row["total"] for row in response.context["machine_rows"]}
+        self.assertEqual(rows, baseline)
+
+        # Machine View แสดงแค่เครื่องใน Machine List
+        response = self.client.get("/dashboard/", {"department": "Overall", "view": "machine"})
+        self.assertEqual([m["machine_no"] for m in response.context["machines"]], ["M525"])
+
+    def test_reverse_restores_machine_text(self):
+        _migrate(self.after)
+        apps = _migrate(self.before)
+        ScanRecord = apps.get_model("production", "ScanRecord")
+        self.assertEqual(
+            sorted(ScanRecord.objects.values_list("machine_no", "qty")), sorted(self.scans)
+        )
+        self.assertEqual(apps.get_model("production", "Machine").objects.count(), 1)
+
+
+@unittest.skipIf(WRITABLE_DATABASES != {"default"}, "migration test ใช้ database default อย่างเดียว")
+@override_settings(DATABASE_ROUTERS=[])
+class DepartmentMigrationTests(TransactionTestCase):
+    """0014: ผูกแผนกแบบไม่สนตัวพิมพ์/ช่องว่าง ชื่อที่ไม่มีในตาราง Department สร้างให้"""
+
+    before = [("production", "0013_machine_fk")]
+    after = [("production", "0022_lot_shard_fks")]
+
+    def test_links_and_creates_departments(self):
+        apps = _migrate(self.before)
+        self.addCleanup(_migrate, self.after)
+        Department = apps.get_model("production", "Department")
+        Lot = apps.get_model("production", "Lot")
+        pf = Department.objects.create(code="PF", name="พรีฟอร์ม")
+        Lot.objects.create(lot_no="LOT-1", department=" พรีฟอร์ม")
+        Lot.objects.create(lot_no="LOT-2", department="pf ")
+        Lot.objects.create(lot_no="LOT-3", department="Paint  Line")
+        Lot.objects.create(lot_no="LOT-4", department="paint line")
+        Lot.objects.create(lot_no="LOT-5", department="")
+
+        apps = _migrate([("production", "0014_department_fk")])
+        Lot = apps.get_model("production", "Lot")
+        paint = apps.get_model("production", "Department").objects.get(code="Paint Line")
+        self.assertEqual(
+            dict(Lot.objects.values_list("lot_no", "dept_id")),
+            {"LOT-1": pf.pk, "LOT-2": pf.pk, "LOT-3": paint.pk, "LOT-4": paint.pk, "LOT-5": None},
+        )
+
+
+@unittest.skipIf(WRITABLE_DATABASES != {"default"}, "migration test ใช้ database default อย่างเดียว")
+@override_settings(DATABASE_ROUTERS=[])
+class LocalDateMigrationTests(TransactionTestCase):
+    """0015: scan เดิมได้ scan_date / scan_hour ตามเวลาท้องถิ่น ไม่ใช่ UTC"""
+
+    before = [("production", "0014_department_fk")]
+    after = [("production", "0022_lot_shard_fks")]
+
+    def test_backfills_local_date_and_hour(self):
+        apps = _migrate(self.before)
+        self.addCleanup(_migrate, self.after)
+        Lot = apps.get_model("production", "Lot")
+        ScanRecord = apps.get_model("production", "ScanRecord")
+        lot = Lot.objects.create(lot_no="LOT-1")
+        for qty, scanned_at in [(1, _at(5, 23, 30)), (2, _at(6, 0, 30)), (3, _at(6, 7, 59))]:
+            ScanRecord.objects.create(lot=lot, qty=qty, scanned_at=scanned_at)
+
+        apps = _migrate([("production", "0015_scanrecord_local_date")])
+        ScanRecord = apps.get_model("production", "ScanRecord")
+        self.assertEqual(
+            sorted(ScanRecord.objects.values_list("qty", "scan_date", "scan_hour")),
+            [(1, _at(5, 0).date(), 23), (2, _at(6, 0).date(), 0), (3, _at(6, 0).date(), 7)],
+        )
+
+
+# ---------- rollup (ScanHourly / MachineDaily) ----------
+
+class RollupTests(ScanTestCase):
+    def setUp(self):
+        super().setUp()
+        self.lot2 = Lot.objects.create(lot_no="LOT-2", machine_no="MC-02")  # ไม่มีแผนก
+        ingest.ingest_scans([
+            _item("LOT-1", qty=10, sticker="S1", scanned_at=_at(6, 8, 5)),
+            _item("LOT-1", qty=20, sticker="S2", scanned_at=_at(6, 8, 50)),
+            _item("LOT-1", qty=30, sticker="S3", scanned_at=_at(6, 9), machine_no="MC-02"),
+            _item("LOT-1", qty=30, sticker="S3", scanned_at=_at(6, 9)),  # ซ้ำ
+            _item("LOT-2", qty=5, scanned_at=_at(6, 23, 30)),
+        ])
+        ingest.ingest_scan(_item("LOT-1", qty=40, sticker="S4", scanned_at=_at(7, 0, 10)))
+        ingest.ingest_scan(_item("LOT-2", qty=7, scanned_at=_at(7, 1), machine_no="Unknown-Machine"))
+
+    def rollup_rows(self):
+        hourly = set(
+            ScanHourly.objects.values_list("lot_id", "machine_id", "scan_date", "scan_hour", "qty", "scan_count")
+        )
+        daily = set(
+            MachineDaily.objects.values_list("machine_id", "dept_id", "scan_date", "qty", "scan_count", "lots_touched")
+        )
+        return hourly, daily
+
+    def test_incremental_rollups_match_rebuild(self):
+        hourly, daily = self.rollup_rows()
+        self.assertIn((self.lot.pk, self.mc1.pk, _at(6, 8).date(), 8, 30, 2), hourly)
+        self.assertIn((self.mc2.pk, None, _at(6, 8).date(), 5, 1, 1), daily)
+        self.assertIn((self.mc2.pk, self.dept.pk, _at(6, 8).date(), 30, 1, 1), daily)
+        self.assertIn((None, None, _at(7, 1).date(), 7, 1, 1), daily)
+
+        rollups.rebuild_rollups()
+        self.assertEqual(self.rollup_rows(), (hourly, daily))
+
+    def test_rebuild_of_one_lot_keeps_other_lots(self):
+        before = self.rollup_rows()
+        ScanHourly.objects.filter(lot_id=self.lot2.pk).delete()
+        self.assertEqual(rollups.rebuild_rollups([self.lot2.pk])[0], 2)
+        self.assertEqual(self.rollup_rows(), before)
+
+    def test_archive_keeps_rollups_and_counters(self):
+        before = self.rollup_rows()
+        counters = self.reload_lot().produced_qty, self.reload_lot().scan_count
+
+        self.assertEqual(archive_lot(self.lot), 4)
+        self.assertEqual(ScanRecordArchive.objects.count(), 4)
+        self.assertEqual(self.rollup_rows(), before)
+
+        # คำนวณใหม่จาก ScanRecord + ScanRecordArchive ต้องได้เท่าเดิม
+        rollups.rebuild_rollups()
+        ingest.rebuild_lot_counters()
+        self.assertEqual(self.rollup_rows(), before)
+        self.assertEqual((self.reload_lot().produced_qty, self.reload_lot().scan_count), counters)
+        self.assertEqual(counters, (100, 4))
+
+    def test_scan_after_archive_is_added_to_same_rollup(self):
+        archive_lot(self.lot)
+        ingest.ingest_scan(_item("LOT-1", qty=1, sticker="S5", scanned_at=_at(6, 8, 59)))
+        after = self.rollup_rows()
+        self.assertIn((self.lot.pk, self.mc1.pk, _at(6, 8).date(), 8, 31, 3), after[0])
+        rollups.rebuild_rollups()
+        self.assertEqual(self.rollup_rows(), after)
+
+    def test_hour_bucket_is_local_time(self):
+        # 17:20 UTC = 00:20 ของวันที่ 7 (Asia/Bangkok) -> ชั่วโมงเดียวกับ S4
+        utc = datetime(2025, 1, 6, 17, 20, tzinfo=dt_timezone.utc)
+        ingest.ingest_scan(_item("LOT-1", qty=2, sticker="S5", scanned_at=utc))
+        hourly, _ = self.rollup_rows()
+        self.assertIn((self.lot.pk, self.mc1.pk, _at(7, 0).date(), 0, 42, 2), hourly)
+
+        self.client.force_login(User.objects.create_user("viewer"))
+        response = self.client.get("/lot/LOT-1/", {"agg": "hour", "scan_from": "2025-01-07"})
+        self.assertEqual(response.context["chart_daily"][:2], [42, 0])
+
+    def test_bucket_without_machine_is_unique(self):
+        keys = dict(lot_id=self.lot2.pk, machine_id=None, scan_date=_at(7, 1).date(), scan_hour=1)
+        with self.assertRaises(IntegrityError), transaction.atomic(using=router.db_for_write(ScanHourly)):
+            ScanHourly.objects.create(**keys, qty=1, scan_count=1)
+
+        # อีก process สร้างแถวไปก่อน (UPDATE แรกไม่เจอแถว) -> create ชน constraint -> บวกเข้าแถวเดิม
+        real_update = QuerySet.update
+        calls = []
+
+        def racing_update(qs, **kwargs):
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else real_update(qs, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", racing_update):
+            rollups._upsert(ScanHourly, keys, qty=3, scan_count=1)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(list(ScanHourly.objects.filter(**keys).values_list("qty", "scan_count")), [(10, 2)])
+
+    def test_daily_bucket_with_null_keys_is_unique(self):
+        day = _at(7, 1).date()
+        for machine_id, dept_id in ((None, None), (self.mc2.pk, None), (None, self.dept.pk)):
+            MachineDaily.objects.get_or_create(machine_id=machine_id, dept_id=dept_id, scan_date=day)
+            with self.assertRaises(IntegrityError), transaction.atomic(using=router.db_for_write(MachineDaily)):
+                MachineDaily.objects.create(machine_id=machine_id, dept_id=dept_id, scan_date=day)
+
+# ---------- db_maintain (SQLite) ----------
+
+@override_settings(DEPARTMENT_SHARDS={}, SQLITE_VACUUM_PAUSE=0)
+class DbMaintainTests(TransactionTestCase):
+    """VACUUM ทำใน transaction ไม่ได้ -> TransactionTestCase"""
+
+    databases = WRITABLE_DATABASES
+
+    def test_maintains_every_sqlite_database(self):
+        aliases = sqlite_maintenance.sqlite_aliases()
+        if "default" not in aliases:
+            self.skipTest("db_maintain ใช้กับ SQLite เท่านั้น")
+        lot = Lot.objects.create(lot_no="LOT-1", target=1000)
+        scans = ScanRecord.objects.bulk_create(
+            ScanRecord(lot=lot, qty=1, scanned_at=_at(6, 8), scan_date=_at(6, 8).date(), scan_hour=8)
+            for _ in range(3000)
+        )
+        call_command("db_maintain", "--enable-incremental", "--skip-check", stdout=io.StringIO())
+        # ลบ scan แล้ว page ว่างต้องถูกคืนด้วย incremental vacuum
+        ScanRecord.objects.filter(pk__in=[s.pk for s in scans[:2000]]).delete()
+
+        out = io.StringIO()
+        call_command("db_maintain", "--json", stdout=out)
+        reports = json.loads(out.getvalue())
+
+        self.assertEqual(sorted(reports), sorted(aliases))
+        for alias, report in reports.items():
+            self.assertEqual(report["steps"]["integrity"], "ok", alias)
+            self.assertEqual(report["database"]["auto_vacuum"], "INCREMENTAL", alias)
+        report = reports[router.db_for_write(ScanRecord)]
+        self.assertGreater(report["steps"]["vacuum_pages"], 0)
+        self.assertEqual(report["database"]["freelist_pages"], 0)
+        tables = {row["table"]: row for row in report["tables"]}
+        if tables:  # SQLite ที่ไม่มี dbstat รายงานต่อ table ไม่ได้
+            self.assertEqual(tables[ScanRecord._meta.db_table]["rows"], 1000)
+
+    def test_rejects_database_that_is_not_writable_sqlite(self):
+        with self.assertRaises(CommandError):
+            call_command("db_maintain", "--database", "replica", stdout=io.StringIO())
+
+
+# ---------- database router (replica / scans / shard) ----------
+# ตั้ง settings.DATABASES = default + aliases ให้ router เห็น (ไม่ขึ้นกับ env ที่ใช้รัน test)
+# ไม่ได้เปิด connection ไปที่ database เหล่านั้น
+
+def _databases(*aliases):
+    default = settings.DATABASES["default"]
+    return mock.patch.dict(
+        settings.DATABASES, {alias: dict(default) for alias in ("default", *aliases)}, clear=True
+    )
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    def test_without_replica_everything_reads_default(self):
+        with _databases(), use_replica():
+            self.assertEqual(router.db_for_read(Machine), "default")
+            self.assertEqual(router.db_for_read(ScanRecord), "default")
+
+    def test_reads_go_to_replica_only_inside_use_replica(self):
+        with _databases("replica"):
+            self.assertEqual(router.db_for_read(Machine), "default")
+            with use_replica():
+                self.assertEqual(router.db_for_read(Machine), "replica")
+                self.assertEqual(router.db_for_read(Lot), "replica")
+                self.assertEqual(router.db_for_write(Machine), "default")
+            self.assertFalse(router.allow_migrate("replica", "production", model_name="lot"))
+
+    def test_pin_cookie_keeps_browser_on_default(self):
+        @read_from_replica
+        def view(request):
+            return HttpResponse(router.db_for_read(Lot))
+
+        @pin_primary
+        def write_view(request):
+            return HttpResponse("ok")
+
+        factory = RequestFactory()
+        with _databases("replica"):
+            self.assertEqual(view(factory.get("/")).content, b"replica")
+            response = write_view(factory.post("/"))
+            self.assertIn(PIN_COOKIE, response.cookies)
+            pinned = factory.get("/")
+            pinned.COOKIES[PIN_COOKIE] = "1"
+            self.assertEqual(view(pinned).content, b"default")
+        with _databases():
+            self.assertNotIn(PIN_COOKIE, write_view(factory.post("/")).cookies)
+
+
+class ScanStoreRouterTests(SimpleTestCase):
+    def test_scan_tables_go_to_scans(self):
+        with _databases("scans"):
+            for model in (ScanRecord, ScanRecordArchive, ScanHourly, MachineDaily, IdempotencyKey):
+                self.assertEqual(router.db_for_read(model), "scans")
+                self.assertEqual(router.db_for_write(model), "scans")
+            self.assertEqual(router.db_for_write(Lot), "default")
+            self.assertTrue(router.allow_migrate("scans", "production", model_name="scanrecord"))
+            self.assertFalse(router.allow_migrate("scans", "production", model_name="lot"))
+            self.assertFalse(router.allow_migrate("default", "production", model_name="scanrecord"))
+
+    def test_scans_replica_is_read_only_path(self):
+        with _databases("scans", "replica", "scans_replica"), use_replica():
+            self.assertEqual(router.db_for_read(ScanRecord), "scans_replica")
+            self.assertEqual(router.db_for_write(ScanRecord), "scans")
+            self.assertEqual(router.db_for_read(Lot), "replica")
+
+    def test_scans_without_own_replica_reads_scans(self):
+        with _databases("scans", "replica"), use_replica():
+            self.assertEqual(router.db_for_read(ScanRecord), "scans")
+
+
+@unittest.skipUnless(SCAN_DB in WRITABLE_DATABASES, "ต้องตั้ง database \"scans\" (SCAN_DATABASE_URL)")
+class MoveScanStoreTests(TransactionTestCase):
+    """move_scan_store: "scans" มีแถวอยู่แล้วต้องไม่ข้าม / ไม่ลบแถวของ default ที่ยังไม่ได้คัดลอก"""
+
+    databases = WRITABLE_DATABASES
+
+    def setUp(self):
+        # ตาราง scan ใน default = ตารางเดิมก่อนแยก database (router ไม่ migrate ให้แล้ว)
+        with connections["default"].schema_editor() as editor:
+            editor.create_model(MachineDaily)
+        self.addCleanup(self.drop_source_table)
+
+        rows = [(1, 10), (2, 20), (3, 30)]
+        MachineDaily.objects.using("default").bulk_create(
+            MachineDaily(pk=pk, machine_id=pk, scan_date=_at(6, 0).date(), qty=qty) for pk, qty in rows
+        )
+        # "scans": id 1 คัดลอกไปแล้ว, id 2 / 10 เป็น rollup ใหม่ (id 2 ชนกับของเดิม)
+        MachineDaily.objects.using(SCAN_DB).bulk_create([
+            MachineDaily(pk=1, machine_id=1, scan_date=_at(6, 0).date(), qty=10),
+            MachineDaily(pk=2, machine_id=7, scan_date=_at(7, 0).date(), qty=5),
+            MachineDaily(pk=10, machine_id=8, scan_date=_at(7, 0).date(), qty=6),
+        ])
+
+    def drop_source_table(self):
+        with connections["default"].schema_editor() as editor:
+            editor.delete_model(MachineDaily)
+
+    def rows(self, alias):
+        return list(MachineDaily.objects.using(alias).order_by("pk").values_list("pk", "machine_id", "qty"))
+
+    def test_prepopulated_target_keeps_unconfirmed_rows(self):
+        self.assertEqual(copy_model(MachineDaily), (1, 1))
+        self.assertEqual(self.rows(SCAN_DB), [(1, 1, 10), (2, 7, 5), (3, 3, 30), (10, 8, 6)])
+
+        self.assertEqual(clear_source(MachineDaily), (2, 1))
+        self.assertEqual(self.rows("default"), [(2, 2, 20)])
+        self.assertEqual(len(self.rows(SCAN_DB)), 4)
+
+        # id ที่ชนกันยังค้างอยู่ -> command จบด้วย error ให้ตรวจเอง
+        with mock.patch(
+            "production.management.commands.move_scan_store.scan_store_models", return_value=[MachineDaily]
+        ), self.assertRaises(CommandError):
+            call_command("move_scan_store", stdout=io.StringIO())
+
+@override_settings(DEPARTMENT_SHARDS={"PF": "shard_1"})
+class ShardRouterTests(TestCase):
+    def setUp(self):
+        shards.clear_cache()
+        self.addCleanup(shards.clear_cache)
+        # alias shard_1 มีเฉพาะใน _databases() -> สร้างแผนกตอนยังไม่แยก shard (signal ไล่ผูก Lot ทุก shard)
+        with override_settings(DEPARTMENT_SHARDS={}):
+            self.dept = Department.objects.create(code="PF", name="พรีฟอร์ม")
+            self.other = Department.objects.create(code="SP", name="พ่น")
+
+    def test_sharded_models_follow_use_shard(self):
+        with _databases("shard_1"), use_shard("shard_1"):
+            self.assertEqual(current_shard(), "shard_1")
+            for model in (Lot, ScanRecord, ScanHourly, IdempotencyKey):
+                self.assertEqual(router.db_for_read(model), "shard_1")
+                self.assertEqual(router.db_for_write(model), "shard_1")
+            # ข้อมูลหลักอยู่ default เสมอ
+            self.assertEqual(router.db_for_read(Machine), "default")
+            self.assertEqual(router.db_for_write(Department), "default")
+
+    def test_new_lot_goes_to_department_shard(self):
+        with _databases("shard_1"):
+            self.assertEqual(router.db_for_write(Lot, instance=Lot(dept=self.dept)), "shard_1")
+            self.assertEqual(router.db_for_write(Lot, instance=Lot(dept=self.other)), "default")
+            self.assertEqual(router.db_for_write(Lot, instance=Lot()), "default")
+
+    def test_instance_from_shard_replica_writes_to_shard(self):
+        lot = Lot(lot_no="LOT-1")
+        lot._state.adding = False
+        lot._state.db = "shard_1_replica"
+        with _databases("shard_1", "shard_1_replica"):
+            self.assertEqual(router.db_for_write(Lot, instance=lot), "shard_1")
+            with use_replica(), use_shard("shard_1"):
+                self.assertEqual(router.db_for_read(Lot), "shard_1_replica")
+
+    def test_migrate_only_sharded_tables_on_shard(self):
+        with _databases("shard_1"):
+            self.assertTrue(router.allow_migrate("shard_1", "production", model_name="lot"))
+            self.assertTrue(router.allow_migrate("shard_1", "production", model_name="scanrecord"))
+            self.assertFalse(router.allow_migrate("shard_1", "production", model_name="machine"))
+            self.assertFalse(router.allow_migrate("shard_1", "auth", model_name="user"))
+
+    def test_overall_fans_out_to_every_shard(self):
+        self.assertEqual(shards.all_shards(), ["default", "shard_1"])
+        self.assertEqual(shards.shards_for_departments(None), ["default", "shard_1"])
+        self.assertEqual(shards.shards_for_departments([self.dept.pk]), ["default", "shard_1"])
+        self.assertEqual(shards.shards_for_departments([self.other.pk]), ["default"])
+        self.assertEqual(fan_out(current_shard, shards.all_shards()), ["default", "shard_1"])
+
+
+# ---------- กล่องนับตาม type (dashboard) ----------
+
+class TypeTotalsTests(TestCase):
+    def test_counts_and_targets_in_one_query(self):
+        for n, (lot_type, target) in enumerate(
+            [("Order", 100), ("order", 50), ("Sample", 10), ("Claim", 0), (None, 999)]
+        ):
+            Lot.objects.create(lot_no=f"LOT-{n}", type=lot_type, target=target)
+
+        with self.assertNumQueries(1):
+            type_counts, qty_by_type = _build_type_totals(Lot.objects.all())
+
+        self.assertEqual(
+            type_counts,
+            {"all": 5, "order": 2, "sample": 1, "reserved": 0, "extra": 0, "claim": 1},
+        )
+        self.assertEqual(
+            qty_by_type,
+            {"Order": 150, "Sample": 10, "Reserved": 0, "Extra": 0, "Claim": 0},
+        )
+        # ไม่มี Lot เลย -> 0 ทุกช่อง (Sum ของแถวว่างเป็น None)
+        type_counts, qty_by_type = _build_type_totals(Lot.objects.filter(lot_no="ไม่มี"))
+        self.assertEqual(set(type_counts.values()) | set(qty_by_type.values()), {0})
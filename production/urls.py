@@ -41,6 +41,8 @@ urlpatterns = [
     path("data-collect/", views.data_collect, name="data_collect"),
     path("user-control/", views.user_control, name="user_control"),
     path("api/", views.api, name="api"),
+    path("api/scan-buffer/", views.scan_buffer_status, name="scan_buffer_status"),
+    path("api/scan-metrics/", views.scan_metrics_status, name="scan_metrics_status"),
     path("export/productivity/",views.export_productivity_excel,name="export_productivity_excel",),
     path("dashboard/machine/<str:machine_no>/mini-chart/",views.machine_mini_chart,name="machine_mini_chart",),
     path("dashboard/machine/<str:machine_no>/chart-data/", views.machine_chart_data, name="machine_chart_data"),
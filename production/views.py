@@ -1,17 +1,22 @@
 from datetime import datetime, timedelta, time
 
 import json
+import logging
+import time as time_mod
+from concurrent.futures import TimeoutError as FuturesTimeout
+from operator import attrgetter
 import openpyxl
 import pandas as pd
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.sessions.models import Session
 from django.core.management.base import BaseCommand
-from django.db import transaction
-from django.db.models import Sum, Q
-from django.db.models.functions import TruncDate, TruncHour, TruncMonth, Coalesce
+from django.db import router, transaction
+from django.db.models import Count, Max, Min, Sum, Q
+from django.db.models.functions import TruncMonth
 from django.http import JsonResponse, HttpResponse, Http404
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse
@@ -27,9 +32,22 @@ import base64
 
 from openpyxl.utils import get_column_letter
 
-from .models import Lot, ScanRecord, UserProfile, Machine, DowntimeLog, Department
+from . import archive, ingest, rollups, scan_buffer
+from .db_router import fan_out, pin_primary, read_from_replica, scan_db, use_shard
+from .device_auth import device_or_login_required
+from .lot_cache import lot_cache
+from .scan_metrics import metrics as scan_metrics, read_snapshots, summarize
+from .shards import (
+    group_by_shard,
+    route_request,
+    shard_for_import,
+    shard_for_lot,
+    shards_for_departments,
+)
+from .models import Lot, ScanRecord, ScanHourly, MachineDaily, UserProfile, Machine, DowntimeLog, Department
 
 
+logger = logging.getLogger(__name__)
 
 MONTH_TH = {
     1: "ม.ค.", 2: "ก.พ.", 3: "มี.ค.", 4: "เม.ย.",
@@ -40,6 +58,26 @@ MONTH_TH = {
 # label ชื่อแผนก
 LABELS = {"Overall": "ภาพรวม", "Preform": "พรีฟอร์ม"}
 
+# ประเภท Lot บน dashboard: key ของปุ่ม / type_counts -> ค่าใน Lot.type
+LOT_TYPES = {
+    "order": "Order",
+    "sample": "Sample",
+    "reserved": "Reserved",
+    "extra": "Extra",
+    "claim": "Claim",
+}
+
+# ลำดับตารางประวัติการสแกน (scan_order ของหน้า lot_detail)
+SCAN_LOG_ORDERING = {
+    "newest": ("-scanned_at",),
+    "oldest": ("scanned_at",),
+    "qty_desc": ("-qty", "-scanned_at"),
+    "qty_asc": ("qty", "-scanned_at"),
+}
+
+# scan_machine ของ scan ที่ไม่ได้ผูกกับเครื่อง (machine_id = NULL) ในหน้า lot_detail
+NO_MACHINE = "__none__"
+
 # ---------- Helper functions (ORM + shared logic) ----------
 
 def _is_staff_or_admin(user):
@@ -49,12 +87,113 @@ def _is_staff_or_admin(user):
     return (up and up.role in ["admin", "staff"]) or user.is_staff or user.is_superuser
 
 
-def _annotate_lots(qs):
+def _day_start(day):
+    """เวลา 00:00 ของวันนั้นตาม timezone ท้องถิ่น"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _day_range(day_from, day_to=None):
+    """
+    ช่วงเวลา [00:00 ของ day_from, 00:00 ของวันถัดจาก day_to) สำหรับ filter scanned_at
+    ใช้แทน scanned_at__date=... (__date ต้องแปลงค่าทุกแถว จึงใช้ index ไม่ได้)
+    """
+    return _day_start(day_from), _day_start((day_to or day_from) + timedelta(days=1))
+
+
+def _qty_by_hour(scans):
+    """
+    ยอด qty รายชั่วโมง {0: ..., 23: ...} ของ scans (ต้อง filter ให้เหลือวันเดียวก่อน)
+    group ด้วย scan_hour ใน DB ไม่ต้องดึงทุกแถวมาแปลงเวลาใน Python
+    ส่งได้ทั้ง ScanRecord และ rollup ScanHourly (มีคอลัมน์ scan_hour / qty เหมือนกัน)
+    """
+    qty_by_hour = {h: 0 for h in range(24)}
+    for row in scans.order_by().values("scan_hour").annotate(total_qty=Sum("qty")):
+        qty_by_hour[row["scan_hour"]] = row["total_qty"] or 0
+    return qty_by_hour
+
+
+def _sort_scan_logs(rows, ordering):
+    """เรียง scan ที่รวมจากหลายตารางตาม ordering แบบ order_by (sort ทีละคีย์จากคีย์รอง)"""
+    for field in reversed(ordering):
+        rows.sort(key=attrgetter(field.lstrip("-")), reverse=field.startswith("-"))
+
+
+def _last_scan_date(lot):
+    """วันที่ (ท้องถิ่น) ล่าสุดที่ Lot มี scan อ่านจาก rollup ScanHourly"""
+    return ScanHourly.objects.filter(lot=lot).aggregate(d=Max("scan_date"))["d"]
+
+
+def _qty_by_date(rows):
+    """ยอด qty รายวัน {date: qty} จาก ScanHourly (หรือ ScanRecord) ที่ filter แล้ว"""
+    return {
+        row["scan_date"]: row["total_qty"] or 0
+        for row in rows.order_by().values("scan_date").annotate(total_qty=Sum("qty"))
+    }
+
+
+def _department_ids(dept):
+    """
+    id ของ Department ที่ตรงกับแผนกที่เลือก (ว่าง / Overall = ไม่ต้อง filter -> None)
+    จับคู่แบบ "มีคำนี้อยู่ในชื่อ" เหมือนเดิม (ไม่สนตัวพิมพ์/ช่องว่าง) กับตาราง Department (เล็ก) ครั้งเดียว
+    แล้วค่อย filter Lot / Machine / ScanRecord ด้วย dept_id__in (เทียบตัวเลข ใช้ index ได้)
+    """
+    if not dept or dept == "Overall":
+        return None
+    label = Department.normalize(LABELS.get(dept, dept))
+    return [
+        pk
+        for pk, code, name in Department.objects.values_list("id", "code", "name")
+        if label in Department.normalize(name) or label in Department.normalize(code)
+    ]
+
+
+def _machine_id(machine_no):
+    """id ของ Machine จากชื่อเครื่อง (ไม่สนตัวพิมพ์/ช่องว่าง) ไม่พบ = None"""
+    key = Machine.make_key(machine_no)
+    if not key:
+        return None
+    return Machine.objects.filter(key=key).values_list("id", flat=True).first()
+
+
+def _scans_of_machine(machine_no, model=ScanRecord):
+    """
+    ScanRecord (หรือ rollup ScanHourly ถ้าส่ง model มา) ของเครื่องนี้
+    filter ด้วย machine_id -> ใช้ index ที่ขึ้นต้นด้วย machine
+    """
+    machine_id = _machine_id(machine_no)
+    if machine_id is None:
+        return model.objects.none()
+    return model.objects.filter(machine_id=machine_id)
+
+
+def _filter_by_machine(qs, machine_no):
+    """Lot / ScanRecord / rollup ของเครื่องนี้ (filter ด้วย machine_id ไม่ join ตาราง Machine)"""
+    machine_id = _machine_id(machine_no)
+    if machine_id is None:
+        return qs.none()
+    return qs.filter(machine_id=machine_id)
+
+
+def _filter_by_scan_machine(qs, scan_machine):
+    """ScanRecord / ScanHourly ตามตัวเลือกเครื่องในหน้า lot_detail"""
+    if not scan_machine or scan_machine == "all":
+        return qs
+    if scan_machine == NO_MACHINE:
+        return qs.filter(machine__isnull=True)
+    return _filter_by_machine(qs, scan_machine)
+
+
+def _filter_scans_by_department(scans, dept_ids):
     """
-    เพิ่มฟิลด์ produced_qty ให้แต่ละ Lot ด้วย ORM
-    ใช้ sum ของ ScanRecord.qty เพื่อลด N+1 query
+    ScanRecord / ScanHourly ของ Lot ที่อยู่ในแผนก dept_ids (None = ไม่ filter)
+    scan อาจอยู่คนละ database กับ Lot (db_router.ScanStoreRouter) join lot__dept ไม่ได้
+    -> หา lot_id ของ scan ชุดนี้ก่อน (ของเครื่องเดียว / วันเดียว มีไม่กี่ Lot) แล้วเช็คแผนกที่ตาราง Lot
     """
-    return qs.annotate(produced_qty=Coalesce(Sum("scans__qty"), 0))
+    if dept_ids is None:
+        return scans
+    lot_ids = list(scans.order_by().values_list("lot_id", flat=True).distinct())
+    in_dept = Lot.objects.filter(id__in=lot_ids, dept_id__in=dept_ids).values_list("id", flat=True)
+    return scans.filter(lot_id__in=list(in_dept))
 
 
 def _build_lot_list(qs):
@@ -63,8 +202,6 @@ def _build_lot_list(qs):
     - lots: list สำหรับใช้ใน template
     - summary: dict ค่า waiting / in_progress / finished / total_lots
     """
-    qs = _annotate_lots(qs)
-
     lots = []
     waiting = 0
     in_progress = 0
@@ -111,7 +248,7 @@ def _build_lot_list(qs):
         )
 
     summary = {
-        "total_lots": qs.count(),
+        "total_lots": len(lots),
         "waiting": waiting,
         "in_progress": in_progress,
         "finished": finished,
@@ -119,19 +256,80 @@ def _build_lot_list(qs):
     return lots, summary
 
 
-def _build_type_counts(qs):
+def _build_type_totals(qs):
     """
-    นับจำนวน lot ตาม type ใช้แสดงกล่องด้านบนของ List View
-    qs ควรเป็น queryset หลัง filter แผนก / search แต่ก่อน filter status
+    จำนวน lot ตาม type (กล่องด้านบนของ List View) + ยอด target ตาม type (Order View)
+    นับทั้งหมดใน query เดียว (conditional aggregation) แทน count / Sum ทีละ type
+    qs ควรเป็น queryset หลัง filter แผนก / search แต่ก่อน filter type / status
+    คืนค่า (type_counts, qty_by_type)
     """
-    return {
-        "all": qs.count(),
-        "order": qs.filter(type__iexact="Order").count(),
-        "sample": qs.filter(type__iexact="Sample").count(),
-        "reserved": qs.filter(type__iexact="Reserved").count(),
-        "extra": qs.filter(type__iexact="Extra").count(),
-        "claim": qs.filter(type__iexact="Claim").count(),
-    }
+    aggregates = {"all": Count("id")}
+    for key, name in LOT_TYPES.items():
+        aggregates[key] = Count("id", filter=Q(type__iexact=name))
+        aggregates[f"{key}_target"] = Sum("target", filter=Q(type__iexact=name))
+    totals = qs.order_by().aggregate(**aggregates)
+
+    type_counts = {"all": totals["all"]}
+    qty_by_type = {}
+    for key, name in LOT_TYPES.items():
+        type_counts[key] = totals[key]
+        qty_by_type[name] = totals[f"{key}_target"] or 0
+    return type_counts, qty_by_type
+
+
+def _dashboard_lots(dept_ids, machine_no, q, lot_type):
+    """
+    ส่วนของ dashboard ที่ query ตาราง Lot (รันใน shard ปัจจุบัน ผ่าน fan_out)
+    คืนค่า (lots, summary, type_counts, overall_qty_by_type) ของ shard นี้
+    """
+    qs = Lot.objects.all()
+
+    # filter ตามแผนก (ภาพรวมไม่ filter เพิ่ม)
+    if dept_ids is not None:
+        qs = qs.filter(dept_id__in=dept_ids)
+
+    # filter ตามเครื่อง (ถ้ามาจาก machine_detail หรือ query)
+    if machine_no:
+        qs = _filter_by_machine(qs, machine_no)
+
+    # search
+    if q:
+        qs = qs.filter(
+            Q(lot_no__icontains=q)
+            | Q(part_no__icontains=q)
+            | Q(customer__icontains=q)
+        )
+
+    # เก็บ qs เดิมไว้ใช้สรุป count ด้านบน (ไม่โดน filter lot_type / status)
+    qs_for_counts = qs
+
+    # ---------- filter ตาม type จากปุ่มด้านบน ----------
+    if lot_type != "all":
+        t = LOT_TYPES.get(lot_type.lower())
+        if t:
+            qs = qs.filter(type__iexact=t)
+
+    lots, summary = _build_lot_list(qs)
+    type_counts, overall_qty_by_type = _build_type_totals(qs_for_counts)
+    return lots, summary, type_counts, overall_qty_by_type
+
+
+def _merge_lot_lists(parts, key=lambda lot: lot["lot_no"] or ""):
+    """รวม list ของ Lot จากหลาย shard แล้วเรียงใหม่ทั้งชุด (shard เดียว = ลำดับจาก database เดิม)"""
+    parts = list(parts)
+    if len(parts) == 1:
+        return parts[0]
+    return sorted((lot for part in parts for lot in part), key=key)
+
+
+def _merge_counts(parts):
+    """รวม dict ตัวเลขจากหลาย shard (key เดียวกันบวกกัน)"""
+    merged = {}
+    for part in parts:
+        for key, value in part.items():
+            merged[key] = merged.get(key, 0) + value
+    return merged
+
 
 # ---------- Auth ----------
 def login_page(request):
@@ -198,6 +396,7 @@ def view_select(request):
 
 
 @login_required
+@read_from_replica
 def dashboard(request):
     dept = request.GET.get("department", "Overall")
     view_type = request.GET.get("view", "list")  # list / machine / order / productivity
@@ -229,52 +428,20 @@ def dashboard(request):
 
     department_label = LABELS.get(dept, dept)
 
-    # ---------- ดึงข้อมูล Lot ----------
-    qs = Lot.objects.all()
-
-    # filter ตามแผนก
-    if dept == "Preform":
-        qs = qs.filter(department__icontains="พรีฟอร์ม")
-    elif dept == "Overall":
-        # ภาพรวมไม่ filter เพิ่ม
-        pass
-    else:
-        qs = qs.filter(department__icontains=department_label)
-
-    # filter ตามเครื่อง (ถ้ามาจาก machine_detail หรือ query)
-    if machine_no_filter:
-        qs = qs.filter(machine_no__iexact=machine_no_filter)
-
-    # search
+    # ---------- ดึงข้อมูล Lot (ทุก shard ของแผนกที่เลือก พร้อมกัน) ----------
+    dept_ids = _department_ids(dept)
     q = request.GET.get("q", "").strip()
-    if q:
-        qs = qs.filter(
-            Q(lot_no__icontains=q)
-            | Q(part_no__icontains=q)
-            | Q(customer__icontains=q)
-        )
-
-    # เก็บ qs เดิมไว้ใช้สรุป count ด้านบน (ไม่โดน filter lot_type / status)
-    qs_for_counts = qs
-
-    # ---------- filter ตาม type จากปุ่มด้านบน ----------
-    active_type = lot_type
-    if lot_type != "all":
-        type_map = {
-            "order": "Order",
-            "sample": "Sample",
-            "reserved": "Reserved",
-            "extra": "Extra",
-            "claim": "Claim",
-        }
-        t = type_map.get(lot_type.lower())
-        if t:
-            qs = qs.filter(type__iexact=t)
-
-    # ---------- สร้าง list lots + summary ----------
-    lots_all, summary = _build_lot_list(qs)
+    parts = fan_out(
+        lambda: _dashboard_lots(dept_ids, machine_no_filter, q, lot_type),
+        shards_for_departments(dept_ids),
+    )
+    lots_all = _merge_lot_lists(part[0] for part in parts)
+    summary = _merge_counts(part[1] for part in parts)
+    type_counts = _merge_counts(part[2] for part in parts)
+    overall_qty_by_type = _merge_counts(part[3] for part in parts)
 
     # ---------- filter ตามสถานะ (ใช้เฉพาะ List View) ----------
+    active_type = lot_type
     active_status = (
         status if status in ["all", "waiting", "in_progress", "finished"] else "all"
     )
@@ -291,9 +458,6 @@ def dashboard(request):
     else:
         lots = lots_all
 
-    # ---------- นับจำนวน lot ตาม type (สำหรับกล่องด้านบน) ----------
-    type_counts = _build_type_counts(qs_for_counts)
-
     # ---------- grouped_lots (ใช้กับ Order View แบบเดิม) ----------
     grouped_lots = {
         "Order": [], "Sample": [], "Reserved": [], "Extra": [], "Claim": [],
@@ -305,28 +469,6 @@ def dashboard(request):
         grouped_lots[t].append(lot)
 
     # ---------- สรุปยอดรวมแบบ Order Dashboard ----------
-    overall_qty_by_type = {
-        "Order": (
-            qs_for_counts.filter(type__iexact="Order")
-            .aggregate(s=Sum("target"))["s"] or 0
-        ),
-        "Sample": (
-            qs_for_counts.filter(type__iexact="Sample")
-            .aggregate(s=Sum("target"))["s"] or 0
-        ),
-        "Reserved": (
-            qs_for_counts.filter(type__iexact="Reserved")
-            .aggregate(s=Sum("target"))["s"] or 0
-        ),
-        "Extra": (
-            qs_for_counts.filter(type__iexact="Extra")
-            .aggregate(s=Sum("target"))["s"] or 0
-        ),
-        "Claim": (
-            qs_for_counts.filter(type__iexact="Claim")
-            .aggregate(s=Sum("target"))["s"] or 0
-        ),
-    }
     overall_total_target = sum(overall_qty_by_type.values())
 
     # ------------------------------------------------------
@@ -338,10 +480,8 @@ def dashboard(request):
     if view_type == "order":
         # 1) ดึงข้อมูล Machine เพื่อเอา machine_type มาทำ label
         machine_qs = Machine.objects.all()
-        if dept == "Preform":
-            machine_qs = machine_qs.filter(department__icontains="พรีฟอร์ม")
-        elif dept != "Overall":
-            machine_qs = machine_qs.filter(department__icontains=department_label)
+        if dept_ids is not None:
+            machine_qs = machine_qs.filter(dept_id__in=dept_ids)
 
         machine_info = {
             m.machine_no: (m.machine_name or "เครื่องจักร")
@@ -441,11 +581,10 @@ def dashboard(request):
                 info["status"] = "Ready"
 
         # 2) ดึงรายการเครื่องจากตาราง Machine แล้วเติมเครื่องที่ "ไม่มี lot" ให้ครบ
-        master_qs = Machine.objects.all()
-        if dept == "Preform":
-            master_qs = master_qs.filter(department__icontains="พรีฟอร์ม")
-        elif dept != "Overall":
-            master_qs = master_qs.filter(department__icontains=department_label)
+        #    (เฉพาะเครื่องใน Machine List ไม่รวมชื่อที่สร้างจาก scan เดิมตอน migrate)
+        master_qs = Machine.objects.filter(in_machine_list=True)
+        if dept_ids is not None:
+            master_qs = master_qs.filter(dept_id__in=dept_ids)
 
         for m in master_qs:
             m_no = m.machine_no or "-"
@@ -503,6 +642,7 @@ def dashboard(request):
 # ---------- Machine detail (ใช้ template list เดิม) ----------
 
 @login_required
+@route_request
 def machine_detail(request, machine_no):
     """
     หน้าแสดง log การสแกนของ 'วันนี้' สำหรับเครื่องหนึ่งเครื่อง
@@ -515,29 +655,17 @@ def machine_detail(request, machine_no):
 
     # วันนี้ (ตาม timezone ปัจจุบัน)
     today = timezone.localdate()
-    start_dt = timezone.make_aware(
-        datetime.combine(today, datetime.min.time())
-    )
-    end_dt = timezone.make_aware(
-        datetime.combine(today, datetime.max.time())
-    )
 
     # ---------- ดึง ScanRecord ของเครื่องนี้ในวันนี้ ----------
     scans_qs = (
-        ScanRecord.objects
-        .filter(
-            machine_no__iexact=machine_no,
-            scanned_at__range=(start_dt, end_dt),
-        )
-        .select_related("lot")
+        _scans_of_machine(machine_no)
+        .filter(scan_date=today)
+        .prefetch_related("lot")
         .order_by("scanned_at")
     )
 
     # filter ตามแผนก
-    if dept == "Preform":
-        scans_qs = scans_qs.filter(lot__department__icontains="พรีฟอร์ม")
-    elif dept != "Overall":
-        scans_qs = scans_qs.filter(lot__department__icontains=department_label)
+    scans_qs = _filter_scans_by_department(scans_qs, _department_ids(dept))
 
     # ---------- สรุป ----------
     total_today = scans_qs.aggregate(s=Sum("qty"))["s"] or 0
@@ -551,10 +679,7 @@ def machine_detail(request, machine_no):
 
     if active_lot:
         target = active_lot.target or active_lot.production_quantity or 0
-        produced = (
-            ScanRecord.objects.filter(lot=active_lot).aggregate(s=Sum("qty"))["s"]
-            or 0
-        )
+        produced = active_lot.produced_qty
         if target and produced >= target:
             status = "Finished"
         elif produced > 0:
@@ -609,12 +734,13 @@ def machine_detail(request, machine_no):
 # ---------- Lot detail + Chart ----------
 
 @login_required
+@route_request
 def lot_detail(request, lot_no):
     """
     หน้าแสดงรายละเอียด Lot + กราฟปริมาณการสแกน + ประวัติการสแกน
     - agg = hour/day/month ใช้กับกราฟ
     - scan_order = newest/oldest/qty_desc/qty_asc ใช้เรียงตารางประวัติ
-    - scan_machine = all หรือรหัสเครื่อง
+    - scan_machine = all / รหัสเครื่อง / NO_MACHINE (scan ที่ไม่ระบุเครื่อง)
     - scan_from / scan_to = YYYY-MM-DD ใช้กรองช่วงวันที่
     """
     from datetime import datetime, timedelta
@@ -692,11 +818,8 @@ def lot_detail(request, lot_no):
 
     lot = get_object_or_404(Lot, lot_no=lot_no)
 
-    # ------------------ ข้อมูล Scan ทั้งหมดของ Lot ------------------
-    scans_all = ScanRecord.objects.filter(lot=lot).order_by("scanned_at")
-
     # ถ้ายังไม่มีการสแกนเลย
-    if not scans_all.exists():
+    if not lot.scan_count:
         context = {
             "department":        dept_param,
             "department_label":  LABELS.get(dept_param, lot.department or dept_param),
@@ -715,6 +838,8 @@ def lot_detail(request, lot_no):
             "scan_from":         scan_from,
             "scan_to":           scan_to,
             "scan_machines":     [],
+            "has_unassigned_scans": False,
+            "no_machine":        NO_MACHINE,
             "back_view":         back_view,
             "back_url":          back_url,
             "back_label":        back_label,
@@ -722,15 +847,13 @@ def lot_detail(request, lot_no):
         return render(request, "production/lot_detail.html", context)
 
     # ------------------ สรุปด้านบน ------------------
-    produced = scans_all.aggregate(s=Sum("qty"))["s"] or 0   # ใช้ qty
+    produced = lot.produced_qty   # ยอดสะสม (อัปเดตทุกครั้งที่ scan)
     target = lot.target or lot.production_quantity or 0
     progress = round((produced / target) * 100, 1) if target > 0 else 0
-    boxes = scans_all.count()
+    boxes = lot.scan_count
 
-    # ------------------ queryset สำหรับกราฟ ------------------
-    scans_for_chart = scans_all
-    if scan_machine and scan_machine != "all":
-        scans_for_chart = scans_for_chart.filter(machine_no__iexact=scan_machine)
+    # ------------------ queryset สำหรับกราฟ (อ่านจาก rollup รายชั่วโมง) ------------------
+    hourly = _filter_by_scan_machine(ScanHourly.objects.filter(lot=lot), scan_machine)
 
     # filter ช่วงวันที่
     date_from = None
@@ -748,9 +871,9 @@ def lot_detail(request, lot_no):
             
 
     if date_from:
-        scans_for_chart = scans_for_chart.filter(scanned_at__date__gte=date_from)
+        hourly = hourly.filter(scan_date__gte=date_from)
     if date_to:
-        scans_for_chart = scans_for_chart.filter(scanned_at__date__lte=date_to)
+        hourly = hourly.filter(scan_date__lte=date_to)
 
     # ------------------ สร้างข้อมูลกราฟ ------------------
     chart_labels = []
@@ -768,15 +891,9 @@ def lot_detail(request, lot_no):
         if date_from:
             focus_date = date_from
         else:
-            focus_date = scans_all.latest("scanned_at").scanned_at.date()
-
-        scans_day = scans_for_chart.filter(scanned_at__date=focus_date)
+            focus_date = _last_scan_date(lot)
 
-        qty_by_hour = {h: 0 for h in range(24)}
-        for s in scans_day:
-            local_dt = timezone.localtime(s.scanned_at)
-            h = local_dt.hour
-            qty_by_hour[h] += s.qty or 0      # ใช้ qty
+        qty_by_hour = _qty_by_hour(hourly.filter(scan_date=focus_date))
 
         cumulative = 0
         for h in range(24):
@@ -790,25 +907,20 @@ def lot_detail(request, lot_no):
 
     elif agg == "day":
         # -------- รายวัน: label = "23 ม.ค." --------
-        first_scan_date = scans_for_chart.first().scanned_at.date()
-        last_scan_date = scans_for_chart.last().scanned_at.date()
+        qty_by_date = _qty_by_date(hourly)
 
-        start_date = date_from or first_scan_date
-        end_date = date_to or last_scan_date
+        start_date = date_from or min(qty_by_date, default=None)
+        end_date = date_to or max(qty_by_date, default=None)
 
-        days = (end_date - start_date).days
-        date_list = [start_date + timedelta(days=i) for i in range(days + 1)]
-
-        qty_by_date = {d: 0 for d in date_list}
-        for s in scans_for_chart:
-            d = timezone.localtime(s.scanned_at).date()
-            if d in qty_by_date:
-                qty_by_date[d] += s.qty or 0   # ใช้ qty
+        date_list = []
+        if start_date and end_date:
+            days = (end_date - start_date).days
+            date_list = [start_date + timedelta(days=i) for i in range(days + 1)]
 
         cumulative = 0
         for d in date_list:
             label = f"{d.day} {THAI_MONTH_ABBR[d.month]}"
-            qty = qty_by_date[d]
+            qty = qty_by_date.get(d, 0)
             cumulative += qty
 
             chart_labels.append(label)
@@ -817,33 +929,26 @@ def lot_detail(request, lot_no):
 
     else:
         # -------- รายเดือน: label = "ม.ค. 25" --------
-        first_scan = scans_for_chart.first().scanned_at
-        last_scan = scans_for_chart.last().scanned_at
-
-        year_month_start = (first_scan.year, first_scan.month)
-        year_month_end = (last_scan.year, last_scan.month)
+        qty_by_month = {}
+        for d, qty in _qty_by_date(hourly).items():
+            qty_by_month[(d.year, d.month)] = qty_by_month.get((d.year, d.month), 0) + qty
 
         ym_list = []
-        y, m = year_month_start
-        while (y, m) <= year_month_end:
-            ym_list.append((y, m))
-            if m == 12:
-                y += 1
-                m = 1
-            else:
-                m += 1
-
-        qty_by_month = {(y, m): 0 for (y, m) in ym_list}
-        for s in scans_for_chart:
-            dt = timezone.localtime(s.scanned_at)
-            key = (dt.year, dt.month)
-            if key in qty_by_month:
-                qty_by_month[key] += s.qty or 0   # ใช้ qty
+        if qty_by_month:
+            y, m = min(qty_by_month)
+            year_month_end = max(qty_by_month)
+            while (y, m) <= year_month_end:
+                ym_list.append((y, m))
+                if m == 12:
+                    y += 1
+                    m = 1
+                else:
+                    m += 1
 
         cumulative = 0
         for (y, m) in ym_list:
             label = f"{THAI_MONTH_ABBR[m]} {str(y)[2:]}"
-            qty = qty_by_month[(y, m)]
+            qty = qty_by_month.get((y, m), 0)
             cumulative += qty
 
             chart_labels.append(label)
@@ -851,30 +956,27 @@ def lot_detail(request, lot_no):
             chart_cumulative.append(cumulative)
 
     # ------------------ ตารางประวัติการสแกน ------------------
-    scan_logs_qs = scans_all
-    if scan_machine and scan_machine != "all":
-        scan_logs_qs = scan_logs_qs.filter(machine_no__iexact=scan_machine)
-    if date_from:
-        scan_logs_qs = scan_logs_qs.filter(scanned_at__date__gte=date_from)
-    if date_to:
-        scan_logs_qs = scan_logs_qs.filter(scanned_at__date__lte=date_to)
-
-    if scan_order == "oldest":
-        scan_logs_qs = scan_logs_qs.order_by("scanned_at")
-    elif scan_order == "qty_desc":
-        scan_logs_qs = scan_logs_qs.order_by("-qty", "-scanned_at")
-    elif scan_order == "qty_asc":
-        scan_logs_qs = scan_logs_qs.order_by("qty", "-scanned_at")
-    else:  # newest
-        scan_logs_qs = scan_logs_qs.order_by("-scanned_at")
-
-    scan_logs = list(scan_logs_qs)
-
-    scan_machines = (
-        scans_all.values_list("machine_no", flat=True)
-        .order_by()
-        .distinct()
+    # ScanRecord + ScanRecordArchive (เฉพาะ Lot ที่มี scan ถูกย้ายไป archive แล้ว)
+    ordering = SCAN_LOG_ORDERING.get(scan_order, SCAN_LOG_ORDERING["newest"])
+    scan_logs = []
+    scan_machine_ids = set()
+    for scan_logs_qs in archive.scans_of_lot(lot):
+        scan_machine_ids.update(
+            scan_logs_qs.values_list("machine_id", flat=True).order_by().distinct()
+        )
+        scan_logs_qs = _filter_by_scan_machine(scan_logs_qs, scan_machine)
+        if date_from:
+            scan_logs_qs = scan_logs_qs.filter(scanned_at__gte=_day_start(date_from))
+        if date_to:
+            scan_logs_qs = scan_logs_qs.filter(scanned_at__lt=_day_range(date_to)[1])
+        scan_logs.extend(scan_logs_qs.order_by(*ordering).prefetch_related("machine"))
+
+    if lot.has_archived_scans:
+        _sort_scan_logs(scan_logs, ordering)
+    scan_machines = sorted(
+        Machine.objects.filter(id__in=scan_machine_ids - {None}).values_list("machine_no", flat=True)
     )
+    has_unassigned_scans = None in scan_machine_ids
 
     # ------------------ render ------------------
     context = {
@@ -895,6 +997,8 @@ def lot_detail(request, lot_no):
         "scan_from":         scan_from,
         "scan_to":           scan_to,
         "scan_machines":     scan_machines,
+        "has_unassigned_scans": has_unassigned_scans,
+        "no_machine":        NO_MACHINE,
         "back_view":         back_view,
         "back_url":          back_url,
         "back_label":        back_label,
@@ -934,13 +1038,55 @@ def productivity_form(request):
     return render(request, "production/productivity_form.html", context)
 
 
+def _machine_daily(dept_ids, date_from=None, date_to=None):
+    """MachineDaily ของแผนก (ตามแผนกของ Lot) ในช่วง scan_date (ไม่ระบุ = ไม่จำกัด)"""
+    rows = MachineDaily.objects.order_by()
+    if dept_ids is not None:
+        rows = rows.filter(dept_id__in=dept_ids)
+    if date_from:
+        rows = rows.filter(scan_date__gte=date_from)
+    if date_to:
+        rows = rows.filter(scan_date__lte=date_to)
+    return rows
+
+
+def _machine_daily_totals(dept, date_from=None, date_to=None, machine_no=None):
+    """
+    ยอดต่อเครื่องต่อวันจาก MachineDaily [{"machine_id", "scan_date", "total_qty"}, ...]
+    ถามทุก shard ของแผนกพร้อมกัน แล้วรวมยอดของ (เครื่อง, วัน) เดียวกัน
+    """
+    dept_ids = _department_ids(dept)
+    machine_id = None
+    if machine_no:
+        machine_id = _machine_id(machine_no)
+        if machine_id is None:
+            return []
+
+    def load():
+        rows = _machine_daily(dept_ids, date_from, date_to)
+        if machine_id is not None:
+            rows = rows.filter(machine_id=machine_id)
+        return list(rows.values("machine_id", "scan_date").annotate(total_qty=Sum("qty")))
+
+    totals = {}
+    for part in fan_out(load, shards_for_departments(dept_ids)):
+        for row in part:
+            key = (row["machine_id"], row["scan_date"])
+            totals[key] = totals.get(key, 0) + (row["total_qty"] or 0)
+    return [
+        {"machine_id": machine, "scan_date": day, "total_qty": qty}
+        for (machine, day), qty in totals.items()
+    ]
+
+
 @login_required
+@read_from_replica
 def productivity_view(request):
     """
     Productivity Summary แบบรายเครื่อง + รายวัน
     เอาไอเดียมาจากหน้าเดิม (Netlify):
     - เลือกช่วงวันที่ (from / to)
-    - รวมยอดผลิตต่อเครื่อง (sum ScanRecord.qty)
+    - รวมยอดผลิตต่อเครื่อง (อ่านจาก rollup MachineDaily)
     - แสดงกราฟแท่ง + ตารางรายวัน + total
     """
 
@@ -970,50 +1116,36 @@ def productivity_view(request):
     days = (to_date - from_date).days
     date_list = [from_date + timedelta(days=i) for i in range(days + 1)]
 
-    # -------- 2) ดึง ScanRecord ในช่วงวันที่ + filter ตามแผนก --------
-    scans = ScanRecord.objects.all()
-
-    # filter ตามแผนก ใช้ department ของ Lot (เร็วและแม่นกว่า)
-    if dept == "Preform":
-        scans = scans.filter(lot__department__icontains="พรีฟอร์ม")
-    elif dept != "Overall":
-        scans = scans.filter(lot__department__icontains=department_label)
+    # -------- 2) ยอดต่อเครื่องต่อวันจาก MachineDaily (ช่วงวันที่ + แผนกของ Lot) --------
+    grouped = _machine_daily_totals(dept, from_date, to_date)
 
-    # filter ช่วงวันที่ (ใช้ส่วน date ของ scanned_at)
-    scans = scans.filter(
-        scanned_at__date__gte=from_date,
-        scanned_at__date__lte=to_date,
-    )
-
-    # -------- 3) รวมยอดต่อเครื่องต่อวันด้วย ORM --------
-    grouped = (
-        scans.annotate(day=TruncDate("scanned_at"))
-        .values("machine_no", "day")
-        .annotate(total_qty=Sum("qty"))
-    )
+    # ชื่อเครื่อง / ชื่อเรียกจากตาราง Machine (ตาม id ที่มีในช่วงนี้)
+    machine_info = {
+        pk: (no, name)
+        for pk, no, name in Machine.objects.filter(
+            id__in={row["machine_id"] for row in grouped}
+        ).values_list("id", "machine_no", "machine_name")
+    }
 
     # เก็บเป็น dict โดย key = machine_no
     machine_data = {}  # {"M308": {"daily": {date1: qty, ...}, "total": sum}}
     for row in grouped:
-        machine_no = row["machine_no"] or "-"
-        day = row["day"]
+        machine_no = machine_info.get(row["machine_id"], ("-", ""))[0]
+        day = row["scan_date"]
         qty = row["total_qty"] or 0
 
         info = machine_data.setdefault(
             machine_no,
             {"machine_no": machine_no, "daily": {}, "total": 0},
         )
-        info["daily"][day] = qty
+        # machine_no "-" (ไม่พบเครื่อง) อาจมาจากหลาย machine_id -> บวกสะสม
+        info["daily"][day] = info["daily"].get(day, 0) + qty
         info["total"] += qty
 
-    # -------- 4) ดึงชื่อเครื่องจากตาราง Machine (ถ้ามี) --------
+    # -------- 4) เตรียมแถวของแต่ละเครื่อง --------
     machine_rows = []
     if machine_data:
-        machine_names = dict(
-            Machine.objects.filter(machine_no__in=machine_data.keys()).values_list(
-                "machine_no", "machine_name"
-            )
-        )
+        machine_names = dict(machine_info.values())
 
         # สร้าง list สำหรับ template
         for m_no in sorted(machine_data.keys()):
@@ -1062,7 +1194,9 @@ def productivity_table(request):
 
 @login_required
 def scan(request):
-    return render(request, "production/scan.html")
+    # คิวออฟไลน์ในเบราว์เซอร์จำ Lot|UniqueID ที่สแกนแล้วไว้เท่าอายุ idempotency key
+    seen_ttl_ms = getattr(settings, "IDEMPOTENCY_KEY_TTL", 86400) * 1000
+    return render(request, "production/scan.html", {"seen_ttl_ms": seen_ttl_ms})
 
 
 # ==========================================
@@ -1181,41 +1315,87 @@ def _mock_if_empty():
             first_scan=now(),
             last_scan=now(),
         )
-        ScanRecord.objects.create(lot=lot, machine_no="MC-01", qty=250)
-        ScanRecord.objects.create(lot=lot, machine_no="MC-01", qty=300)
+        ScanRecord.objects.create(lot=lot, machine=lot.machine, qty=250)
+        ScanRecord.objects.create(lot=lot, machine=lot.machine, qty=300)
+        ingest.rebuild_lot_counters([lot.id])
+        rollups.rebuild_rollups([lot.id])
 
 
 # ==========================================
 # 2. ฟังก์ชัน API (วางทับ api ตัวเดิม)
 # ==========================================
+def _scan_retry_response(item, code, message):
+    """
+    scan ที่ยังไม่รู้ผล / บันทึกไม่สำเร็จ: ตอบ JSON รูปแบบเดียวกับ error อื่น (ไม่ใช่หน้า 500 ของ Django)
+    retry = ให้เครื่องสแกนส่งซ้ำ ถ้ามี Idempotency-Key ส่ง key เดิม -> ได้ผลเดิม ไม่นับซ้ำ
+    """
+    body = {"status": "error", "code": code, "message": message, "retry": True}
+    if item.get("idempotency_key"):
+        body["idempotency_key"] = item["idempotency_key"]
+    response = JsonResponse(body, status=503)
+    response["Retry-After"] = "1"
+    return response
+
+
+def _apply_device_machine(request, item):
+    """scan จากเครื่องที่ใช้ Device token และไม่ได้ระบุเครื่อง -> ใช้เครื่อง Default ของสถานีนั้น"""
+    device = getattr(request, "device", None)
+    if device is not None and device.machine_no and not item["machine_no"]:
+        item["machine_no"] = device.machine_no
+
+
 @csrf_exempt
 def api(request):
-    action = request.POST.get("action") or request.GET.get("action")
+    # รองรับ JSON body (ใช้กับ scan_batch)
+    payload = None
+    if request.content_type and "application/json" in request.content_type:
+        try:
+            payload = json.loads(request.body.decode("utf-8") or "{}")
+        except json.JSONDecodeError:
+            return JsonResponse({"status": "error", "message": "invalid JSON"}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({"status": "error", "message": "invalid JSON"}, status=400)
+
+    action = (
+        request.POST.get("action")
+        or request.GET.get("action")
+        or (payload or {}).get("action")
+    )
     if not action:
         return JsonResponse({"status": "error", "message": "Missing action"}, status=400)
 
     # --- API: ดึงรายการ Lot ตามแผนก (เพิ่มใหม่) ---
     if action == "get_lots_by_dept":
         dept_name = request.POST.get("department") or request.GET.get("department")
-        qs = Lot.objects.all()
-        
-        if dept_name:
-            qs = qs.filter(department__icontains=dept_name)
-            
-        # เอา Lot ล่าสุด 100 รายการ
-        qs = qs.order_by('-id')[:100]
-        
-        data = list(qs.values('lot_no', 'customer', 'part_no', 'production_quantity'))
+        dept_ids = _department_ids(dept_name)
+
+        def load():
+            qs = Lot.objects.all()
+            if dept_ids is not None:
+                qs = qs.filter(dept_id__in=dept_ids)
+            # เอา Lot ล่าสุด 100 รายการ
+            return list(
+                qs.order_by('-id')[:100]
+                .values('id', 'lot_no', 'customer', 'part_no', 'production_quantity')
+            )
+
+        # แยก shard: ล่าสุด 100 รายการของแต่ละ shard แล้วตัดรวมอีกครั้ง (id ของแต่ละ shard นับแยกกัน)
+        data = _merge_lot_lists(
+            fan_out(load, shards_for_departments(dept_ids)), key=lambda row: -row["id"]
+        )[:100]
+        for row in data:
+            del row["id"]
         return JsonResponse({"status": "success", "data": data})
     
     # === [NEW] API สำหรับ Operator Panel: ดึงรายละเอียด Lot จากการสแกน ===
     if action == "get_lot_details":
         lot_no = request.POST.get("lot_no") or request.GET.get("lot_no")
         try:
-            lot = Lot.objects.get(lot_no=lot_no)
+            with use_shard(shard_for_lot(lot_no or "")):
+                lot = Lot.objects.defer("remark").get(lot_no=lot_no)
             
-            # คำนวณยอดผลิตปัจจุบันไปด้วยเลย
-            produced = lot.scans.aggregate(s=Sum("qty"))["s"] or 0
+            # ยอดผลิตปัจจุบัน (เก็บสะสมไว้ใน Lot แล้ว ไม่ต้อง sum ใหม่)
+            produced = lot.produced_qty
             
             data = {
                 "id": lot.id,
@@ -1241,8 +1421,12 @@ def api(request):
     # --- API: Get Data for Dashboard (เดิม) ---
     if action == "getData":
         rows = []
-        for lot in Lot.objects.all().order_by("lot_no"):
-            produced = lot.scans.aggregate(s=Sum("qty"))["s"] or 0
+        lots = _merge_lot_lists(
+            fan_out(lambda: list(Lot.objects.order_by("lot_no")), shards_for_departments(None)),
+            key=lambda lot: lot.lot_no or "",
+        )
+        for lot in lots:
+            produced = lot.produced_qty
             progress = 0 if not lot.target else min(100, int(produced * 100 / lot.target))
             rows.append({
                 "lotNo": lot.lot_no,
@@ -1260,62 +1444,96 @@ def api(request):
 
     # --- API: Scan (เดิม) ---
     if action == "scan":
-        lot_no = request.POST.get("lot_no")
-        qty_str = request.POST.get("qty") or "0"
-        
-        # [แก้จุดที่ 1] รับค่า machine_no แต่ถ้าไม่มี ให้เป็น None ไว้ก่อน
-        machine_no = request.POST.get("machine_no") 
-
-        qr_code_full = request.POST.get("qr_code") 
-        
-        try:
-            qty = int(qty_str)
-        except ValueError:
-            qty = 0
-
+        started = time_mod.perf_counter()
+        # Idempotency-Key (header หรือ field) ใช้ตอบผลเดิมเมื่อเครื่องสแกน retry
+        with scan_metrics.timed("parse"):
+            item = ingest.normalize_item(request.POST, request.headers.get("Idempotency-Key"))
+            _apply_device_machine(request, item)
         try:
-            lot = Lot.objects.get(lot_no=lot_no)
-            
-            # [แก้จุดที่ 2] ถ้าหน้าเว็บไม่ได้ระบุเครื่องมา -> ให้ใช้เครื่อง Default ของ Lot นั้น
-            if not machine_no:
-                machine_no = lot.machine_no or "Unknown-Machine"
-
-            # ... (ส่วนเช็ค Unique ID เหมือนเดิม) ...
-            unique_id = None
-            if qr_code_full and "|" in qr_code_full:
-                parts = qr_code_full.split("|")
-                if len(parts) >= 3:
-                    unique_id = parts[2]
-
-            if unique_id:
-                is_duplicate = ScanRecord.objects.filter(lot=lot, sticker_unique_id=unique_id).exists()
-                if is_duplicate:
-                    return JsonResponse({"status": "error", "message": f"ซ้ำ! เบอร์ {unique_id} รับไปแล้ว"})
-
-            # บันทึก
-            ScanRecord.objects.create(
-                lot=lot, 
-                machine_no=machine_no, # ใช้ค่าที่หามาได้
-                qty=qty, 
-                scanned_at=timezone.now(),
-                sticker_unique_id=unique_id
+            # ถ้าเปิด SCAN_BUFFER_ENABLED จะรวบ commit เป็นกลุ่ม (ตอบกลับหลัง commit)
+            result = scan_buffer.submit_and_wait(item)
+        except FuturesTimeout:
+            # รอ flush ไม่ทัน แต่ scan ยังอยู่ในคิว อาจ commit ทีหลังได้
+            if item.get("idempotency_key"):
+                message = "Server ไม่ว่าง scan อาจบันทึกแล้ว ส่งซ้ำด้วย Idempotency-Key เดิมได้ (ไม่นับซ้ำ)"
+            else:
+                message = "Server ไม่ว่าง scan อาจบันทึกแล้ว กรุณาตรวจสอบประวัติก่อนสแกนซ้ำ"
+            return _scan_retry_response(item, "timeout", message)
+        except Exception:
+            # flush / insert ล้มเหลว (lock timeout, IntegrityError ที่ fallback ไม่ได้ ฯลฯ)
+            # transaction rollback แล้ว -> ส่งซ้ำได้
+            logger.exception("scan ingest failed (lot_no=%s)", item.get("lot_no"))
+            scan_metrics.incr("error")
+            return _scan_retry_response(item, "write_failed", "บันทึกไม่สำเร็จ กรุณาส่งซ้ำอีกครั้ง")
+        status_code = 404 if result.get("code") == "lot_not_found" else 200
+        scan_metrics.record("total", time_mod.perf_counter() - started)
+        return JsonResponse(result, status=status_code)
+
+    # --- API: Scan หลายรายการในครั้งเดียว (เครื่องสแกนปลายสาย) ---
+    if action == "scan_batch":
+        started = time_mod.perf_counter()
+        scans = (payload or {}).get("scans")
+        if scans is None:
+            try:
+                scans = json.loads(request.POST.get("scans") or "[]")
+            except json.JSONDecodeError:
+                return JsonResponse({"status": "error", "message": "invalid JSON"}, status=400)
+
+        if not isinstance(scans, list) or not all(isinstance(x, dict) for x in scans):
+            return JsonResponse({"status": "error", "message": "scans ต้องเป็น list ของ object"}, status=400)
+
+        max_items = getattr(settings, "SCAN_BATCH_MAX_ITEMS", 500)
+        if len(scans) > max_items:
+            return JsonResponse(
+                {"status": "error", "message": f"ส่งได้สูงสุด {max_items} รายการต่อครั้ง"},
+                status=400,
             )
-            
-            # ... (Update Lot stats เหมือนเดิม) ...
-            lot.last_scan = timezone.now()
-            if not lot.first_scan: lot.first_scan = timezone.now()
-            lot.save(update_fields=["last_scan", "first_scan"])
-
-            # [แถม] ส่งชื่อเครื่องกลับไปบอกหน้าเว็บด้วย
-            return JsonResponse({
-                "status": "success", 
-                "machine": machine_no,
-                "lot": lot.lot_no,
-                "qty": qty
-            })
 
-        except Lot.DoesNotExist:
-            return JsonResponse({"status": "error", "message": "ไม่พบ Lot นี้ในระบบ"}, status=404)
+        # ถ้าส่ง header Idempotency-Key มากับทั้ง batch -> ใช้เป็น key ของแต่ละรายการ (key:ลำดับ)
+        # รายการที่มี field idempotency_key ของตัวเองจะใช้ค่านั้นแทน
+        batch_key = request.headers.get("Idempotency-Key")
+        with scan_metrics.timed("parse"):
+            items = [
+                ingest.normalize_item(x, None if x.get("idempotency_key") or not batch_key else f"{batch_key}:{n}")
+                for n, x in enumerate(scans)
+            ]
+            for item in items:
+                _apply_device_machine(request, item)
+        results = ingest.ingest_scans(items)
+        accepted = sum(1 for r in results if r["status"] == "success")
+        scan_metrics.record("total_batch", time_mod.perf_counter() - started)
+        return JsonResponse({
+            "status": "success",
+            "accepted": accepted,
+            "rejected": len(results) - accepted,
+            "results": results,
+        })
+
+    return JsonResponse({"status": "error", "message": "Unknown action"}, status=400)
+
+
+@login_required
+@user_passes_test(_is_staff_or_admin)
+def scan_metrics_status(request):
+    """
+    เวลาแต่ละขั้นของการบันทึก Scan (p50/p95/p99 ย้อนหลัง SCAN_METRICS_WINDOW_MINUTES นาที)
+    ?scope=all -> รวมทุก process จากไฟล์ snapshot (ค่าอาจช้ากว่าจริงไม่เกิน SCAN_METRICS_SNAPSHOT_INTERVAL)
+    """
+    if request.GET.get("scope") == "all":
+        window = scan_metrics.window_minutes
+        return JsonResponse(summarize(read_snapshots(max_age=window * 60), window))
+    return JsonResponse(scan_metrics.summary())
+
+
+@login_required
+@user_passes_test(_is_staff_or_admin)
+def scan_buffer_status(request):
+    """สถานะ write-behind buffer ของ process นี้ (queue depth / เวลา flush)"""
+    buf = scan_buffer.get_buffer()
+    return JsonResponse({
+        "enabled": buf is not None,
+        "stats": buf.stats() if buf else None,
+    })
 
 
 # ---------- Dashboard shortcuts (Overall / Preform) ----------
@@ -1361,7 +1579,44 @@ def dashboard_preform_order(request):
     return redirect(f"{url}?department=Preform&view=order")
 
 
+def _append_machine_daily_sheet(wb, dept, machine_no, date_from, date_to):
+    """
+    เพิ่มชีท "Machine Daily": แถว = เครื่อง, คอลัมน์ = วันที่ (+ Total)
+    ไม่ระบุช่วงวันที่ = ช่วงที่มีข้อมูลจริงใน MachineDaily
+    """
+    grouped = _machine_daily_totals(dept, date_from or None, date_to or None, machine_no)
+    ws = wb.create_sheet("Machine Daily")
+    if not grouped:
+        ws.append(["ไม่มีข้อมูลในช่วงวันที่ที่เลือก"])
+        return
+
+    days = sorted({row["scan_date"] for row in grouped})
+    date_list = [days[0] + timedelta(days=i) for i in range((days[-1] - days[0]).days + 1)]
+
+    names = {
+        m.id: (m.machine_no or "-", m.machine_name or "-")
+        for m in Machine.objects.filter(id__in={row["machine_id"] for row in grouped})
+    }
+    machines = {}
+    for row in grouped:
+        key = names.get(row["machine_id"], ("-", "-"))
+        daily = machines.setdefault(key, {})
+        daily[row["scan_date"]] = daily.get(row["scan_date"], 0) + (row["total_qty"] or 0)
+
+    ws.append(["Machine", "Name"] + [d.strftime("%Y-%m-%d") for d in date_list] + ["Total"])
+    for (m_no, m_name), daily in sorted(machines.items()):
+        values = [daily.get(d, 0) for d in date_list]
+        ws.append([m_no, m_name] + values + [sum(values)])
+
+    totals = [sum(daily.get(d, 0) for daily in machines.values()) for d in date_list]
+    ws.append(["Total", ""] + totals + [sum(totals)])
+
+    for col in range(1, len(date_list) + 4):
+        ws.column_dimensions[get_column_letter(col)].width = 12
+
+
 @login_required
+@read_from_replica
 def export_productivity_excel(request):
     # 1) รับ filter (เหมือนหน้า Dashboard)
     dept = request.GET.get("department", "Overall")
@@ -1369,27 +1624,32 @@ def export_productivity_excel(request):
     date_from = request.GET.get("from", "")
     date_to = request.GET.get("to", "")
 
-    # 2) Query ข้อมูลพื้นฐาน
-    qs = Lot.objects.all()
+    # 2) Query ข้อมูลพื้นฐาน (ทุก shard ของแผนกพร้อมกัน)
+    dept_ids = _department_ids(dept)
 
-    # Filter แผนก
-    if dept == "Preform":
-        qs = qs.filter(department__icontains="พรีฟอร์ม")
-    elif dept != "Overall":
-        qs = qs.filter(department__icontains=LABELS.get(dept, dept))
+    def load():
+        qs = Lot.objects.all()
 
-    # Filter เครื่อง
-    if machine_no_filter:
-        qs = qs.filter(machine_no__iexact=machine_no_filter)
+        # Filter แผนก
+        if dept_ids is not None:
+            qs = qs.filter(dept_id__in=dept_ids)
 
-    # Filter วันที่
-    if date_from:
-        qs = qs.filter(last_scan__date__gte=date_from)
-    if date_to:
-        qs = qs.filter(last_scan__date__lte=date_to)
+        # Filter เครื่อง
+        if machine_no_filter:
+            qs = _filter_by_machine(qs, machine_no_filter)
+
+        # Filter วันที่
+        if date_from:
+            qs = qs.filter(last_scan__date__gte=date_from)
+        if date_to:
+            qs = qs.filter(last_scan__date__lte=date_to)
+
+        # ยอดผลิตใช้ produced_qty ที่เก็บสะสมไว้ใน Lot
+        return list(qs.order_by("lot_no"))
 
-    # Annotate ผลรวมการผลิต (ORM ลด Query)
-    qs = _annotate_lots(qs).order_by("lot_no")
+    qs = _merge_lot_lists(
+        fan_out(load, shards_for_departments(dept_ids)), key=lambda lot: lot.lot_no or ""
+    )
 
     # 3) สร้าง Excel Workbook
     wb = openpyxl.Workbook()
@@ -1455,7 +1715,10 @@ def export_productivity_excel(request):
     for col in range(1, len(headers) + 1):
         ws.column_dimensions[get_column_letter(col)].width = 16
 
-    # 6) ส่งกลับเป็นไฟล์ดาวน์โหลด
+    # 6) ชีทยอดรายเครื่อง x รายวัน (อ่านจาก MachineDaily เหมือนหน้า Productivity)
+    _append_machine_daily_sheet(wb, dept, machine_no_filter, date_from, date_to)
+
+    # 7) ส่งกลับเป็นไฟล์ดาวน์โหลด
     response = HttpResponse(
         content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     )
@@ -1467,6 +1730,7 @@ def export_productivity_excel(request):
 
 
 @login_required
+@pin_primary
 def import_excel(request):
     if request.method == "POST" and request.FILES.get("excel_file"):
         excel_file = request.FILES["excel_file"]
@@ -1497,15 +1761,21 @@ def import_excel(request):
                     if pd.isna(row.get("Machine No.")):
                         continue
 
+                    machine_no = str(row["Machine No."]).strip()
+                    # แผนกที่ยังไม่มีในตาราง Department -> สร้างให้ (เครื่องจะได้ผูก dept ตอน save)
+                    if not pd.isna(row.get("Department")):
+                        Department.for_name(row.get("Department"), create=True)
                     Machine.objects.update_or_create(
-                        machine_no=str(row["Machine No."]).strip(),
+                        key=Machine.make_key(machine_no),
                         defaults={
+                            "machine_no": machine_no,
                             "machine_name": str(
                                 row.get("Machine Name", "")
                             ).strip(),
                             "department": str(
                                 row.get("Department", "")
                             ).strip(),
+                            "in_machine_list": True,
                         },
                     )
                     count += 1
@@ -1532,35 +1802,39 @@ def import_excel(request):
                         or 0
                     )
 
-                    Lot.objects.update_or_create(
-                        lot_no=str(row["Lot No."]).strip(),
-                        defaults={
-                            "part_no": str(
-                                row.get("A.Best Part No.", "")
-                            ).strip(),
-                            "customer": str(row.get("Customer", "")).strip(),
-                            "description": str(
-                                row.get("Description", "")
-                            ).strip(),
-                            "customer_part_no": str(
-                                row.get("Customer Part No.", "")
-                            ).strip(),
-                            "po_no": str(row.get("PO No.", "")).strip(),
-                            "remark": str(row.get("Remark", "")).strip(),
-                            "production_quantity": prod_qty,
-                            "target": prod_qty,
-                            "pieces_per_box": pieces_per_box,
-                            "department": str(
-                                row.get("Department", "Overall")
-                            ).strip(),
-                            "machine_no": str(
-                                row.get("Machine No.", "")
-                            ).strip(),
-                            "type": str(row.get("Type", "Order")).strip(),
-                        },
-                    )
+                    lot_no = str(row["Lot No."]).strip()
+                    department = str(row.get("Department", "Overall")).strip()
+                    if "Department" in df.columns and not pd.isna(row.get("Department")):
+                        Department.for_name(department, create=True)
+                    with use_shard(shard_for_import(lot_no, department)):
+                        Lot.objects.update_or_create(
+                            lot_no=lot_no,
+                            defaults={
+                                "part_no": str(
+                                    row.get("A.Best Part No.", "")
+                                ).strip(),
+                                "customer": str(row.get("Customer", "")).strip(),
+                                "description": str(
+                                    row.get("Description", "")
+                                ).strip(),
+                                "customer_part_no": str(
+                                    row.get("Customer Part No.", "")
+                                ).strip(),
+                                "po_no": str(row.get("PO No.", "")).strip(),
+                                "remark": str(row.get("Remark", "")).strip(),
+                                "production_quantity": prod_qty,
+                                "target": prod_qty,
+                                "pieces_per_box": pieces_per_box,
+                                "department": department,
+                                "machine_no": str(
+                                    row.get("Machine No.", "")
+                                ).strip(),
+                                "type": str(row.get("Type", "Order")).strip(),
+                            },
+                        )
                     count += 1
 
+                lot_cache.clear()
                 messages.success(
                     request, f"นำเข้าแผนการผลิตสำเร็จ {count} รายการ"
                 )
@@ -1595,11 +1869,12 @@ class Command(BaseCommand):
         self.stdout.write(self.style.NOTICE(f"Loading workbook: {path}"))
         wb = openpyxl.load_workbook(path, data_only=True)
 
-        with transaction.atomic():
+        with transaction.atomic(), transaction.atomic(using=scan_db()):
             self._import_machines(wb)
             lot_map = self._import_lots(wb)
             self._import_collect(wb, lot_map)
 
+        lot_cache.clear()
         self.stdout.write(self.style.SUCCESS("Import completed."))
 
     # ------------------------ Machines ------------------------
@@ -1630,11 +1905,14 @@ class Command(BaseCommand):
             )
             department = row[idx.get("Department")] if "Department" in idx else ""
 
+            Department.for_name(department, create=True)
             Machine.objects.update_or_create(
-                machine_no=str(machine_no).strip(),
+                key=Machine.make_key(str(machine_no)),
                 defaults={
+                    "machine_no": str(machine_no).strip(),
                     "machine_name": str(machine_name or "").strip(),
                     "department": str(department or "").strip(),
+                    "in_machine_list": True,
                 },
             )
             count += 1
@@ -1697,23 +1975,27 @@ class Command(BaseCommand):
             except Exception:
                 target = prod_qty
 
-            lot, created = Lot.objects.update_or_create(
-                lot_no=str(lot_no).strip(),
-                defaults={
-                    "part_no": str(abest_part_no or "").strip(),
-                    "customer": str(customer or "").strip(),
-                    "description": str(description or "").strip(),
-                    "customer_part_no": str(customer_part_no or "").strip(),
-                    "po_no": str(po_no or "").strip(),
-                    "remark": str(remark or "").strip(),
-                    "production_quantity": prod_qty,
-                    "pieces_per_box": pieces_per_box,
-                    "target": target,
-                    "department": str(department or "").strip(),
-                    "machine_no": str(machine_no or "").strip(),
-                    "type": str(lot_type or "Order").strip(),
-                },
-            )
+            lot_no = str(lot_no).strip()
+            department = str(department or "").strip()
+            Department.for_name(department, create=True)
+            with use_shard(shard_for_import(lot_no, department)):
+                lot, created = Lot.objects.update_or_create(
+                    lot_no=lot_no,
+                    defaults={
+                        "part_no": str(abest_part_no or "").strip(),
+                        "customer": str(customer or "").strip(),
+                        "description": str(description or "").strip(),
+                        "customer_part_no": str(customer_part_no or "").strip(),
+                        "po_no": str(po_no or "").strip(),
+                        "remark": str(remark or "").strip(),
+                        "production_quantity": prod_qty,
+                        "pieces_per_box": pieces_per_box,
+                        "target": target,
+                        "department": department,
+                        "machine_no": str(machine_no or "").strip(),
+                        "type": str(lot_type or "Order").strip(),
+                    },
+                )
             lot_map[lot.lot_no] = lot
             count += 1
 
@@ -1732,6 +2014,7 @@ class Command(BaseCommand):
         idx = {name: i for i, name in enumerate(headers) if name}
 
         count = 0
+        lots = {}
         per_lot_first = {}
         per_lot_last = {}
 
@@ -1741,7 +2024,10 @@ class Command(BaseCommand):
                 continue
 
             lot_no = str(lot_no).strip()
-            lot = lot_map.get(lot_no) or Lot.objects.filter(lot_no=lot_no).first()
+            lot = lot_map.get(lot_no)
+            if not lot:
+                with use_shard(shard_for_lot(lot_no)):
+                    lot = Lot.objects.filter(lot_no=lot_no).first()
             if not lot:
                 # ถ้าไม่มี lot ใน Databased ข้ามไป
                 continue
@@ -1766,31 +2052,40 @@ class Command(BaseCommand):
 
             qty = lot.pieces_per_box or 0  # 1 scan = 1 กล่อง
 
-            scan, created = ScanRecord.objects.get_or_create(
-                lot=lot,
-                machine_no=str(machine_no or "").strip(),
-                scanned_at=scan_dt,
-                defaults={"qty": qty},
-            )
+            machine = Machine.for_machine_no(str(machine_no or ""))
+            with use_shard(lot._state.db):
+                scan, created = ScanRecord.objects.get_or_create(
+                    lot=lot,
+                    machine=machine,
+                    scanned_at=scan_dt,
+                    defaults={"qty": qty},
+                )
             if not created:
                 # ถ้าเคยมีอยู่แล้ว ไม่ต้องทำซ้ำ
                 continue
 
-            # เก็บ first/last scan per lot
-            per_lot_first[lot.pk] = min(
-                per_lot_first.get(lot.pk, scan_dt), scan_dt
+            # เก็บ first/last scan per lot (id ของ Lot ซ้ำกันได้ระหว่าง shard)
+            lots[lot._state.db, lot.pk] = lot
+            per_lot_first[lot._state.db, lot.pk] = min(
+                per_lot_first.get((lot._state.db, lot.pk), scan_dt), scan_dt
             )
-            per_lot_last[lot.pk] = max(
-                per_lot_last.get(lot.pk, scan_dt), scan_dt
+            per_lot_last[lot._state.db, lot.pk] = max(
+                per_lot_last.get((lot._state.db, lot.pk), scan_dt), scan_dt
             )
 
             count += 1
 
-        # อัปเดต first_scan / last_scan
-        for lot_id, lot in Lot.objects.in_bulk(per_lot_first.keys()).items():
-            lot.first_scan = per_lot_first.get(lot_id)
-            lot.last_scan = per_lot_last.get(lot_id)
-            lot.save(update_fields=["first_scan", "last_scan"])
+        # อัปเดต first_scan / last_scan ทีละ shard ของ Lot
+        for alias, lot_ids in group_by_shard(lots.values()).items():
+            with use_shard(alias):
+                for lot_id, lot in Lot.objects.in_bulk(lot_ids).items():
+                    lot.first_scan = per_lot_first.get((alias, lot_id))
+                    lot.last_scan = per_lot_last.get((alias, lot_id))
+                    lot.save(update_fields=["first_scan", "last_scan"])
+
+                # อัปเดตยอดสะสม produced_qty / scan_count + rollup กราฟ / Productivity ของ Lot ที่มี scan ใหม่
+                ingest.rebuild_lot_counters(lot_ids)
+                rollups.rebuild_rollups(lot_ids)
 
         self.stdout.write(
             self.style.SUCCESS(f"Imported {count} scan records from Collect.")
@@ -1798,6 +2093,7 @@ class Command(BaseCommand):
 
 
 @login_required
+@route_request
 def lot_chart_data(request, lot_no):
     """
     คืนค่า labels / daily / cumulative เป็น JSON สำหรับกราฟใน lot_detail
@@ -1816,9 +2112,11 @@ def lot_chart_data(request, lot_no):
 
     lot = get_object_or_404(Lot, lot_no=lot_no)
 
-    scans_all = ScanRecord.objects.filter(lot=lot).order_by("scanned_at")
+    # อ่านจาก rollup รายชั่วโมง (จำนวนแถว = จำนวนชั่วโมงที่มี scan ไม่ใช่จำนวน scan)
+    hourly = ScanHourly.objects.filter(lot=lot)
+    bounds = hourly.aggregate(first=Min("scan_date"), last=Max("scan_date"))
 
-    if not scans_all.exists():
+    if bounds["last"] is None:
         return JsonResponse(
             {"labels": [], "daily": [], "cumulative": [], "dates": [], "month_ranges": []}
         )
@@ -1843,20 +2141,9 @@ def lot_chart_data(request, lot_no):
 
     # ---------- hour ----------
     if agg == "hour":
-        if focus_date:
-            target_date = focus_date
-        else:
-            target_date = timezone.localtime(
-                scans_all.latest("scanned_at").scanned_at
-            ).date()
+        target_date = focus_date or bounds["last"]
 
-        scans_day = scans_all.filter(scanned_at__date=target_date)
-
-        qty_by_hour = {h: 0 for h in range(24)}
-        for s in scans_day:
-            local_dt = timezone.localtime(s.scanned_at)
-            h = local_dt.hour
-            qty_by_hour[h] += s.qty or 0
+        qty_by_hour = _qty_by_hour(hourly.filter(scan_date=target_date))
 
         for h in range(24):
             q = qty_by_hour[h]
@@ -1867,25 +2154,20 @@ def lot_chart_data(request, lot_no):
 
     # ---------- day ----------
     elif agg == "day":
-        first_date = timezone.localtime(scans_all.first().scanned_at).date()
-        last_date = timezone.localtime(scans_all.last().scanned_at).date()
-
-        start_date = date_from or first_date
-        end_date = date_to or last_date
+        start_date = date_from or bounds["first"]
+        end_date = date_to or bounds["last"]
         if end_date < start_date:
             end_date = start_date
 
         days = (end_date - start_date).days
         date_list = [start_date + timedelta(days=i) for i in range(days + 1)]
 
-        qty_by_date = {d: 0 for d in date_list}
-        for s in scans_all:
-            d = timezone.localtime(s.scanned_at).date()
-            if d in qty_by_date:
-                qty_by_date[d] += s.qty or 0
+        qty_by_date = _qty_by_date(
+            hourly.filter(scan_date__gte=start_date, scan_date__lte=end_date)
+        )
 
         for d in date_list:
-            q = qty_by_date[d]
+            q = qty_by_date.get(d, 0)
             running += q
             labels.append(f"{d.day} {MONTH_TH[d.month]}")
             daily.append(q)
@@ -1895,8 +2177,8 @@ def lot_chart_data(request, lot_no):
 
     # ---------- month ----------
     else:
-        first_dt = timezone.localtime(scans_all.first().scanned_at)
-        last_dt = timezone.localtime(scans_all.last().scanned_at)
+        first_dt = bounds["first"]
+        last_dt = bounds["last"]
 
         if date_from:
             first_dt = first_dt.replace(year=date_from.year, month=date_from.month, day=1)
@@ -1917,11 +2199,9 @@ def lot_chart_data(request, lot_no):
                 m += 1
 
         qty_by_month = {(y, m): 0 for (y, m) in ym_list}
-        for s in scans_all:
-            dt = timezone.localtime(s.scanned_at)
-            key = (dt.year, dt.month)
-            if key in qty_by_month:
-                qty_by_month[key] += s.qty or 0
+        for d, qty in _qty_by_date(hourly).items():
+            if (d.year, d.month) in qty_by_month:
+                qty_by_month[(d.year, d.month)] += qty
 
         for (y, m) in ym_list:
             q = qty_by_month[(y, m)]
@@ -2007,7 +2287,8 @@ def _kick_user_sessions(user_id: int):
         if data.get("_auth_user_id") == str(user_id):
             s.delete()
 
-@login_required
+@device_or_login_required
+@route_request
 def machine_mini_chart(request, machine_no):
     """
     คืนข้อมูลกราฟ mini chart ของแต่ละเครื่อง (รายชั่วโมงของวันนี้)
@@ -2015,29 +2296,10 @@ def machine_mini_chart(request, machine_no):
     """
     dept = request.GET.get("department", "Overall")
 
-    now = timezone.localtime(timezone.now())
-    start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    end_of_day = start_of_day.replace(hour=23, minute=59, second=59)
-
-    scans = ScanRecord.objects.filter(
-        machine_no__iexact=machine_no,
-        scanned_at__range=(start_of_day, end_of_day),
-    )
-
-    if dept != "Overall":
-        scans = scans.filter(lot__department__icontains=dept)
-
-    grouped = (
-        scans.annotate(h=TruncHour("scanned_at"))
-        .values("h")
-        .annotate(total_qty=Sum("qty"))
-        .order_by("h")
-    )
+    hourly = _scans_of_machine(machine_no, ScanHourly).filter(scan_date=timezone.localdate())
 
-    qty_by_hour = {h: 0 for h in range(24)}
-    for row in grouped:
-        h = timezone.localtime(row["h"]).hour
-        qty_by_hour[h] = row["total_qty"] or 0
+    hourly = _filter_scans_by_department(hourly, _department_ids(dept))
+    qty_by_hour = _qty_by_hour(hourly)
 
     labels = [f"{h:02d}:00" for h in range(24)]
     daily = [qty_by_hour[h] for h in range(24)]
@@ -2045,26 +2307,18 @@ def machine_mini_chart(request, machine_no):
     return JsonResponse({"labels": labels, "daily": daily})
 
 
-@login_required
+@device_or_login_required
+@route_request
 def machine_chart_data(request, machine_no):
     """
     คืนค่า JSON สรุปข้อมูลเครื่อง + กราฟยอดสแกนรายชั่วโมงของวันนี้
     ใช้กับการ์ดใน Machine View
     """
     today = timezone.localdate()
+    machine_scans = _scans_of_machine(machine_no)
 
-    scans_qs = ScanRecord.objects.filter(
-        machine_no__iexact=machine_no,
-        scanned_at__date=today,
-    ).order_by("scanned_at")
-
-    qty_by_hour = {h: 0 for h in range(24)}
-    latest_scan = None
-    for s in scans_qs:
-        local_dt = timezone.localtime(s.scanned_at)
-        h = local_dt.hour
-        qty_by_hour[h] += s.qty or 0
-        latest_scan = s
+    qty_by_hour = _qty_by_hour(_scans_of_machine(machine_no, ScanHourly).filter(scan_date=today))
+    latest_scan = machine_scans.filter(scan_date=today).order_by("scanned_at").last()
 
     labels = [f"{h:02d}:00" for h in range(24)]
     daily = [qty_by_hour[h] for h in range(24)]
@@ -2074,7 +2328,7 @@ def machine_chart_data(request, machine_no):
         lot = latest_scan.lot
     else:
         latest_scan_all = (
-            ScanRecord.objects.filter(machine_no__iexact=machine_no)
+            machine_scans
             .order_by("scanned_at")
             .last()
         )
@@ -2094,9 +2348,7 @@ def machine_chart_data(request, machine_no):
         part_no = lot.part_no or ""
         customer = lot.customer or ""
         target = lot.target or lot.production_quantity or 0
-        produced = (
-            ScanRecord.objects.filter(lot=lot).aggregate(s=Sum("qty"))["s"] or 0
-        )
+        produced = lot.produced_qty
 
     if latest_scan:
         last_scan_display = timezone.localtime(
@@ -2124,7 +2376,8 @@ def machine_chart_data(request, machine_no):
     }
     return JsonResponse(data)
 
-@login_required
+@device_or_login_required
+@route_request
 def machine_chart_data(request, machine_no):
     """
     คืนค่า JSON สรุปข้อมูลเครื่อง + กราฟยอดสแกนรายชั่วโมงของ
@@ -2132,9 +2385,9 @@ def machine_chart_data(request, machine_no):
     ใช้กับการ์ดใน Machine View
     """
     # หา log ล่าสุดของเครื่องนี้ก่อน
+    machine_scans = _scans_of_machine(machine_no)
     latest_scan_all = (
-        ScanRecord.objects
-        .filter(machine_no__iexact=machine_no)
+        machine_scans
         .order_by("scanned_at")
         .last()
     )
@@ -2155,25 +2408,12 @@ def machine_chart_data(request, machine_no):
         })
 
     # ใช้ "วันที่ของ log ล่าสุด" เป็นวันเป้าหมายของกราฟ
-    focus_date = timezone.localtime(latest_scan_all.scanned_at).date()
-
-    scans_qs = (
-        ScanRecord.objects
-        .filter(
-            machine_no__iexact=machine_no,
-            scanned_at__date=focus_date,
-        )
-        .order_by("scanned_at")
-    )
+    focus_date = latest_scan_all.scan_date
 
     # รวมจำนวนสแกนต่อชั่วโมง
-    qty_by_hour = {h: 0 for h in range(24)}
-    latest_scan = None
-    for s in scans_qs:
-        local_dt = timezone.localtime(s.scanned_at)
-        h = local_dt.hour
-        qty_by_hour[h] += s.qty or 0
-        latest_scan = s
+    qty_by_hour = _qty_by_hour(
+        _scans_of_machine(machine_no, ScanHourly).filter(scan_date=focus_date)
+    )
 
     labels = [f"{h:02d}:00" for h in range(24)]
     daily = [qty_by_hour[h] for h in range(24)]
@@ -2193,9 +2433,7 @@ def machine_chart_data(request, machine_no):
         part_no = lot.part_no or ""
         customer = lot.customer or ""
         target = lot.target or lot.production_quantity or 0
-        produced = (
-            ScanRecord.objects.filter(lot=lot).aggregate(s=Sum("qty"))["s"] or 0
-        )
+        produced = lot.produced_qty
 
     if latest_scan_all:
         last_scan_display = timezone.localtime(
@@ -2224,17 +2462,13 @@ def machine_chart_data(request, machine_no):
     }
     return JsonResponse(data)
 
-@login_required
+@device_or_login_required
+@route_request
 def machine_scan_logs_today(request, machine_no):
-    today = timezone.localdate()
-
     scans = (
-        ScanRecord.objects
-        .filter(
-            machine_no__iexact=machine_no,
-            scanned_at__date=today
-        )
-        .select_related("lot")
+        _scans_of_machine(machine_no)
+        .filter(scan_date=timezone.localdate())
+        .prefetch_related("lot")
         .order_by("-scanned_at")
     )
 
@@ -2279,9 +2513,13 @@ def oee_operator(request):
 
 # ====== Helper payloads ======
 
-def lot_status_payload(lot: Lot):
-    """ข้อมูลสถานะ LOT + flag ว่ามี BREAK ค้างอยู่ไหม + โหมดการทำงาน"""
-    break_open = lot.downtime_logs.filter(end_time__isnull=True).first()
+def _open_break(lot: Lot):
+    """BREAK ที่ยังไม่ปิดของ LOT (ไม่มี = None) ใช้ partial index downtime_open_lot_idx"""
+    return DowntimeLog.objects.filter(lot=lot, end_time__isnull=True).first()
+
+
+def lot_status_payload(lot: Lot, break_open):
+    """ข้อมูลสถานะ LOT + flag ว่ามี BREAK ค้างอยู่ไหม + โหมดการทำงาน (break_open จาก _open_break)"""
     return {
         "lot_no": lot.lot_no,
         "part_no": lot.part_no,
@@ -2299,35 +2537,39 @@ def lot_status_payload(lot: Lot):
 
 
 def lot_time_payload(lot: Lot):
-    """ข้อมูลเวลารวม / downtime / runtime + ค่า A (ทั้ง seconds และ minutes)"""
+    """
+    ข้อมูลเวลารวม / downtime / runtime + ค่า A (ทั้ง seconds และ minutes)
+    คำนวณแต่ละค่าครั้งเดียว (property ของ Lot อ่าน downtime_logs ใหม่ทุกครั้งที่เรียก)
+    """
+    total = lot.total_time_seconds
+    downtime = lot.total_downtime_seconds
+    runtime = max(0, total - downtime)
     return {
         # ใช้ seconds เป็นหลัก
-        "total_seconds": lot.total_time_seconds,
-        "downtime_seconds": lot.total_downtime_seconds,
-        "runtime_seconds": lot.runtime_seconds,
+        "total_seconds": total,
+        "downtime_seconds": downtime,
+        "runtime_seconds": runtime,
 
         # เผื่อที่ไหนยังใช้เป็นนาทีอยู่
-        "total_minutes": lot.total_time_minutes,
-        "downtime_minutes": lot.total_downtime_minutes,
-        "runtime_minutes": lot.runtime_minutes,
+        "total_minutes": total // 60,
+        "downtime_minutes": downtime // 60,
+        "runtime_minutes": runtime // 60,
 
         # ข้อความแสดงผล
-        "display_total_time": lot.display_total_time,
-        "display_downtime": lot.display_downtime,
-        "display_runtime": lot.display_runtime,
-        "availability_percent": lot.availability_percent,
+        "display_total_time": lot._format_seconds(total),
+        "display_downtime": lot._format_seconds(downtime),
+        "display_runtime": lot._format_seconds(runtime),
+        "availability_percent": round(runtime / total * 100, 1) if total else 0,
     }
 
 
-def lot_actions_payload(lot: Lot):
+def lot_actions_payload(lot: Lot, break_open):
     """
     บอกว่าแต่ละปุ่มกดได้ไหม
     - UI มี 3 ปุ่ม: START, BREAK/CONTINUE, END
     - backend ใช้ action 4 แบบ: start / break / resume / end
     (UI จะเลือกส่ง break หรือ resume ตาม has_open_break)
     """
-    break_open = lot.downtime_logs.filter(end_time__isnull=True).first()
-
     can_start = lot.start_time is None
     is_finished = lot.end_time is not None
 
@@ -2345,7 +2587,8 @@ def lot_actions_payload(lot: Lot):
 
 # ====== API: GET สถานะปัจจุบัน ======
 
-@login_required
+@device_or_login_required
+@route_request
 def oee_get_status(request):
     """API: ดึงสถานะปัจจุบันของ Lot ที่ระบุ (ใช้ตอนกดปุ่มโหลด LOT)"""
     lot_no = (request.GET.get("lot_no") or "").strip()
@@ -2353,19 +2596,22 @@ def oee_get_status(request):
         return JsonResponse({"ok": False, "error": "missing lot_no"}, status=400)
 
     lot = get_object_or_404(Lot, lot_no=lot_no)
+    open_break = _open_break(lot)
 
     return JsonResponse({
         "ok": True,
-        "lot": lot_status_payload(lot),
+        "lot": lot_status_payload(lot, open_break),
         "time": lot_time_payload(lot),
-        "actions": lot_actions_payload(lot),
+        "actions": lot_actions_payload(lot, open_break),
     })
 
 
 # ====== API: POST ทำ action (start / break / resume / end / set_mode) ======
 
-@login_required
+@device_or_login_required
 @require_POST
+@pin_primary
+@route_request
 def oee_do_action(request):
     """
     API: รับ action = start / break / resume / end / set_mode
@@ -2389,72 +2635,78 @@ def oee_do_action(request):
     if not lot_no:
         return JsonResponse({"ok": False, "error": "missing lot_no"}, status=400)
 
-    lot = get_object_or_404(Lot, lot_no=lot_no)
-    now = timezone.now()
-
     # --------- Action Logic ---------
-    if action == "start":
-        # เริ่มงานครั้งแรกเท่านั้น ถ้าเริ่มไปแล้วไม่ reset
-        if not lot.start_time:
-            lot.start_time = now
-            lot.end_time = None
-            lot.save(update_fields=["start_time", "end_time"])
-
-    elif action == "break":
-        # ต้องเคย START และยังไม่ END
-        if not lot.start_time:
-            return JsonResponse({"ok": False, "error": "ยังไม่ได้กด START"}, status=400)
-        if lot.end_time:
-            return JsonResponse({"ok": False, "error": "งานนี้จบไปแล้ว"}, status=400)
-
-        # ต้องไม่มี BREAK ค้างอยู่
-        open_break = lot.downtime_logs.filter(end_time__isnull=True).first()
-        if open_break:
-            return JsonResponse({"ok": False, "error": "มี BREAK ค้างอยู่แล้ว"}, status=400)
-
-        DowntimeLog.objects.create(
-            lot=lot,
-            start_time=now,
-            reason=payload.get("reason") or "",
-        )
+    # ตรวจสถานะ + เขียนใน transaction เดียว (SQLite: BEGIN IMMEDIATE จอง write lock ตั้งแต่ต้น
+    # กดซ้ำ / สองเครื่องกดพร้อมกันจะรอคิวกัน ไม่เกิด BREAK ซ้อน หรือ "database is locked")
+    # DowntimeLog อยู่ database ของ scan (ถ้าแยกไว้) -> เปิด transaction ของ database นั้นด้วย
+    # (แยก shard: Lot + DowntimeLog อยู่ shard เดียวกัน ที่ route_request เลือกไว้)
+    with transaction.atomic(using=router.db_for_write(Lot)), transaction.atomic(using=scan_db()):
+        lot = get_object_or_404(Lot, lot_no=lot_no)
+        now = timezone.now()
+        # ถามหา BREAK ค้างครั้งเดียว แล้วใช้ต่อทั้ง action และ response
+        open_break = _open_break(lot)
+
+        if action == "start":
+            # เริ่มงานครั้งแรกเท่านั้น ถ้าเริ่มไปแล้วไม่ reset
+            if not lot.start_time:
+                lot.start_time = now
+                lot.end_time = None
+                lot.save(update_fields=["start_time", "end_time"])
+
+        elif action == "break":
+            # ต้องเคย START และยังไม่ END
+            if not lot.start_time:
+                return JsonResponse({"ok": False, "error": "ยังไม่ได้กด START"}, status=400)
+            if lot.end_time:
+                return JsonResponse({"ok": False, "error": "งานนี้จบไปแล้ว"}, status=400)
+
+            # ต้องไม่มี BREAK ค้างอยู่
+            if open_break:
+                return JsonResponse({"ok": False, "error": "มี BREAK ค้างอยู่แล้ว"}, status=400)
+
+            open_break = DowntimeLog.objects.create(
+                lot=lot,
+                start_time=now,
+                reason=payload.get("reason") or "",
+            )
 
-    elif action == "resume":
-        open_break = lot.downtime_logs.filter(end_time__isnull=True).first()
-        if not open_break:
-            return JsonResponse({"ok": False, "error": "ไม่พบ BREAK ที่ค้างอยู่"}, status=400)
+        elif action == "resume":
+            if not open_break:
+                return JsonResponse({"ok": False, "error": "ไม่พบ BREAK ที่ค้างอยู่"}, status=400)
 
-        open_break.end_time = now
-        open_break.save(update_fields=["end_time"])
+            open_break.end_time = now
+            open_break.save(update_fields=["end_time"])
+            open_break = None
 
-    elif action == "end":
-        if not lot.start_time:
-            return JsonResponse({"ok": False, "error": "ยังไม่ได้กด START"}, status=400)
+        elif action == "end":
+            if not lot.start_time:
+                return JsonResponse({"ok": False, "error": "ยังไม่ได้กด START"}, status=400)
 
-        lot.end_time = now
-        lot.save(update_fields=["end_time"])
+            lot.end_time = now
+            lot.save(update_fields=["end_time"])
 
-        # ถ้ามี BREAK ค้างอยู่ให้ปิดด้วยเวลาเดียวกัน
-        open_break = lot.downtime_logs.filter(end_time__isnull=True).first()
-        if open_break:
-            open_break.end_time = now
-            open_break.save(update_fields=["end_time"])
+            # ถ้ามี BREAK ค้างอยู่ให้ปิดด้วยเวลาเดียวกัน
+            if open_break:
+                open_break.end_time = now
+                open_break.save(update_fields=["end_time"])
+                open_break = None
 
-    elif action == "set_mode":
-        # บันทึกโหมดการทำงานของ LOT (setup / production)
-        mode = (payload.get("mode") or "").strip().lower()
-        if mode not in (Lot.OEE_MODE_SETUP, Lot.OEE_MODE_PRODUCTION):
-            return JsonResponse({"ok": False, "error": "invalid mode"}, status=400)
-        lot.operation_mode = mode
-        lot.save(update_fields=["operation_mode"])
+        elif action == "set_mode":
+            # บันทึกโหมดการทำงานของ LOT (setup / production)
+            mode = (payload.get("mode") or "").strip().lower()
+            if mode not in (Lot.OEE_MODE_SETUP, Lot.OEE_MODE_PRODUCTION):
+                return JsonResponse({"ok": False, "error": "invalid mode"}, status=400)
+            lot.operation_mode = mode
+            lot.save(update_fields=["operation_mode"])
 
     # โหลดค่าล่าสุดจาก DB แล้วส่งกลับ
     lot.refresh_from_db()
 
     return JsonResponse({
         "ok": True,
-        "lot": lot_status_payload(lot),
+        "lot": lot_status_payload(lot, open_break),
         "time": lot_time_payload(lot),
-        "actions": lot_actions_payload(lot),
+        "actions": lot_actions_payload(lot, open_break),
     })
 
 @login_required
@@ -2532,6 +2784,11 @@ def _lot_daily_oee(lot, day_start, day_end):
     }
 
 
+def _machine_lot_key(lot):
+    """ลำดับ (machine_no, lot_no) ของรายงาน OEE ใช้เรียง Lot ที่รวมจากหลาย shard"""
+    return (lot.machine_no or "", lot.lot_no or "")
+
+
 def _format_hms(sec):
     """แปลงวินาทีเป็น string HH:MM:SS"""
     s = max(0, int(sec or 0))
@@ -2541,6 +2798,7 @@ def _format_hms(sec):
     return f"{h:02d}:{m:02d}:{r:02d}"
 
 @login_required
+@read_from_replica
 def oee_daily_report(request):
     """
     Daily OEE รายวัน 00:00–23:59:
@@ -2565,22 +2823,32 @@ def oee_daily_report(request):
 
     # 3) filter LOT ที่มีส่วนเกี่ยวข้องกับวันนั้น
     #    เงื่อนไข: start_time < day_end และ (end_time >= day_start หรือ end_time is null)
-    lots_qs = Lot.objects.filter(
-        start_time__lt=day_end
-    ).filter(
-        Q(end_time__gte=day_start) | Q(end_time__isnull=True)
-    ).select_related() \
-     .prefetch_related("downtime_logs") \
-     .order_by("machine_no", "lot_no")
-
-    # (option) filter เพิ่มตาม machine / department ถ้าต้องการ
+    #    แยกเป็น 2 กรณีให้แต่ละฝั่งใช้ index ของตัวเองได้:
+    #    - LOT ที่ยังไม่จบ -> lot_open_start_idx (partial: end_time IS NULL)
+    #    - LOT ที่จบแล้ว   -> lot_end_start_idx (end_time, start_time)
     machine_no = (request.GET.get("machine_no") or "").strip()
-    if machine_no:
-        lots_qs = lots_qs.filter(machine_no__iexact=machine_no)
-
     dept = request.GET.get("department", "").strip()
-    if dept:
-        lots_qs = lots_qs.filter(department__icontains=dept)
+    dept_ids = _department_ids(dept)
+
+    def load():
+        lots_qs = Lot.objects.filter(
+            Q(end_time__isnull=True, start_time__lt=day_end)
+            | Q(end_time__gte=day_start, start_time__lt=day_end)
+        ).select_related() \
+         .prefetch_related("downtime_logs") \
+         .order_by("machine_no", "lot_no")
+
+        # (option) filter เพิ่มตาม machine / department ถ้าต้องการ
+        if machine_no:
+            lots_qs = _filter_by_machine(lots_qs, machine_no)
+        if dept_ids is not None:
+            lots_qs = lots_qs.filter(dept_id__in=dept_ids)
+        return list(lots_qs)
+
+    # ทุก shard ของแผนกพร้อมกัน (prefetch downtime ภายใน shard ของ Lot)
+    lots_qs = _merge_lot_lists(
+        fan_out(load, shards_for_departments(dept_ids)), key=_machine_lot_key
+    )
 
     # 4) คำนวณราย LOT
     rows = []
@@ -2630,6 +2898,7 @@ def oee_daily_report(request):
     return render(request, "production/oee_daily_report.html", context)
 
 @login_required
+@read_from_replica
 def oee_daily_view(request):
     """
     หน้า OEE Daily:
@@ -2678,14 +2947,18 @@ def oee_daily_view(request):
 
     # ---------- เลือก LOT ที่เกี่ยวข้องกับวันนั้น ----------
     # เงื่อนไขง่าย ๆ: LOT ที่ start ก่อน day_end และ end หลัง day_start (หรือยังไม่ end)
-    lots_qs = (
-        Lot.objects.filter(
-            Q(start_time__lte=day_end),
-            Q(end_time__gte=day_start) | Q(end_time__isnull=True),
+    # (แยก 2 กรณีเหมือน oee_daily_report ให้ใช้ index ได้ + ดึง downtime ทุก LOT ใน query เดียว)
+    def load():
+        return list(
+            Lot.objects.filter(
+                Q(end_time__isnull=True, start_time__lte=day_end)
+                | Q(end_time__gte=day_start, start_time__lte=day_end)
+            )
+            .prefetch_related("downtime_logs")
+            .order_by("machine_no", "lot_no")
         )
-        .distinct()
-        .order_by("machine_no", "lot_no")
-    )
+
+    lots_qs = _merge_lot_lists(fan_out(load, shards_for_departments(None)), key=_machine_lot_key)
 
     rows = []
 